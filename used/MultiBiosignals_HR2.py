@@ -2,24 +2,34 @@ import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtWidgets
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
-from scipy.signal import iirnotch, filtfilt, butter, find_peaks, hilbert
 import csv
 import datetime
 from PyQt5.QtGui import QFont
-from scipy.fft import fft
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QListWidget
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import Qt
 import sys
+from stream_dsp import make_normalizer, resolve_mains
+from graph import vitals_graph
+from calibration import Calibration
+from acquisition import Acquisition, board_opener, close_board
+import settings
 
 # --- BrainFlow Setup ---
 params = BrainFlowInputParams()
 params.serial_port = '/dev/ttyUSB0'
+board_config = 'x1060100Xx2010000Xx3010000Xx4060000Xx5060000Xx6010000Xx7010000Xx8010000XxQ010000XxW010000X'
 board = BoardShim(BoardIds.CYTON_DAISY_BOARD.value, params)
 board.prepare_session()
-board.config_board('x1060100Xx2010000Xx3010000Xx4060000Xx5060000Xx6010000Xx7010000Xx8010000XxQ010000XxW010000X')
+board.config_board(board_config)
 board.start_stream()
 
+# Board I/O runs on the acquisition thread; the GUI only reads the ring buffer.
+# A stalled board is reopened there automatically (see settings.ACQ_STALL_S).
+acquisition = Acquisition(board, BoardIds.CYTON_DAISY_BOARD.value,
+                          reopen=board_opener(BoardIds.CYTON_DAISY_BOARD.value, params.serial_port, board_config))
+acquisition.start()
+
 # --- Channel Info ---
 eeg_channels = BoardShim.get_eeg_channels(BoardIds.CYTON_DAISY_BOARD.value)
 channel_names = {
@@ -118,7 +128,7 @@ stop_button = QtWidgets.QPushButton("Stop")
 start_logging_button = QtWidgets.QPushButton("Start Logging")
 stop_logging_button = QtWidgets.QPushButton("Stop Logging")
 fft_checkbox = QtWidgets.QCheckBox("Show FFT")
-notch_checkbox = QtWidgets.QCheckBox("60Hz Notch Filter")
+notch_checkbox = QtWidgets.QCheckBox("Mains Notch Filter")
 close_button = QtWidgets.QPushButton("HOME")
 restart_button = QtWidgets.QPushButton("Restart")
 control_layout.addWidget(restart_button)
@@ -135,7 +145,12 @@ right_column_layout.addLayout(control_layout)
 curves = {}
 buffer_size = 1200
 eeg_data_buffers = {}
-timer = QtCore.QTimer()
+display_normalizers = {}
+gui_calibration = None
+gui_graph = None  # raw -> notch -> window -> {plots, FFT}, notch -> band -> HR (graph.py)
+mains_hz = 60.0
+gui_reader = None
+plotting_active = False
 plots = {}  # Store separate plot widgets for each channel if needed
 selected_channels = []
 file_handle = None
@@ -146,51 +161,25 @@ current_hr_values = {'ECG': '--', 'PPG': '--', 'PCG': '--'}
 def update_hr_label():
     hr_label.setText(f"HR (ECG): {current_hr_values['ECG']} bpm | HR (PPG): {current_hr_values['PPG']} bpm | HR (PCG): {current_hr_values['PCG']} bpm")
 
-def bandpass_filter(sig, fs, low, high):
-    b, a = butter(2, [low / (fs/2), high / (fs/2)], btype='band')
-    return filtfilt(b, a, sig)
-
-def pan_tompkins_hr(ecg, fs):
-    def pipeline(x):
-        b, a = butter(1, [5/(0.5*fs), 15/(0.5*fs)], btype='band')
-        x = filtfilt(b, a, x)
-        x = np.convolve(x, np.array([1, 2, 0, -2, -1])/8, mode='same')
-        x = x ** 2
-        x = np.convolve(x, np.ones(int(0.15*fs))/int(0.15*fs), mode='same')
-        return x
-    out = pipeline(ecg)
-    peaks, _ = find_peaks(out, distance=int(0.2*fs), height=np.mean(out))
-    return int(60.0 / np.mean(np.diff(peaks) / fs)) if len(peaks) > 1 else '--'
-
 # Fungsi untuk restart koneksi ke OpenBCI
+# The acquisition thread releases and reopens the board and marks the gap
 def restart_connection():
-    global board
-    try:
-        print("🔁 Restarting OpenBCI connection...")
-        board.stop_stream()
-        board.release_session()
-    except Exception as e:
-        print("Warning during cleanup:", e)
-    
-    # Buat ulang board dan mulai stream
-    board = BoardShim(BoardIds.CYTON_DAISY_BOARD.value, params)
-    board.prepare_session()
-    board.config_board('x1060100Xx2010000Xx3010000Xx4060000Xx5060000Xx6010000Xx7010000Xx8010000XxQ010000XxW010000X')
-    board.start_stream()
-    print("✅ Connection restarted.")
-
-# Notch filter function
-def notch_filter(data, freq, fs, quality=30):
-    nyq = 0.5 * fs
-    freq = freq / nyq
-    b, a = iirnotch(freq, quality)
-    y = filtfilt(b, a, data)
-    return y
+    print("🔁 Restarting OpenBCI connection...")
+    acquisition.reconnect()
+
+# Mains frequency (50/60 Hz) from the data already streaming, detected once
+def detect_mains_frequency():
+    global mains_hz
+    fs = BoardShim.get_sampling_rate(BoardIds.CYTON_DAISY_BOARD.value)
+    _, data = acquisition.ring.latest(2 * fs)
+    mains_hz = resolve_mains(data[eeg_channels], fs)
+    notch_checkbox.setText(f"{mains_hz:g}Hz Notch Filter")
 
 # Function to close the app
 def close_app():
-    board.stop_stream()
-    board.release_session()
+    acquisition.stop()
+    if acquisition.board is not None:
+        close_board(acquisition.board)
     app.quit()
 
 # Variabel global untuk handle file
@@ -223,7 +212,7 @@ def start_logging():
         writer = csv.writer(file_handle)
         # Tulis header jika file baru
         if file_handle.tell() == 0:  # Cek apakah file kosong
-            writer.writerow(['Time'] + selected_channels)
+            writer.writerow(['Time'] + list(selected_channels))
         print(f"Logging started in {filename}")
     else:
         # Handle jika pengguna membatalkan dialog
@@ -242,50 +231,50 @@ def stop_logging():
 
 def update_plot():
     global eeg_data_buffers
-    data = board.get_board_data()
+    if gui_reader is None:
+        return
+    _, data = gui_reader.read()
+    if data.shape[1] == 0:
+        return
     fs = BoardShim.get_sampling_rate(BoardIds.CYTON_DAISY_BOARD.value)
 
-    for channel_name in selected_channels:
-        channel_index = channel_selector.findItems(channel_name, QtCore.Qt.MatchExactly)[0].data(QtCore.Qt.UserRole)
-        eeg_data = data[channel_index, -buffer_size:].flatten()
-        eeg_data_buffers[channel_name] = np.roll(eeg_data_buffers[channel_name], -len(eeg_data))
-        eeg_data_buffers[channel_name][-len(eeg_data):] = eeg_data
-
-        if notch_checkbox.isChecked():
-            eeg_data_buffers[channel_name] = notch_filter(eeg_data_buffers[channel_name], 60, fs)
+    # Raw values to physical units for all selected channels in one pass
+    new_data = gui_calibration.apply(data[list(selected_channels.values()), -buffer_size:])
+    # Notch (when checked) and the shift into the plot buffers run once per block
+    gui_graph.push(raw=new_data)
+    n_new = new_data.shape[1]
 
+    for i, channel_name in enumerate(selected_channels):
         if fft_checkbox.isChecked():
-            freq_data = np.abs(np.fft.fft(eeg_data_buffers[channel_name]))[:buffer_size // 2]
-            curves[channel_name].setData(freq_data)
+            curves[channel_name].setData(gui_graph.get("fft")[i])
         signal = eeg_data_buffers[channel_name]
+        # Sliding min/max scale, fed only with the new samples
+        normalizer = display_normalizers[channel_name]
         if channel_name == "PPG":
-            signal = -signal
-            signal = signal - np.min(signal)
-            signal = signal / np.max(signal)
+            normalizer.update(signal[-n_new:])
+            signal = normalizer.apply(signal)[0]
             signal = signal * 100
             curves[channel_name].setData(signal)
         elif channel_name in ["ECG", "PCG", "EMG1", "EMG2", "EEG11", "EEG12", "EEG13", "EEG14", "EEG15", "EEG16"]:
-            signal = signal - np.min(signal)
-            signal = signal / np.max(signal)
+            normalizer.update(signal[-n_new:])
+            signal = normalizer.apply(signal)[0]
             signal = signal * 100
             curves[channel_name].setData(signal)
         elif channel_name == "MYOMETER":    # Newton
-            signal = (signal - 109840)/30000
-            curves[channel_name].setData(signal) 
+            curves[channel_name].setData(signal)
         elif channel_name == "SPIRO":
-            signal = signal - 1100000
-            signal = 0.010698 * signal - 9.3359e-9 * signal**2
             curves[channel_name].setData(signal) # miliLiter/second
         elif channel_name == "TEMPERATURE":  # Celcius
-            signal = -signal
-            signal = signal - np.min(signal)
+            lo, _ = normalizer.update(signal[-n_new:])
+            signal = signal - lo[0]
             curves[channel_name].setData(signal)
         elif channel_name == "NIBP":    # mmHg
-            signal = signal - np.min(signal)
+            lo, _ = normalizer.update(signal[-n_new:])
+            signal = signal - lo[0]
             curves[channel_name].setData(signal)
         elif channel_name == "OXYGEN":    # %O2
-            signal = -signal
-            signal = signal - np.min(signal)
+            lo, _ = normalizer.update(signal[-n_new:])
+            signal = signal - lo[0]
             curves[channel_name].setData(signal)
         else:
             curves[channel_name].setData(eeg_data_buffers[channel_name])
@@ -303,54 +292,12 @@ def update_plot():
             writer.writerow(row)
 
 def update_hr():
-    fs = BoardShim.get_sampling_rate(BoardIds.CYTON_DAISY_BOARD.value)
-    
-    for name, buffer in eeg_data_buffers.items():
-        if len(buffer) < fs * 2:
-            current_hr_values[name] = '--'
-            continue
-
-        if name == "ECG":
-            try:
-                current_hr_values['ECG'] = pan_tompkins_hr(buffer, fs)
-            except:
-                current_hr_values['ECG'] = '--'
-
-        elif name == "PPG":
-            try:
-                f = bandpass_filter(buffer, fs, 0.5, 5)
-                norm_f = (f - np.mean(f)) / np.std(f)
-                peaks, _ = find_peaks(norm_f, distance=int(0.5 * fs), prominence=0.8)
-                if len(peaks) > 1:
-                    hr = 60.0 / np.mean(np.diff(peaks) / fs)
-                    current_hr_values['PPG'] = int(hr)
-                else:
-                    current_hr_values['PPG'] = '--'
-            except:
-                current_hr_values['PPG'] = '--'
-
-        elif name == "PCG":
-            try:
-                # Bandpass dulu untuk S1-S2 range
-                f = bandpass_filter(buffer, fs, 20, 45)
-
-                # Ambil envelope menggunakan Hilbert
-                analytic = hilbert(f)
-                envelope = np.abs(analytic)
-
-                # Normalisasi envelope
-                norm_env = (envelope - np.mean(envelope)) / np.std(envelope)
-
-                # Cari puncak di envelope (deteksi S1)
-                peaks, _ = find_peaks(norm_env, distance=int(0.6 * fs), prominence=1.0)
-
-                if len(peaks) > 1:
-                    hr = 60.0 / np.mean(np.diff(peaks) / fs)
-                    current_hr_values['PCG'] = int(hr)
-                else:
-                    current_hr_values['PCG'] = '--'
-            except:
-                current_hr_values['PCG'] = '--'
+    # HR nodes of the graph: evaluated at most once per block, on the notched signal
+    if gui_graph is None:
+        return
+    for name in current_hr_values:
+        if f"hr/{name}" in gui_graph.nodes:
+            current_hr_values[name] = gui_graph.get(f"hr/{name}")
 
     update_hr_label()
 
@@ -358,6 +305,17 @@ def update_hr():
 hr_timer = QtCore.QTimer()
 hr_timer.timeout.connect(update_hr)            
 
+# Redraws are paced by a frame timer (20 ms, as before the acquisition
+# thread) and skipped when the ring has no new samples since the last one
+REDRAW_MS = 20
+
+def on_frame():
+    if plotting_active and gui_reader is not None and gui_reader.pending():
+        update_plot()
+
+plot_timer = QtCore.QTimer()
+plot_timer.timeout.connect(on_frame)
+
 def update_plot_layout():
     global selected_channels, curves, plot_area
     num_channels = len(selected_channels)
@@ -375,29 +333,46 @@ def update_plot_layout():
 
 # Update selected channels and layout when selection changes
 def update_selected_channels():
-    global selected_channels, curves, eeg_data_buffers
+    global selected_channels, curves, eeg_data_buffers, display_normalizers, gui_calibration, gui_graph
 #asli    selected_channels = [item.text() for item in channel_selector.selectedItems()]
     selected_channels = {
     item.text(): item.data(QtCore.Qt.UserRole)
     for item in channel_selector.selectedItems()
 }
-    eeg_data_buffers = {channel: np.zeros(buffer_size) for channel in selected_channels}
+    fs = BoardShim.get_sampling_rate(BoardIds.CYTON_DAISY_BOARD.value)
+    display_normalizers = {channel: make_normalizer(1, fs) for channel in selected_channels}
+    gui_calibration = Calibration(list(selected_channels), list(selected_channels.values()), config=board_config)
+    gui_graph = vitals_graph(list(selected_channels), fs, mains_hz, window_s=buffer_size / fs,
+                             hr=("ECG", "PPG", "PCG"), notch=notch_checkbox.isChecked,
+                             dtype=settings.SAMPLE_DTYPE)
+    # Plot buffers are rows of the graph's window, shifted in place every block
+    window = gui_graph.stage("window").buf
+    eeg_data_buffers = {channel: window[i] for i, channel in enumerate(selected_channels)}
+    gui_graph.derive("fft", lambda _: np.abs(np.fft.rfft(window, axis=1))[:, :buffer_size // 2], "window")
     update_plot_layout()
 
 def start_all():
+    global gui_reader, plotting_active
+    detect_mains_frequency()
     update_selected_channels()
+    gui_reader = acquisition.reader(backlog=buffer_size)
     update_plot()
-    timer.start(20)
+    plotting_active = True
+    plot_timer.start(REDRAW_MS)
     hr_timer.start(1000)
 
+def stop_plotting():
+    global plotting_active
+    plotting_active = False
+    plot_timer.stop()
+
 
 # Connect buttons to functions
 channel_selector.itemSelectionChanged.connect(update_selected_channels)
 start_logging_button.clicked.connect(start_logging)
 stop_logging_button.clicked.connect(stop_logging)
 start_button.clicked.connect(start_all)
-stop_button.clicked.connect(timer.stop)
-timer.timeout.connect(update_plot)
+stop_button.clicked.connect(stop_plotting)
 close_button.clicked.connect(close_app)
 restart_button.clicked.connect(restart_connection)
 
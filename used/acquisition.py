@@ -0,0 +1,459 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowError, BrainFlowInputParams
+
+import settings
+from annotations import AnnotationTrack
+
+# Acquisition layer: one thread owns the BrainFlow board and copies new
+# samples into a preallocated ring buffer. Everything else (WebSocket
+# handlers, DSP tasks, the GUI) reads from the ring through a RingReader,
+# so blocking board I/O never runs on the event loop or the Qt thread.
+# Given a `reopen` function, the thread also treats ACQ_STALL_S without
+# samples as a lost board: it releases it and reopens (prepare, config,
+# start) with exponential backoff while readers stay attached. The gap is
+# put on the annotation track ("board_lost", then "gap" with its duration
+# and the recovery time).
+# With `idle`, consumers that need live samples subscribe; once nobody has
+# for ACQ_IDLE_GRACE_S the thread stops the board stream (the session stays
+# prepared) and blocks without wakeups until the next subscriber. The
+# parked stretch goes on the track as "idle" with its duration.
+
+
+# --- Ring buffer ---
+class RingBuffer:
+    """Fixed-size (rows x capacity) sample ring with a running sequence number.
+
+    `seq` is the number of samples written so far; sample k (absolute) lives
+    in column k % capacity while k >= seq - capacity. Samples are stored in
+    settings.SAMPLE_DTYPE; the timestamp row is also kept at float64 in
+    `times`, since float32 cannot hold a Unix time to the sample.
+    """
+
+    def __init__(self, n_rows, capacity, timestamp_row=None, dtype=None):
+        self.dtype = np.dtype(settings.SAMPLE_DTYPE if dtype is None else dtype)
+        self.data = np.zeros((n_rows, capacity), dtype=self.dtype)
+        self.times = np.zeros(capacity)
+        self.capacity = capacity
+        self.timestamp_row = timestamp_row
+        self.seq = 0
+        self.cond = threading.Condition()
+        self._waiters = set()     # (loop, asyncio.Event) of async readers
+
+    def write(self, block):
+        n = block.shape[1]
+        if n == 0:
+            return
+        if n > self.capacity:
+            block = block[:, -self.capacity:]
+            skipped, n = n - self.capacity, self.capacity
+        else:
+            skipped = 0
+        with self.cond:
+            start = (self.seq + skipped) % self.capacity
+            end = start + n
+            # Slice assignment casts to the ring dtype without a temporary
+            if end <= self.capacity:
+                self.data[:, start:end] = block
+            else:
+                first = self.capacity - start
+                self.data[:, start:] = block[:, :first]
+                self.data[:, :n - first] = block[:, first:]
+            if self.timestamp_row is not None:
+                ts = block[self.timestamp_row]
+                if end <= self.capacity:
+                    self.times[start:end] = ts
+                else:
+                    self.times[start:] = ts[:first]
+                    self.times[:n - first] = ts[first:]
+            self.seq += skipped + n
+            self.cond.notify_all()
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def oldest(self):
+        return max(0, self.seq - self.capacity)
+
+    def _copy(self, buf, start, stop):
+        stop = self.seq if stop is None else min(stop, self.seq)
+        start = max(start, self.oldest())
+        n = max(0, stop - start)
+        i = start % self.capacity
+        if i + n <= self.capacity:
+            return start, buf[..., i:i + n].copy()
+        first = self.capacity - i
+        return start, np.concatenate((buf[..., i:], buf[..., :n - first]), axis=-1)
+
+    def read(self, start, stop=None):
+        """Copy of samples [start, stop) clamped to what the ring still holds."""
+        with self.cond:
+            return self._copy(self.data, start, stop)
+
+    def read_times(self, start, stop=None):
+        """float64 timestamps of samples [start, stop), clamped like read()."""
+        with self.cond:
+            return self._copy(self.times, start, stop)
+
+    def latest(self, n):
+        return self.read(self.seq - n)
+
+    def timestamp(self, seq):
+        if self.timestamp_row is None or seq < self.oldest() or seq >= self.seq:
+            return None
+        return float(self.times[seq % self.capacity])
+
+    def add_waiter(self, token):
+        with self.cond:
+            self._waiters.add(token)
+
+    def remove_waiter(self, token):
+        with self.cond:
+            self._waiters.discard(token)
+
+
+class RingReader:
+    """Per-consumer cursor into a RingBuffer."""
+
+    def __init__(self, ring, backlog=0):
+        self.ring = ring
+        self.seq = max(ring.oldest(), ring.seq - backlog)
+        self.overruns = 0
+
+    def pending(self):
+        return self.ring.seq - max(self.seq, self.ring.oldest())
+
+    def oldest_timestamp(self):
+        return self.ring.timestamp(max(self.seq, self.ring.oldest()))
+
+    def read(self, max_n=None):
+        """(seq, block) of the unread samples; block may have zero columns."""
+        stop = None if max_n is None else self.seq + max_n
+        start, block = self.ring.read(self.seq, stop)
+        if start > self.seq:
+            self.overruns += 1
+        self.seq = start + block.shape[1]
+        return start, block
+
+    def wait(self, timeout=None):
+        """Block the calling thread until new samples arrive."""
+        with self.ring.cond:
+            return self.ring.cond.wait_for(lambda: self.ring.seq > self.seq, timeout)
+
+    async def wait_async(self, timeout=None):
+        """Wait on the event loop until new samples arrive (no polling)."""
+        if self.pending():
+            return True
+        token = (asyncio.get_running_loop(), asyncio.Event())
+        self.ring.add_waiter(token)
+        try:
+            if self.pending():
+                return True
+            await asyncio.wait_for(token[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.ring.remove_waiter(token)
+
+
+# --- Subscribers ---
+class Demand:
+    """Subscriber count of an idle-aware producer thread."""
+
+    def __init__(self, grace_s=None):
+        self.grace_s = settings.ACQ_IDLE_GRACE_S if grace_s is None else grace_s
+        self.count = 0
+        self._lock = threading.Lock()
+        self._event = threading.Event()   # set while anybody subscribes
+        self._since = time.monotonic()
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+            self._event.set()
+
+    def remove(self):
+        with self._lock:
+            self.count = max(0, self.count - 1)
+            if not self.count:
+                self._event.clear()
+                self._since = time.monotonic()
+
+    def idle(self):
+        """Nobody subscribed for the last grace_s seconds."""
+        return not self._event.is_set() and time.monotonic() - self._since > self.grace_s
+
+    def wait(self):
+        self._event.wait()
+
+    def wake(self):
+        # Releases a parked thread on shutdown
+        self._event.set()
+
+
+# --- Board sessions ---
+def open_board(board_id, params, config=None):
+    """BoardShim with a prepared session, optional config and a running stream."""
+    board = BoardShim(board_id, params)
+    board.prepare_session()
+    if config:
+        board.config_board(config)
+        time.sleep(0.5)
+    board.start_stream()
+    return board
+
+
+def close_board(board):
+    for step in (board.stop_stream, board.release_session):
+        try:
+            step()
+        except (BrainFlowError, OSError) as e:
+            print(f"⚠️ {step.__name__} error:", e)
+
+
+def board_opener(board_id, serial_port, config=None):
+    """reopen function for Acquisition: a fresh session on the same port."""
+    def reopen():
+        params = BrainFlowInputParams()
+        params.serial_port = serial_port
+        return open_board(board_id, params, config)
+    return reopen
+
+
+# --- Acquisition thread ---
+class Acquisition:
+    def __init__(self, board, board_id, capacity_s=None, poll_s=None, reopen=None, idle=False):
+        capacity_s = settings.ACQ_RING_S if capacity_s is None else capacity_s
+        self.board = board
+        self.reopen = reopen
+        self.idle = idle
+        self.fs = BoardShim.get_sampling_rate(board_id)
+        self.poll_s = settings.ACQ_POLL_S if poll_s is None else poll_s
+        self.ring = RingBuffer(
+            BoardShim.get_num_rows(board_id),
+            int(capacity_s * self.fs),
+            BoardShim.get_timestamp_channel(board_id),
+        )
+        self.errors = 0
+        self.last_data = None
+        self.annotations = AnnotationTrack()
+        self._failing = False
+        self._heard = None        # monotonic time of the last data (or (re)open)
+        self._lost = None         # (monotonic, seq, last timestamp) when the board was lost
+        self._retry_at = None
+        self._backoff = settings.RECONNECT_MIN_S
+        self._attempts = 0
+        self._force_reconnect = False
+        self.reconnects = 0
+        self.last_recovery_s = None
+        self.demand = Demand()
+        self.stream_started = None  # monotonic time the stream last (re)started
+        self.parked = False
+        self.parked_s = 0.0         # total time parked
+        self.idle_cpu = None        # process CPU share (%) during the last parked stretch
+        self.polls = 0
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._heard = self.stream_started = time.monotonic()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="acquisition", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self.demand.wake()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def subscribe(self):
+        """A consumer needs live samples (stream client, recorder): stream while any do."""
+        self.demand.add()
+
+    def unsubscribe(self):
+        self.demand.remove()
+
+    def reconnect(self):
+        """Drop the board and reopen it from the acquisition thread (needs `reopen`).
+
+        Ignored while already reconnecting.
+        """
+        if self._lost is None:
+            self._force_reconnect = True
+
+    def gaps(self, seq, n):
+        """"gap" events at samples [seq, seq + n): frames carry them to clients."""
+        return self.annotations.range(seq, seq + n, kind="gap")
+
+    @property
+    def connected(self):
+        return self._lost is None
+
+    def annotate(self, kind, text=None, seq=None, **data):
+        """Add an event at sample `seq` (default: the next sample to arrive)."""
+        ring = self.ring
+        seq = ring.seq if seq is None else seq
+        t = ring.timestamp(seq)
+        if t is None:
+            last = ring.timestamp(ring.seq - 1)
+            t = time.time() if last is None else last + (seq - ring.seq + 1) / self.fs
+        return self.annotations.add(kind, seq, t, text, **data)
+
+    def reader(self, backlog=0):
+        return RingReader(self.ring, backlog)
+
+    def _lose(self, now):
+        seq = self.ring.seq
+        self._lost = (now, seq, self.ring.timestamp(seq - 1))
+        self._retry_at = now
+        self._backoff = settings.RECONNECT_MIN_S
+        self._attempts = 0
+        print("⚠️ Board lost, reconnecting...")
+        self.annotate("board_lost", seq=seq)
+        self._drop()
+
+    def _drop(self):
+        if self.board is None:
+            return
+        close_board(self.board)
+        # Drop the old BoardShim before opening a new one: its __del__ would
+        # release whichever session has the same board id and params
+        self.board = None
+
+    def _retry_later(self, now):
+        self._retry_at = now + self._backoff
+        self._backoff = min(2 * self._backoff, settings.RECONNECT_MAX_S)
+
+    def _try_reopen(self, now):
+        self._attempts += 1
+        try:
+            self.board = self.reopen()
+            self._retry_at = None
+            self._heard = self.stream_started = time.monotonic()
+            print(f"🔁 Board reopened (attempt {self._attempts})")
+        except (BrainFlowError, OSError) as e:
+            print(f"🚨 Reconnect attempt {self._attempts} failed:", e)
+            self._retry_later(now)
+
+    def _recovered(self, n):
+        # First samples after a reconnect: mark the gap they close
+        lost_at, seq, t_before = self._lost
+        self._lost = None
+        recovery = time.monotonic() - lost_at
+        self.reconnects += 1
+        self.last_recovery_s = recovery
+        t_after = self.ring.timestamp(self.ring.seq - n)
+        duration = None if t_before is None or t_after is None else t_after - t_before
+        print(f"✅ Board back after {recovery:.1f} s")
+        self.annotate("gap", seq=self.ring.seq - n, duration=duration,
+                      recovery_s=round(recovery, 3), attempts=self._attempts)
+
+    def _poll(self):
+        now = time.monotonic()
+        if self._retry_at is not None:
+            if now >= self._retry_at:
+                self._try_reopen(now)
+            return
+        self.polls += 1
+        try:
+            data = self.board.get_board_data()
+            if data.shape[1]:
+                self.ring.write(data)
+                self.last_data = self._heard = time.monotonic()
+                if self._lost is not None:
+                    self._recovered(data.shape[1])
+            self._failing = False
+        except BrainFlowError as e:
+            self._fail(e)
+        if self.reopen is None:
+            return
+        stalled = now - self._heard > settings.ACQ_STALL_S
+        if self._lost is not None:
+            # Still reconnecting: a reopened board that stays silent (or
+            # fails every read) is dropped and retried after the backoff
+            self._force_reconnect = False
+            if stalled:
+                print(f"🚨 Reopened board silent (attempt {self._attempts})")
+                self._drop()
+                self._retry_later(now)
+        elif self._force_reconnect or stalled:
+            self._force_reconnect = False
+            self._lose(now)
+
+    def _park(self):
+        if self._lost is None:
+            try:
+                self.board.stop_stream()
+                # Samples still in BrainFlow's buffer
+                self.ring.write(self.board.get_board_data())
+            except BrainFlowError as e:
+                print("⚠️ stop_stream error:", e)
+        seq = self.ring.seq
+        print("💤 No subscribers, stream parked")
+        self.parked = True
+        parked_at, cpu = time.monotonic(), time.process_time()
+        while self._running.is_set() and self.demand.idle():
+            self.demand.wait()
+        parked = time.monotonic() - parked_at
+        self.parked = False
+        self.parked_s += parked
+        self.idle_cpu = 100.0 * (time.process_time() - cpu) / max(parked, 1e-9)
+        if not self._running.is_set():
+            return
+        print(f"▶️ Subscriber back after {parked:.1f} s parked ({self.idle_cpu:.2f}% CPU while parked)")
+        self.annotate("idle", seq=seq, duration=parked)
+        now = self._heard = self.stream_started = time.monotonic()
+        if self._lost is not None:
+            self._drop()
+            self._retry_at = now  # was reconnecting: try again right away
+            return
+        try:
+            self.board.start_stream()
+        except BrainFlowError as e:
+            print("🚨 start_stream error:", e)
+            if self.reopen is not None:
+                self._lose(now)
+
+    def _fail(self, e):
+        self.errors += 1
+        print("🚨 Acquisition error:", e)
+        if not self._failing:
+            self._failing = True
+            try:
+                self.annotate("acquisition_error", str(e))
+            except Exception as e:
+                print("⚠️ Annotation listener error:", e)
+
+    def _step(self):
+        if self.idle and self.demand.idle():
+            self._park()
+            return True
+        self._poll()
+        return False
+
+    def _run(self):
+        deadline = time.monotonic()
+        while self._running.is_set():
+            # Anything unexpected (ring shape, a raising listener, ...) is
+            # logged and counted; the thread keeps serving the ring
+            try:
+                parked = self._step()
+            except Exception as e:
+                self._fail(e)
+                parked = False
+            if parked:
+                deadline = time.monotonic()
+                continue
+            # Fixed cadence on an absolute clock
+            deadline += self.poll_s
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
@@ -0,0 +1,147 @@
+import bisect
+import json
+import os
+import threading
+
+import numpy as np
+
+import settings
+
+# Annotation / event track aligned to the sample stream.
+# An event is a dict {"seq", "t", "kind", ...}: seq is the absolute sample
+# index (the acquisition ring numbering), t the board timestamp of that
+# sample, plus optional "text", "duration" (seconds) and free-form fields.
+# Board timestamps grow with seq, so one sorted order serves both sample
+# and time range lookups (bisect, O(log n)).
+#
+# Recorded sessions keep events next to the chunks:
+#     annotations.jsonl   one event per line, in arrival order
+#     annotations.idx     written on close: (seq, t, byte offset) sorted by seq
+# so a reader jumps to the events of a range without scanning the file.
+
+INDEX_DTYPE = np.dtype([("seq", "<i8"), ("t", "<f8"), ("offset", "<i8")])
+
+
+def make_event(kind, seq, t, text=None, duration=None, **data):
+    event = {"seq": int(seq), "t": float(t), "kind": kind}
+    if text:
+        event["text"] = text
+    if duration:
+        event["duration"] = float(duration)
+    event.update(data)
+    return event
+
+
+class AnnotationTrack:
+    """In-memory event track, sorted by sample index, bounded to `capacity` events."""
+
+    def __init__(self, capacity=None):
+        self.capacity = settings.ANNOTATION_CAPACITY if capacity is None else capacity
+        self.events = []
+        self._seqs = []
+        self._times = []
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add(self, kind, seq, t, text=None, duration=None, **data):
+        event = make_event(kind, seq, t, text, duration, **data)
+        with self._lock:
+            # Events nearly always arrive in order, so this is an append
+            i = bisect.bisect_right(self._seqs, event["seq"])
+            self._seqs.insert(i, event["seq"])
+            self._times.insert(i, event["t"])
+            self.events.insert(i, event)
+            excess = len(self.events) - self.capacity
+            if excess > 0:
+                del self._seqs[:excess], self._times[:excess], self.events[:excess]
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(event)
+        return event
+
+    def range(self, start=None, stop=None, kind=None):
+        """Events with start <= seq < stop."""
+        with self._lock:
+            i = 0 if start is None else bisect.bisect_left(self._seqs, start)
+            j = len(self._seqs) if stop is None else bisect.bisect_left(self._seqs, stop)
+            events = self.events[i:j]
+        return [e for e in events if e["kind"] == kind] if kind else events
+
+    def time_range(self, t_start=None, t_end=None, kind=None):
+        """Events with t_start <= t < t_end."""
+        with self._lock:
+            i = 0 if t_start is None else bisect.bisect_left(self._times, t_start)
+            j = len(self._times) if t_end is None else bisect.bisect_left(self._times, t_end)
+            events = self.events[i:j]
+        return [e for e in events if e["kind"] == kind] if kind else events
+
+    def add_listener(self, callback):
+        """callback(event) runs on the thread that added the event."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+
+class AnnotationFile:
+    """Append-only annotations.jsonl of a session directory, indexed on close."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(os.path.join(path, "annotations.jsonl"), "ab")
+        self._index = []
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        line = (json.dumps(event) + "\n").encode()
+        with self._lock:
+            self._index.append((event["seq"], event["t"], self._file.tell()))
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            index = np.array(sorted(self._index), dtype=INDEX_DTYPE)
+            index.tofile(os.path.join(self.path, "annotations.idx"))
+
+
+def load_index(path):
+    """Sorted (seq, t, offset) index of a session's annotations.
+
+    Closed sessions map annotations.idx; a live session has none yet, so
+    the index is built from the jsonl file.
+    """
+    idx_file = os.path.join(path, "annotations.idx")
+    if os.path.exists(idx_file):
+        if os.path.getsize(idx_file) == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.memmap(idx_file, dtype=INDEX_DTYPE, mode="r")
+    rows = []
+    jsonl = os.path.join(path, "annotations.jsonl")
+    if os.path.exists(jsonl):
+        with open(jsonl, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.endswith(b"\n"):
+                    event = json.loads(line)
+                    rows.append((event["seq"], event["t"], offset))
+                offset += len(line)
+    return np.array(sorted(rows), dtype=INDEX_DTYPE)
+
+
+def read_events(path, index, i, j, kind=None):
+    """Events index[i:j], read by seeking straight to their lines."""
+    events = []
+    if j <= i:
+        return events
+    with open(os.path.join(path, "annotations.jsonl"), "rb") as f:
+        for offset in index["offset"][i:j]:
+            f.seek(int(offset))
+            event = json.loads(f.readline())
+            if not kind or event["kind"] == kind:
+                events.append(event)
+    return events
@@ -0,0 +1,321 @@
+from collections import deque
+
+import numpy as np
+
+import settings
+
+# Streaming Pan-Tompkins QRS detector.
+# Band-pass, derivative, squaring and moving-window integration are causal
+# filters that carry their state between blocks, so each call only processes
+# the new ECG samples. Peaks of the integrated signal are classified with the
+# adaptive signal/noise thresholds (SPKI/NPKI) and a search-back for missed
+# beats; the R-peak is then located on the band-passed ECG and refined on
+# the raw samples. SciPy is imported on first use to keep startup fast.
+# Each detected beat is also correlated with a running QRS template (on the
+# band-passed history the detector already keeps) for a 0-1 quality index.
+
+
+class StreamingPanTompkins:
+    def __init__(self, fs, learn_s=2.0, refractory_s=0.2, history_s=2.0, max_rr_s=2.0, dtype=None):
+        from scipy.signal import butter
+
+        self.fs = fs
+        # lfilter runs in the common dtype of coefficients and input
+        self.dtype = np.dtype(settings.SAMPLE_DTYPE if dtype is None else dtype)
+        b_bp, a_bp = butter(1, [5 / (0.5 * fs), 15 / (0.5 * fs)], btype='band')
+        self.b_bp, self.a_bp = b_bp.astype(self.dtype), a_bp.astype(self.dtype)
+        self.b_der = (np.array([1, 2, 0, -2, -1]) / 8).astype(self.dtype)
+        self.mwi_len = int(0.15 * fs)
+        self.b_mwi = np.full(self.mwi_len, 1.0 / self.mwi_len, dtype=self.dtype)
+        self.refine = max(1, int(0.03 * fs))  # raw search half-width around the band-pass peak
+
+        self.zi_bp = None
+        self.zi_der = np.zeros(len(self.b_der) - 1, dtype=self.dtype)
+        self.zi_mwi = np.zeros(self.mwi_len - 1, dtype=self.dtype)
+
+        self.refractory = int(refractory_s * fs)
+        self.max_rr = max_rr_s      # longer intervals span a gap or a missed stretch, not one beat
+        self.learn_len = int(learn_s * fs)
+        self.learn_buf = []
+        self.learned = 0
+
+        self.spki = 0.0
+        self.npki = 0.0
+        self.threshold1 = 0.0
+
+        # Recent raw/band-passed ECG and timestamps, for locating the R-peak;
+        # a search-back beat can be more than one RR interval old
+        self.history = int(history_s * fs)
+        self.raw_hist = np.zeros(0, dtype=self.dtype)
+        self.bp_hist = np.zeros(0, dtype=self.dtype)
+        self.ts_hist = np.zeros(0)
+
+        self.n = 0                  # absolute index of the next sample
+        self.prev = np.zeros(2)     # last two integrated samples (peak test)
+        self.last_beat = None       # absolute index of the last integrated peak
+        self.last_r = None          # absolute index of the last R-peak
+        self.last_r_t = None        # board time of the last R-peak
+        self.rr = []                # recent RR intervals (s)
+        self.best_noise = None      # (index, height) of the largest noise peak since last beat
+
+        self.half_qrs = max(1, int(0.05 * fs))
+        self.template = None        # running mean of band-passed QRS complexes
+        self.corr = deque(maxlen=8)  # template correlation of the last beats
+
+    def _threshold(self):
+        self.threshold1 = self.npki + 0.25 * (self.spki - self.npki)
+
+    def _learn(self, mwi):
+        self.learn_buf.append(mwi)
+        self.learned += len(mwi)
+        if self.learned < self.learn_len:
+            return False
+        data = np.concatenate(self.learn_buf)
+        self.spki = np.max(data) / 3
+        self.npki = np.mean(data) / 2
+        self._threshold()
+        self.learn_buf = []
+        return True
+
+    def _rr_mean(self):
+        return np.mean(self.rr[-8:]) if self.rr else None
+
+    def _r_peak(self, peak_idx):
+        # Largest |band-passed| sample in the integration window ending at the peak
+        hist_start = self.n - len(self.bp_hist)
+        lo = max(peak_idx - self.mwi_len - 2 - hist_start, 0)
+        hi = min(peak_idx - hist_start + 1, len(self.bp_hist))
+        if hi <= lo:
+            k = len(self.bp_hist) - 1
+        else:
+            k = lo + int(np.argmax(np.abs(self.bp_hist[lo:hi])))
+        # Refine on the raw ECG: largest deflection from the local baseline
+        lo = max(k - self.refine, 0)
+        hi = min(k + self.refine + 1, len(self.raw_hist))
+        baseline = np.median(self.raw_hist)
+        k = lo + int(np.argmax(np.abs(self.raw_hist[lo:hi] - baseline)))
+        return hist_start + k, float(self.ts_hist[k])
+
+    def _beat(self, idx, height, searchback=False):
+        if searchback:
+            self.spki = 0.25 * height + 0.75 * self.spki
+        else:
+            self.spki = 0.125 * height + 0.875 * self.spki
+        self._threshold()
+        self.last_beat = idx
+        self.best_noise = None
+
+        r_idx, r_ts = self._r_peak(idx)
+        self._score(r_idx)
+        rr = None
+        if self.last_r is not None and r_idx > self.last_r:
+            rr = (r_idx - self.last_r) / self.fs
+            if rr > self.max_rr:
+                rr = None
+            else:
+                self.rr.append(rr)
+                del self.rr[:-32]
+        self.last_r = r_idx
+        self.last_r_t = r_ts
+        return {
+            "type": "beat",
+            "seq": int(r_idx),
+            "t": r_ts,
+            "rr": rr,
+            "hr": round(60.0 / rr, 1) if rr else None,
+        }
+
+    def _score(self, r_idx):
+        # QRS around the R-peak; the integrator delay leaves the samples after it in bp_hist
+        k = r_idx - (self.n - len(self.bp_hist))
+        lo, hi = k - self.half_qrs, k + self.half_qrs + 1
+        if lo < 0 or hi > len(self.bp_hist):
+            return
+        qrs = self.bp_hist[lo:hi].astype(float)
+        if self.template is None:
+            self.template = qrs
+            return
+        a = qrs - qrs.mean()
+        b = self.template - self.template.mean()
+        denom = np.sqrt(np.dot(a, a) * np.dot(b, b))
+        self.corr.append(float(np.dot(a, b) / denom) if denom > 0 else 0.0)
+        self.template += 0.1 * (qrs - self.template)
+
+    def _noise(self, idx, height):
+        self.npki = 0.125 * height + 0.875 * self.npki
+        self._threshold()
+        if self.best_noise is None or height > self.best_noise[1]:
+            self.best_noise = (idx, height)
+
+    def update(self, ecg, timestamps, bp=None):
+        """Feed new ECG samples with their board timestamps; returns beat events.
+
+        `bp` may carry the same samples already band-passed at 5-15 Hz
+        (e.g. a processing graph's stage), which skips the detector's own.
+        """
+        from scipy.signal import lfilter, lfilter_zi
+
+        ecg = np.asarray(ecg, dtype=self.dtype)
+        n = len(ecg)
+        if n == 0:
+            return []
+        if bp is not None:
+            bp = np.asarray(bp, dtype=self.dtype)
+        else:
+            if self.zi_bp is None:
+                self.zi_bp = (lfilter_zi(self.b_bp, self.a_bp) * ecg[0]).astype(self.dtype)
+            bp, self.zi_bp = lfilter(self.b_bp, self.a_bp, ecg, zi=self.zi_bp)
+
+        one = self.dtype.type(1)
+        der, self.zi_der = lfilter(self.b_der, one, bp, zi=self.zi_der)
+        np.multiply(der, der, out=der)
+        mwi, self.zi_mwi = lfilter(self.b_mwi, one, der, zi=self.zi_mwi)
+
+        # The whole block stays in the history while its peaks are located
+        keep = self.history + n
+        self.raw_hist = np.concatenate((self.raw_hist, ecg))[-keep:]
+        self.bp_hist = np.concatenate((self.bp_hist, bp))[-keep:]
+        self.ts_hist = np.concatenate((self.ts_hist, np.asarray(timestamps, dtype=float)))[-keep:]
+
+        base = self.n
+        # Local maxima of the integrated signal, using the carried-over samples
+        ext = np.concatenate((self.prev, mwi))
+        cand = np.flatnonzero((ext[1:-1] > ext[:-2]) & (ext[1:-1] >= ext[2:]))
+        cand_idx = base - 1 + cand          # absolute index of each candidate
+        cand_h = ext[1:-1][cand]
+        self.prev = ext[-2:]
+        self.n += n
+
+        if self.learned < self.learn_len:
+            if not self._learn(mwi):
+                return []
+
+        events = []
+        for idx, h in zip(cand_idx.tolist(), cand_h.tolist()):
+            if self.last_beat is not None and idx - self.last_beat < self.refractory:
+                continue
+            if h > self.threshold1:
+                events.append(self._beat(idx, h))
+                continue
+            self._noise(idx, h)
+            # Search-back: no beat for 1.66 x mean RR, take the best noise peak
+            rr_mean = self._rr_mean()
+            if (rr_mean and self.last_beat is not None and self.best_noise is not None
+                    and idx - self.last_beat > 1.66 * rr_mean * self.fs
+                    and self.best_noise[1] > 0.5 * self.threshold1):
+                events.append(self._beat(*self.best_noise, searchback=True))
+        self.raw_hist = self.raw_hist[-self.history:]
+        self.bp_hist = self.bp_hist[-self.history:]
+        self.ts_hist = self.ts_hist[-self.history:]
+        return events
+
+    def quality(self, stale_s=3.0):
+        """Mean template correlation of the last beats, clipped to 0-1 (None before two beats).
+
+        Decays linearly to 0 from one to `stale_s` seconds (board time) after
+        the last beat, so a lost QRS does not keep its last good score.
+        """
+        if not self.corr:
+            return None
+        q = min(1.0, max(0.0, float(np.mean(self.corr))))
+        age = float(self.ts_hist[-1]) - self.last_r_t
+        if age > 1.0:
+            q *= max(0.0, (stale_s - age) / (stale_s - 1.0))
+        return q
+
+    def heart_rate(self, beats=4):
+        """Mean HR over the last few RR intervals, as an int or '--'."""
+        if not self.rr:
+            return '--'
+        return int(60.0 / np.mean(self.rr[-beats:]))
+
+
+# --- HRV ---
+class HrvTracker:
+    """Rolling time-domain HRV over the last `window_s` seconds of beats.
+
+    Sums for SDNN, RMSSD and pNN50 are updated as RR intervals enter and
+    leave the window, so each beat costs O(1). Successive differences are
+    only taken between accepted intervals with no rejected one in between.
+    LF/HF needs a resampled tachogram and is recomputed at most every
+    `lfhf_every_s` seconds.
+    """
+
+    def __init__(self, window_s, lfhf_every_s=10.0, rr_range=(0.3, 2.0)):
+        self.window = window_s
+        self.lfhf_every = lfhf_every_s
+        self.rr_range = rr_range
+        self.beats = deque()        # [t, rr_ms, difference to the previous beat or None]
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.diff_sq = 0.0
+        self.nn50 = 0
+        self.n_diffs = 0
+        self._broken = True         # a rejected interval since the last accepted one
+        self.lf_hf = None
+        self.lf_hf_at = None
+
+    def add(self, t, rr):
+        if rr is None or not (self.rr_range[0] <= rr <= self.rr_range[1]):
+            self._broken = True
+            return
+        rr_ms = float(rr) * 1000.0
+        d = None
+        if self.beats and not self._broken:
+            d = rr_ms - self.beats[-1][1]
+            self.diff_sq += d * d
+            self.nn50 += abs(d) > 50.0
+            self.n_diffs += 1
+        self._broken = False
+        self.beats.append([t, rr_ms, d])
+        self.sum += rr_ms
+        self.sumsq += rr_ms * rr_ms
+        self._expire(t)
+
+    def _expire(self, now):
+        while self.beats and self.beats[0][0] < now - self.window:
+            _, r0, _ = self.beats.popleft()
+            self.sum -= r0
+            self.sumsq -= r0 * r0
+            if self.beats and self.beats[0][2] is not None:
+                d = self.beats[0][2]
+                self.diff_sq -= d * d
+                self.nn50 -= abs(d) > 50.0
+                self.n_diffs -= 1
+                self.beats[0][2] = None
+
+    def _lf_hf(self, fs_resample=4.0):
+        from scipy.signal import welch
+
+        t = np.fromiter((b[0] for b in self.beats), float, len(self.beats))
+        rr = np.fromiter((b[1] for b in self.beats), float, len(self.beats))
+        if t[-1] - t[0] < 30.0:
+            return None
+        grid = np.arange(t[0], t[-1], 1.0 / fs_resample)
+        tach = np.interp(grid, t, rr)
+        tach -= tach.mean()
+        f, p = welch(tach, fs_resample, nperseg=min(256, len(tach)))
+        df = f[1] - f[0]
+        lf = p[(f >= 0.04) & (f < 0.15)].sum() * df
+        hf = p[(f >= 0.15) & (f < 0.4)].sum() * df
+        return round(float(lf / hf), 3) if hf > 0 else None
+
+    def metrics(self, now=None):
+        if now is not None:
+            self._expire(now)
+        n = len(self.beats)
+        if n < 3:
+            return {"n": n, "sdnn": None, "rmssd": None, "pnn50": None, "lf_hf": None}
+        var = max(self.sumsq - self.sum * self.sum / n, 0.0) / (n - 1)
+        stamp = self.beats[-1][0]
+        if self.lf_hf_at is None or stamp - self.lf_hf_at >= self.lfhf_every:
+            self.lf_hf = self._lf_hf()
+            self.lf_hf_at = stamp
+        k = self.n_diffs
+        return {
+            "n": n,
+            "sdnn": round(float(np.sqrt(var)), 2),
+            "rmssd": round(float(np.sqrt(max(self.diff_sq, 0.0) / k)), 2) if k else None,
+            "pnn50": round(100.0 * self.nn50 / k, 2) if k else None,
+            "lf_hf": self.lf_hf,
+        }
@@ -0,0 +1,138 @@
+import sys
+import time
+
+import numpy as np
+
+from acquisition import RingBuffer
+from beats import StreamingPanTompkins
+from calibration import Calibration, MBS_CALIBRATION
+from stream_dsp import MainsNotch, StreamingNormalizer
+
+# float64 vs float32 sample buffers: memory, processing time on long
+# buffers, and ECG beat detection accuracy on a synthetic ECG with known
+# R-peaks. No board needed:
+#   python bench_dtype.py [minutes]
+
+FS = 250
+N_CHANNELS = 16
+DTYPES = ("float64", "float32")
+
+
+def synthetic_board(minutes, rng):
+    """16 channels of board-like microvolt data with DC offsets and mains."""
+    n = int(minutes * 60 * FS)
+    t = np.arange(n) / FS
+    offsets = rng.uniform(-150_000, 1_200_000, size=(N_CHANNELS, 1))
+    data = offsets + 40 * rng.standard_normal((N_CHANNELS, n))
+    data += 80 * np.sin(2 * np.pi * 50 * t) + 300 * np.sin(2 * np.pi * 0.3 * t)
+    return data
+
+
+def synthetic_ecg(minutes, rng):
+    """ECG (uV) with P/QRS/T waves, drifting RR, noise and mains; true R indices."""
+    n = int(minutes * 60 * FS)
+    t = np.arange(n) / FS
+    beats = []
+    tb = 1.0
+    while tb < t[-1] - 1.0:
+        beats.append(tb)
+        tb += 0.8 + 0.08 * np.sin(2 * np.pi * tb / 20) + rng.normal(0, 0.02)
+    beats = np.array(beats)
+
+    ecg = np.full(n, -25_000.0)  # electrode DC offset
+    for shift, width, amp in ((-0.2, 0.025, 150), (-0.03, 0.008, -120), (0.0, 0.01, 1200),
+                              (0.03, 0.008, -200), (0.3, 0.05, 300)):
+        centers = beats + shift
+        for c in centers:
+            lo, hi = int((c - 5 * width) * FS), int((c + 5 * width) * FS) + 1
+            seg = slice(max(lo, 0), min(hi, n))
+            ecg[seg] += amp * np.exp(-0.5 * ((t[seg] - c) / width) ** 2)
+    ecg += 200 * np.sin(2 * np.pi * 0.25 * t) + 50 * np.sin(2 * np.pi * 50 * t)
+    ecg += 15 * rng.standard_normal(n)
+    return ecg, np.rint(beats * FS).astype(int)
+
+
+def best_of(fn, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_pipeline(data, dtype):
+    """Acquisition ring -> calibration -> mains notch -> normalizer, 1 s blocks."""
+    labels = ["ECG", "PPG", "PCG", "EMG1", "EMG2", *MBS_CALIBRATION][:N_CHANNELS]
+    labels += [f"EEG{i}" for i in range(N_CHANNELS - len(labels))]
+    calibration = Calibration(labels, list(range(1, N_CHANNELS + 1)))
+    ring = RingBuffer(N_CHANNELS, data.shape[1], dtype=dtype)
+
+    def streaming():
+        notch = MainsNotch(N_CHANNELS, FS, 50.0, dtype=dtype)
+        normalizer = StreamingNormalizer(N_CHANNELS, window=4 * FS, block=FS // 10, release=FS)
+        for start in range(0, data.shape[1], FS):
+            seq = ring.seq
+            ring.write(data[:, start:start + FS])
+            _, block = ring.read(seq)
+            y = notch.process(calibration.apply(block, dtype=dtype))
+            normalizer.update(y)
+            normalizer.apply(y)
+
+    def whole_buffer():
+        _, block = ring.read(ring.oldest())
+        MainsNotch(N_CHANNELS, FS, 50.0, dtype=dtype).process(calibration.apply(block, dtype=dtype))
+
+    t_stream = best_of(streaming)
+    t_whole = best_of(whole_buffer)
+    return ring.data.nbytes, t_stream, t_whole
+
+
+def bench_beats(ecg, truth, dtype, tolerance=2):
+    detector = StreamingPanTompkins(FS, dtype=dtype)
+    timestamps = np.arange(len(ecg)) / FS
+    found = []
+    for start in range(0, len(ecg), 10):
+        stop = start + 10
+        found += [e["seq"] for e in detector.update(ecg[start:stop], timestamps[start:stop])]
+    found = np.array(found)
+
+    # Match every true R-peak to the nearest detection
+    pos = np.clip(np.searchsorted(found, truth), 1, len(found) - 1)
+    nearest = np.where(np.abs(found[pos] - truth) < np.abs(found[pos - 1] - truth), found[pos], found[pos - 1])
+    err = nearest - truth
+    hit = np.abs(err) <= tolerance
+    sensitivity = hit.mean()
+    ppv = hit.sum() / len(found)
+    # HR error on consecutive matched beats
+    both = hit[1:] & hit[:-1]
+    hr_true = 60 * FS / np.diff(truth)[both]
+    hr_found = 60 * FS / np.diff(nearest)[both]
+    return sensitivity, ppv, np.mean(np.abs(hr_found - hr_true)), np.max(np.abs(err[hit])), found
+
+
+def main():
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    rng = np.random.default_rng(0)
+    data = synthetic_board(minutes, rng)
+    ecg, truth = synthetic_ecg(minutes, rng)
+
+    print(f"{N_CHANNELS} channels x {minutes:g} min at {FS} Hz")
+    print(f"{'dtype':<8} {'ring MB':>8} {'stream s':>9} {'whole s':>8}")
+    for dtype in DTYPES:
+        nbytes, t_stream, t_whole = bench_pipeline(data, dtype)
+        print(f"{dtype:<8} {nbytes / 1e6:>8.1f} {t_stream:>9.3f} {t_whole:>8.3f}")
+
+    print(f"\nECG beat detection, {len(truth)} true beats (match within 2 samples)")
+    print(f"{'dtype':<8} {'sens':>6} {'ppv':>6} {'HR err bpm':>11} {'max R err':>10}")
+    detections = {}
+    for dtype in DTYPES:
+        sens, ppv, hr_err, r_err, found = bench_beats(ecg, truth, dtype)
+        detections[dtype] = found
+        print(f"{dtype:<8} {sens:>6.3f} {ppv:>6.3f} {hr_err:>11.3f} {r_err:>10d}")
+    same = np.array_equal(detections["float64"], detections["float32"])
+    print(f"identical R-peak indices float64/float32: {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+import websockets
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+
+import runtime
+import settings
+from acquisition import Acquisition
+from calibration import Calibration
+from payload import build_signals, dumps
+from scheduler import SendScheduler
+
+# Frames/s and send latency of the WebSocket send path on stock asyncio
+# and on uvloop. Runs the server handler and N clients in one process,
+# fed from the BrainFlow synthetic board through the acquisition thread:
+#   python bench_loop.py [clients] [seconds]
+
+BOARD_ID = BoardIds.SYNTHETIC_BOARD.value
+
+
+def make_handler(acquisition, eeg_channels, calibration, labels):
+    async def handler(websocket, path=None):
+        reader = acquisition.reader()
+        scheduler = SendScheduler(acquisition.fs, name="bench send")
+        interval = 1.0 / acquisition.fs
+        try:
+            while True:
+                await scheduler.tick()
+                batch = scheduler.take(reader)
+                if batch is None:
+                    continue
+                seq, raw_data = batch
+                rows, units = calibration.transport(raw_data[eeg_channels])
+                now = time.time()
+                frame = {"signals": build_signals(rows, labels, now, interval, seq, units=units), "timestamp": now}
+                await websocket.send(dumps(frame))
+                scheduler.sent(raw_data.shape[1])
+        except websockets.ConnectionClosed:
+            pass
+    return handler
+
+
+async def client(uri, seconds, latencies):
+    frames = 0
+    async with websockets.connect(uri, **runtime.ws_options()) as ws:
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            message = await ws.recv()
+            latencies.append(time.time() - json.loads(message)["timestamp"])
+            frames += 1
+    return frames
+
+
+async def bench(acquisition, n_clients, seconds):
+    eeg_channels = BoardShim.get_eeg_channels(BOARD_ID)
+    labels = [f"CH{ch}" for ch in eeg_channels]
+    calibration = Calibration(labels, eeg_channels)
+    handler = make_handler(acquisition, eeg_channels, calibration, labels)
+
+    latencies = []
+    async with websockets.serve(handler, "127.0.0.1", 0, **runtime.ws_options()) as server:
+        port = list(server.sockets)[0].getsockname()[1]
+        uri = f"ws://127.0.0.1:{port}"
+        counts = await asyncio.gather(*(client(uri, seconds, latencies) for _ in range(n_clients)))
+    lat_ms = np.array(latencies) * 1e3
+    return sum(counts) / seconds, np.percentile(lat_ms, 50), np.percentile(lat_ms, 99)
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+
+    loops = ["asyncio"]
+    if runtime.uvloop is not None:
+        loops.append("uvloop")
+    else:
+        print("uvloop not installed, measuring stock asyncio only")
+
+    BoardShim.disable_board_logger()
+    board = BoardShim(BOARD_ID, BrainFlowInputParams())
+    board.prepare_session()
+    board.start_stream()
+    acquisition = Acquisition(board, BOARD_ID)
+    acquisition.start()
+    try:
+        options = runtime.ws_options()
+        print(f"{n_clients} clients, {seconds:g} s per loop, compression={options['compression']}, "
+              f"write_limit={options['write_limit']}")
+        print(f"{'loop':<8} {'frames/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for loop in loops:
+            settings.USE_UVLOOP = loop == "uvloop"
+            rate, p50, p99 = runtime.run(lambda: bench(acquisition, n_clients, seconds))
+            print(f"{loop:<8} {rate:>9.1f} {p50:>8.2f} {p99:>8.2f}")
+    finally:
+        acquisition.stop()
+        board.stop_stream()
+        board.release_session()
+
+
+if __name__ == '__main__':
+    main()
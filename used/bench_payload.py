@@ -0,0 +1,57 @@
+import sys
+import time
+import numpy as np
+
+import payload
+import settings
+
+# Bytes and CPU per frame for the legacy and columnar payload schemas.
+# Uses synthetic 16-channel data, no board needed:
+#   python bench_payload.py [samples_per_frame] [frames]
+
+N_CHANNELS = 16
+FS = 250
+
+
+def make_frame(n_samples, rng):
+    # ADS1299 counts as the MBS server sends them (int)
+    counts = rng.integers(-8_000_000, 8_000_000, size=(N_CHANNELS, n_samples))
+    return counts.astype(np.int64)
+
+
+def run(schema, use_orjson, n_samples, frames):
+    settings.USE_ORJSON = use_orjson
+    rng = np.random.default_rng(0)
+    labels = [f"CH{i + 1}" for i in range(N_CHANNELS)]
+    data = [make_frame(n_samples, rng) for _ in range(16)]
+
+    total_bytes = 0
+    start = time.process_time()
+    for k in range(frames):
+        rows = data[k % len(data)]
+        signals = payload.build_signals(rows, labels, time.time(), 1.0 / FS, k * n_samples, schema=schema)
+        total_bytes += len(payload.dumps(signals).encode())
+    cpu = time.process_time() - start
+    return total_bytes / frames, cpu / frames * 1e6
+
+
+def main():
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    cases = [("legacy", False), ("columnar", False)]
+    if payload.orjson is not None:
+        cases += [("legacy", True), ("columnar", True)]
+    else:
+        print("orjson not installed, skipping the fast serializer")
+
+    print(f"{N_CHANNELS} channels x {n_samples} samples, {frames} frames")
+    print(f"{'schema':<10} {'serializer':<10} {'bytes/frame':>12} {'cpu us/frame':>13}")
+    for schema, use_orjson in cases:
+        size, cpu_us = run(schema, use_orjson, n_samples, frames)
+        name = "orjson" if use_orjson else "json"
+        print(f"{schema:<10} {name:<10} {size:>12.0f} {cpu_us:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import re
+import numpy as np
+
+import settings
+
+# Per-channel calibration shared by the GUI and the servers.
+# The table maps a channel label to its transform from BrainFlow output
+# (microvolts) to physical units:
+#     u = (x - offset) * gain
+#     y = poly(u)            (numpy order, highest power first; default y = u)
+#     y = interp(u, lut)     (lookup table, replaces poly when given)
+# Calibration() compiles the table once into coefficient arrays so a whole
+# block (channels x samples) is converted in one vectorized evaluation.
+
+# --- ADS1299 ---
+ADS1299_VREF = 4.5
+ADS1299_GAINS = {0: 1, 1: 2, 2: 4, 3: 6, 4: 8, 5: 12, 6: 24}
+ADS1299_CHANNEL_KEYS = '12345678QWERTYUI'  # Cyton 1-8, Daisy 9-16
+
+# Channel settings sent to the Cyton+Daisy by the MBS scripts
+MBS_BOARD_CONFIG = (
+    'x1060100Xx2010000Xx3010000Xx4060000Xx5060000Xx6010000Xx7010000Xx8010000X'
+    'xQ010000XxW010000XxE010000XxR010000XxT010000XxY010000XxU010000XxI010000X'
+)
+
+_CHANNEL_SETTING = re.compile(r'x([1-8QWERTYUI])([01])([0-6])[0-7][01][01][01]X')
+
+
+def parse_ads_gains(config, n_channels=16, default=24):
+    """PGA gain per ADS1299 channel (index 1..n) from a config_board string."""
+    gains = {ch: default for ch in range(1, n_channels + 1)}
+    for key, _power, gain_code in _CHANNEL_SETTING.findall(config or ''):
+        ch = ADS1299_CHANNEL_KEYS.index(key) + 1
+        if ch <= n_channels:
+            gains[ch] = ADS1299_GAINS[int(gain_code)]
+    return gains
+
+
+def lsb_microvolts(gain):
+    """Microvolts per ADC count for a given PGA gain."""
+    return ADS1299_VREF / gain / (2 ** 23 - 1) * 1e6
+
+
+# --- Calibration table ---
+DEFAULT_ENTRY = {"unit": "uV"}
+
+MBS_CALIBRATION = {
+    "PPG":         {"unit": "uV", "gain": -1},
+    "MYOMETER":    {"unit": "N", "offset": 109840, "gain": 1 / 30000},
+    "SPIRO":       {"unit": "mL/s", "offset": 1100000, "poly": [-9.3359e-9, 0.010698, 0.0]},
+    # Temperature and oxygen sensors are inverted. Without absolute fits these
+    # and NIBP stay in microvolts; set degC / mmHg / %O2 with a real fit
+    "TEMPERATURE": {"unit": "uV", "gain": -1},
+    "NIBP":        {"unit": "uV"},
+    "OXYGEN":      {"unit": "uV", "gain": -1},
+}
+
+
+class Calibration:
+    def __init__(self, labels, channels, table=None, config=None):
+        table = MBS_CALIBRATION if table is None else table
+        entries = [table.get(label, DEFAULT_ENTRY) for label in labels]
+        gains = parse_ads_gains(config)
+
+        self.labels = list(labels)
+        self.units = [e.get("unit", "uV") for e in entries]
+        self.ads_gain = np.array([gains.get(ch, 24) for ch in channels], dtype=float)
+        self.lsb_uv = lsb_microvolts(self.ads_gain)
+        self.full_scale_uv = self.lsb_uv * (2 ** 23 - 1)
+
+        self.offset = np.array([e.get("offset", 0.0) for e in entries], dtype=float)
+        self.gain = np.array([e.get("gain", 1.0) for e in entries], dtype=float)
+
+        polys = [list(e.get("poly", [1.0, 0.0])) for e in entries]
+        degree = max((len(p) for p in polys), default=2)
+        self.coeffs = np.array([[0.0] * (degree - len(p)) + p for p in polys], dtype=float)
+        self.identity = all(p == [1.0, 0.0] for p in polys) and not np.any(self.offset) \
+            and np.all(self.gain == 1.0)
+
+        self.luts = [
+            (i, np.asarray(e["lut"][0], dtype=float), np.asarray(e["lut"][1], dtype=float))
+            for i, e in enumerate(entries) if "lut" in e
+        ]
+
+    @classmethod
+    def concat(cls, calibrations, labels=None):
+        """One Calibration over the channels of several (e.g. one per board)."""
+        merged = cls.__new__(cls)
+        merged.labels = list(labels) if labels is not None else [l for c in calibrations for l in c.labels]
+        merged.units = [u for c in calibrations for u in c.units]
+        for name in ("ads_gain", "lsb_uv", "full_scale_uv", "offset", "gain"):
+            setattr(merged, name, np.concatenate([getattr(c, name) for c in calibrations]))
+        degree = max(c.coeffs.shape[1] for c in calibrations)
+        merged.coeffs = np.vstack([np.pad(c.coeffs, ((0, 0), (degree - c.coeffs.shape[1], 0))) for c in calibrations])
+        merged.identity = all(c.identity for c in calibrations)
+        merged.luts = []
+        base = 0
+        for c in calibrations:
+            merged.luts += [(base + i, xp, fp) for i, xp, fp in c.luts]
+            base += len(c.labels)
+        return merged
+
+    def apply(self, block, counts=False, dtype=None):
+        """Convert a block (channels x samples) to physical units.
+
+        counts=True means the block holds raw ADC counts, which are first
+        scaled to microvolts with the ADS1299 gain of each channel. The
+        result has `dtype` (default settings.SAMPLE_DTYPE) and is always a
+        new array; every later step works in place on it.
+        """
+        dtype = np.dtype(settings.SAMPLE_DTYPE if dtype is None else dtype)
+        u = np.array(block, dtype=dtype)
+        if counts:
+            u *= self.lsb_uv.astype(dtype)[:, None]
+        if self.identity and not self.luts:
+            return u
+
+        u -= self.offset.astype(dtype)[:, None]
+        u *= self.gain.astype(dtype)[:, None]
+        # Horner evaluation of every channel polynomial at once
+        coeffs = self.coeffs.astype(dtype)
+        y = np.empty_like(u)
+        y[:] = coeffs[:, :1]
+        for k in range(1, coeffs.shape[1]):
+            y *= u
+            y += coeffs[:, k:k + 1]
+        for i, xp, fp in self.luts:
+            y[i] = np.interp(u[i], xp, fp)
+        return y
+
+    def transport(self, block):
+        """Block and units as the servers send them (settings.CALIBRATE)."""
+        if not settings.CALIBRATE:
+            return block, None
+        y = self.apply(block)
+        return np.round(y, settings.CALIBRATED_DECIMALS, out=y), self.units
+
+    def physical_range(self, points=1025):
+        """Per-channel (min, max) in physical units over the full ADC input range.
+
+        Evaluated on a grid, so non-monotonic polynomials are covered too.
+        """
+        grid = np.linspace(-1.0, 1.0, points)[None, :] * self.full_scale_uv[:, None]
+        y = self.apply(grid, dtype=float)
+        return y.min(axis=1), y.max(axis=1)
+
+    def to_counts(self, block_uv):
+        """Microvolts back to ADC counts (settings.RAW_DTYPE) with each channel's gain."""
+        return np.rint(np.asarray(block_uv) / self.lsb_uv[:, None]).astype(settings.RAW_DTYPE)
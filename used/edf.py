@@ -0,0 +1,201 @@
+import datetime
+import io
+import os
+import sys
+
+import numpy as np
+
+import settings
+
+# Streaming EDF+ / BDF+ writer (continuous recordings, "+C").
+# Samples arrive as physical blocks (channels x n) in any block size; they
+# are scaled to digital values in one vectorized step per data record and
+# written out record by record, so memory stays at one record however long
+# the recording is. Every record carries the EDF+ time-keeping annotation.
+
+FORMATS = {
+    # version, reserved, annotation label, bytes per sample, digital range
+    "edf": ("0", "EDF+C", "EDF Annotations", 2, (-32768, 32767)),
+    "bdf": ("\xffBIOSEMI", "BDF+C", "BDF Annotations", 3, (-8388608, 8388607)),
+}
+ANNOTATION_BYTES = 120  # per record: time-keeping TAL plus a few text annotations
+
+
+def _field(value, width):
+    text = str(value)
+    if len(text) > width:
+        raise ValueError(f"EDF header field {text!r} is longer than {width}")
+    return text.ljust(width)
+
+
+def _number(value, width=8):
+    """Shortest decimal text of `value` that fits the header field."""
+    for digits in range(width, 0, -1):
+        text = f"{value:.{digits}g}"
+        if len(text) <= width:
+            return text.ljust(width)
+    raise ValueError(f"{value} does not fit an EDF header field")
+
+
+class EdfWriter:
+    def __init__(self, fileobj, labels, units, fs, phys_min, phys_max, fmt="edf",
+                 start=None, record_s=1, n_records=None, patient="X X X X", recording="X"):
+        version, reserved, ann_label, self.width, (dmin, dmax) = FORMATS[fmt]
+        self.f = fileobj
+        self.n_channels = len(labels)
+        self.spr = int(round(fs * record_s))
+        self.record_s = record_s
+        self.ann_samples = -(-ANNOTATION_BYTES // self.width)
+        self.records = 0
+        self.count_known = n_records is not None
+        self.buf = np.zeros((self.n_channels, self.spr))
+        self.fill = 0
+        self.pending = []         # text annotation TALs for the next records
+
+        # Vectorized physical -> digital scaling per channel
+        pmin = np.asarray(phys_min, dtype=float)
+        pmax = np.asarray(phys_max, dtype=float)
+        flat = pmax <= pmin
+        pmax = np.where(flat, pmin + 1.0, pmax)
+        # Header fields hold ~8 characters; scale with the rounded limits
+        self.pmin = np.array([float(_number(v)) for v in pmin])
+        self.pmax = np.array([float(_number(v)) for v in pmax])
+        self.dmin, self.dmax = dmin, dmax
+        self.gain = (dmax - dmin) / (self.pmax - self.pmin)
+
+        start = start or datetime.datetime.now()
+        ns = self.n_channels + 1
+        header = [
+            _field(version, 8),
+            _field(patient, 80),
+            _field(f"Startdate {start.strftime('%d-%b-%Y').upper()} {recording}", 80),
+            start.strftime("%d.%m.%y"),
+            start.strftime("%H.%M.%S"),
+            _field(256 * (ns + 1), 8),
+            _field(reserved, 44),
+            _field(n_records if self.count_known else -1, 8),
+            _number(record_s),
+            _field(ns, 4),
+        ]
+        header += [_field(label, 16) for label in labels] + [_field(ann_label, 16)]
+        header += [_field("", 80)] * ns
+        header += [_field(unit or "", 8) for unit in units] + [_field("", 8)]
+        header += [_number(v) for v in self.pmin] + [_number(-1)]
+        header += [_number(v) for v in self.pmax] + [_number(1)]
+        header += [_field(dmin, 8)] * ns
+        header += [_field(dmax, 8)] * ns
+        header += [_field("", 80)] * ns
+        header += [_field(self.spr, 8)] * self.n_channels + [_field(self.ann_samples, 8)]
+        header += [_field("", 32)] * ns
+        self.f.write("".join(header).encode("latin-1"))
+
+    def _encode(self, x):
+        d = np.rint((x - self.pmin[:, None]) * self.gain[:, None] + self.dmin)
+        d = np.clip(d, self.dmin, self.dmax).astype("<i4")
+        if self.width == 2:
+            return d.astype("<i2").tobytes()
+        # 24-bit little endian: the low three bytes of each int32
+        return d.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+    def annotate(self, onset, text, duration=None):
+        """Text annotation at `onset` seconds from the file start (e.g. a gap)."""
+        dur = f"\x15{duration:g}" if duration else ""
+        self.pending.append(f"+{onset:g}{dur}\x14{text}\x14\x00".encode())
+
+    def _annotation(self):
+        onset = self.records * self.record_s
+        tal = f"+{onset:g}\x14\x14\x00".encode()
+        size = self.ann_samples * self.width
+        # Queued annotations that do not fit wait for the next record
+        while self.pending and len(tal) + len(self.pending[0]) <= size:
+            tal += self.pending.pop(0)
+        return tal.ljust(size, b"\x00")
+
+    def _record(self):
+        self.f.write(self._encode(self.buf) + self._annotation())
+        self.records += 1
+        self.fill = 0
+
+    def write(self, block):
+        """Append physical samples (channels x n)."""
+        block = np.asarray(block)
+        pos = 0
+        while pos < block.shape[1]:
+            take = min(self.spr - self.fill, block.shape[1] - pos)
+            self.buf[:, self.fill:self.fill + take] = block[:, pos:pos + take]
+            self.fill += take
+            pos += take
+            if self.fill == self.spr:
+                self._record()
+
+    def close(self):
+        """Pad the last record (holding the last value) and fix the record count."""
+        if self.fill:
+            self.buf[:, self.fill:] = self.buf[:, self.fill - 1:self.fill]
+            self._record()
+        if not self.count_known and self.f.seekable():
+            self.f.seek(236)
+            self.f.write(_field(self.records, 8).encode())
+            self.f.seek(0, 2)
+
+
+def for_calibration(fileobj, calibration, fs, fmt="edf", uv_range=None, **kwargs):
+    """EdfWriter with labels, units and physical ranges from a Calibration.
+
+    Every channel gets its full ADC input range, except biopotentials in
+    16-bit EDF, where that range would swamp the signal: microvolt channels
+    at PGA gain 24 (ECG, EMG, EEG) are limited to +/-uv_range
+    (settings.EDF_UV_RANGE). The DC-coupled gain-2 sensor channels keep
+    the full range, their offsets sit far outside it.
+    """
+    phys_min, phys_max = calibration.physical_range()
+    if FORMATS[fmt][3] == 2:
+        uv_range = settings.EDF_UV_RANGE if uv_range is None else uv_range
+        bio = np.array([unit == "uV" for unit in calibration.units]) & (calibration.ads_gain == 24)
+        phys_min = np.where(bio, np.maximum(phys_min, -uv_range), phys_min)
+        phys_max = np.where(bio, np.minimum(phys_max, uv_range), phys_max)
+    return EdfWriter(fileobj, calibration.labels, calibration.units, fs, phys_min, phys_max, fmt=fmt, **kwargs)
+
+
+def iter_export(session, fmt="edf", t_start=None, t_end=None, channels=None, record_s=1):
+    """Yield an EDF+/BDF+ file of a recorded session as byte chunks.
+
+    The record count is known up front, so the output needs no seeking and
+    can go straight into an HTTP response; one chunk file is mapped at a time.
+    """
+    t_start = session.t0 if t_start is None else t_start
+    t_end = float("inf") if t_end is None else t_end
+    spr = int(round(session.fs * record_s))
+    n_records = -(-session.count(t_start, t_end) // spr)
+    out = io.BytesIO()
+    writer = for_calibration(out, session.calibration(channels), session.fs, fmt=fmt, record_s=record_s,
+                             start=datetime.datetime.fromtimestamp(t_start), n_records=n_records)
+
+    def drain():
+        data = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return data
+
+    yield drain()
+    for block, _ in session.calibrated(t_start, t_end, channels):
+        writer.write(block)
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def export_session(session, path, fmt="edf", **kwargs):
+    with open(path, "wb") as f:
+        for data in iter_export(session, fmt, **kwargs):
+            f.write(data)
+
+
+if __name__ == '__main__':
+    # python edf.py <session name> [edf|bdf] [output file]
+    import recording
+    session = recording.open_session(sys.argv[1])
+    fmt = sys.argv[2] if len(sys.argv) > 2 else "edf"
+    out_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(session.path, f"{session.meta['name']}.{fmt}")
+    export_session(session, out_path, fmt)
+    print(f"Exported {session.meta['name']} to {out_path}")
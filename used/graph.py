@@ -0,0 +1,209 @@
+import time
+
+import numpy as np
+
+from stream_dsp import Bandpass, make_mains_notch
+
+# Declarative processing graph.
+# A graph is a set of named nodes, each naming the nodes it reads:
+#   source   set from outside for every block (graph.push(raw=block))
+#   stream   stateful stage fed every block, in declaration order (filters,
+#            rolling windows): O(new samples), state never misses a block
+#   derive   analysis evaluated only when asked for (graph.get(name))
+# Every node runs at most once per block; its value is cached until the next
+# push, so consumers sharing an intermediate (display and heart rate both
+# reading the notched signal) reuse it, and a new analysis is one more
+# derive() on top of what is already computed.
+#
+# vitals_graph() is the per-channel chain of the MBS board:
+#   raw -> notch -> window
+#              \-> band/PPG -> band_window/PPG -> hr/PPG   (same for PCG, ECG)
+
+
+class Graph:
+    """Named processing nodes evaluated at most once per block."""
+
+    def __init__(self):
+        self.nodes = {}       # name -> (fn, inputs, streaming)
+        self.values = {}      # values of the current block
+        self.blocks = 0
+        self.runs = {}        # name -> evaluations
+        self.seconds = {}     # name -> time spent
+
+    def _add(self, name, fn, inputs, streaming):
+        if name in self.nodes:
+            raise ValueError(f"duplicate node {name!r}")
+        for dep in inputs:
+            if dep not in self.nodes:
+                raise KeyError(f"node {name!r} reads unknown node {dep!r}")
+        self.nodes[name] = (fn, tuple(inputs), streaming)
+        return name
+
+    def source(self, name):
+        return self._add(name, None, (), True)
+
+    def stream(self, name, fn, *inputs):
+        """Stage fed every block: fn(*input values) -> value."""
+        return self._add(name, fn, inputs, True)
+
+    def derive(self, name, fn, *inputs):
+        """Analysis evaluated on demand, once per block: fn(*input values) -> value."""
+        return self._add(name, fn, inputs, False)
+
+    def push(self, **sources):
+        """Start a block: set the sources, then run every stream stage once."""
+        self.values = dict(sources)
+        self.blocks += 1
+        for name, (fn, _, streaming) in self.nodes.items():
+            if streaming and fn is not None:
+                self.get(name)
+
+    def stage(self, name):
+        """The callable behind a node (e.g. a RollingWindow, for its buffer)."""
+        return self.nodes[name][0]
+
+    def get(self, name):
+        if name not in self.values:
+            fn, inputs, _ = self.nodes[name]
+            if fn is None:
+                raise KeyError(f"source {name!r} was not pushed")
+            args = [self.get(dep) for dep in inputs]
+            start = time.perf_counter()
+            self.values[name] = fn(*args)
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            self.runs[name] = self.runs.get(name, 0) + 1
+        return self.values[name]
+
+    def stats(self):
+        """{node: (evaluations, mean ms)} since the graph was built."""
+        return {name: (n, round(1e3 * self.seconds[name] / n, 4)) for name, n in self.runs.items()}
+
+
+class RollingWindow:
+    """Stage keeping the last `n` samples of its input, shifted in place.
+
+    Returns the filled part (channels x up to n); `buf` is the whole
+    window, zeros included, with rows that stay valid as views.
+    """
+
+    def __init__(self, n_channels, n, dtype=float):
+        self.buf = np.zeros((n_channels, int(n)), dtype=dtype)
+        self.filled = 0
+
+    def __call__(self, x):
+        x = np.atleast_2d(x)[:, -self.buf.shape[1]:]
+        k = x.shape[1]
+        if k:
+            self.buf[:, :self.buf.shape[1] - k] = self.buf[:, k:]
+            self.buf[:, -k:] = x
+            self.filled = min(self.buf.shape[1], self.filled + k)
+        return self.buf[:, self.buf.shape[1] - self.filled:]
+
+
+# --- Heart rate from band-passed windows ---
+def _rate(peaks, fs):
+    return int(60.0 / np.mean(np.diff(peaks) / fs)) if len(peaks) > 1 else '--'
+
+
+def _zscore(x):
+    std = np.std(x)
+    if not std > 0:
+        raise FloatingPointError("flat window")
+    return (x - np.mean(x)) / std
+
+
+def ppg_rate(f, fs):
+    from scipy.signal import find_peaks
+
+    peaks, _ = find_peaks(_zscore(f), distance=int(0.5 * fs), prominence=0.8)
+    return _rate(peaks, fs)
+
+
+def pcg_rate(f, fs):
+    from scipy.signal import find_peaks, hilbert
+
+    # S1 peaks on the Hilbert envelope of the 20-45 Hz band
+    peaks, _ = find_peaks(_zscore(np.abs(hilbert(f))), distance=int(0.6 * fs), prominence=1.0)
+    return _rate(peaks, fs)
+
+
+def ecg_rate(f, fs):
+    from scipy.signal import find_peaks
+
+    # Pan-Tompkins after the 5-15 Hz band: derivative, square, 150 ms integration
+    x = np.convolve(f, np.array([1, 2, 0, -2, -1]) / 8, mode='same') ** 2
+    w = int(0.15 * fs)
+    x = np.convolve(x, np.ones(w) / w, mode='same')
+    peaks, _ = find_peaks(x, distance=int(0.2 * fs), height=np.mean(x))
+    return _rate(peaks, fs)
+
+
+# label -> (band-pass low, high, order, rate estimator)
+VITALS = {
+    "PPG": (0.5, 5.0, 2, ppg_rate),
+    "PCG": (20.0, 45.0, 2, pcg_rate),
+    "ECG": (5.0, 15.0, 1, ecg_rate),
+}
+
+
+def _band_stage(label, i, band, window, usable):
+    skipped = [False]
+
+    def stage(x):
+        if usable is not None and not usable(label):
+            skipped[0] = True
+            return x[i:i + 1, :0]
+        if skipped[0]:
+            band.zi = None
+            window.filled = 0
+            skipped[0] = False
+        return band.process(x[i:i + 1])
+    return stage
+
+
+def _estimator(rate, window, fs):
+    def estimate(f):
+        if window.filled < window.buf.shape[1]:
+            return '--'
+        try:
+            return rate(f[0], fs)
+        except (ValueError, FloatingPointError) as e:
+            print("⚠️ HR error:", e)
+            return '--'
+    return estimate
+
+
+def vitals_graph(labels, fs, mains, window_s=1.0, hr=("PPG", "PCG"), notch=None, active=None,
+                 usable=None, dtype=float):
+    """Graph over calibrated blocks (channels x n, `labels` order) pushed as "raw".
+
+    "notch" is the mains comb notch (pass-through while notch() returns
+    False; active() may return the per-channel mask of channels to filter),
+    "window" its last window_s seconds, and "hr/<label>" the heart rate of
+    each vital in `hr` present in `labels`, from its own band-pass window.
+    While usable(label) is False a vital's band stages are skipped; they
+    restart from a fresh filter state and an empty window.
+    """
+    graph = Graph()
+    n = int(round(window_s * fs))
+    graph.source("raw")
+    stage = make_mains_notch(len(labels), fs, mains)
+
+    def filtered(x):
+        if notch is not None and not notch():
+            return x
+        return stage.process(x, active=None if active is None else active())
+    graph.stream("notch", filtered, "raw")
+    graph.stream("window", RollingWindow(len(labels), n, dtype), "notch")
+
+    for label in hr:
+        if label not in labels:
+            continue
+        low, high, order, rate = VITALS[label]
+        i = labels.index(label)
+        window = RollingWindow(1, n, dtype)
+        graph.stream(f"band/{label}", _band_stage(label, i, Bandpass(1, fs, low, high, order), window, usable),
+                     "notch")
+        graph.stream(f"band_window/{label}", window, f"band/{label}")
+        graph.derive(f"hr/{label}", _estimator(rate, window, fs), f"band_window/{label}")
+    return graph
@@ -0,0 +1,106 @@
+import numpy as np
+
+import settings
+from acquisition import RingBuffer
+
+# Multi-resolution history for zoomed-out views.
+# Each pyramid level reduces the next finer one into bins of min, max and
+# mean (e.g. 8x, 64x, 512x samples per bin), updated incrementally as
+# blocks arrive. A level is a RingBuffer of bins with rows
+# [min x C, max x C, mean x C, t], so coarser levels cover proportionally
+# longer spans for the same memory. Level 1x is the raw acquisition ring.
+
+STATS = ("min", "max", "mean")
+
+
+class _Level:
+    def __init__(self, factor, ratio, n_channels, bins, dtype):
+        self.factor = factor      # samples per bin
+        self.ratio = ratio        # finer-level bins per bin
+        self.n_channels = n_channels
+        self.ring = RingBuffer(3 * n_channels + 1, bins, timestamp_row=3 * n_channels, dtype=dtype)
+        self.tail = None          # finer bins waiting for a full bin: (lo, hi, mean, t)
+
+    def reduce(self, lo, hi, mean, t):
+        """Fold finer bins into this level; returns the newly completed bins."""
+        if self.tail is not None:
+            lo, hi, mean, t = (np.concatenate((a, b), axis=-1) for a, b in zip(self.tail, (lo, hi, mean, t)))
+        k = lo.shape[1] // self.ratio
+        used = k * self.ratio
+        self.tail = (lo[:, used:], hi[:, used:], mean[:, used:], t[used:])
+        shape = (self.n_channels, k, self.ratio)
+        out = (
+            lo[:, :used].reshape(shape).min(axis=2),
+            hi[:, :used].reshape(shape).max(axis=2),
+            mean[:, :used].reshape(shape).mean(axis=2),
+            t[:used:self.ratio],
+        )
+        if k:
+            self.ring.write(np.vstack((out[0], out[1], out[2], out[3][None, :])))
+        return out
+
+
+class MinMaxPyramid:
+    def __init__(self, n_channels, fs, factors=None, span_s=None, dtype=None):
+        factors = settings.PYRAMID_FACTORS if factors is None else factors
+        span_s = settings.PYRAMID_SPAN_S if span_s is None else span_s
+        self.fs = fs
+        self.n_channels = n_channels
+        self.origin = None        # sample seq of the first bin of every level
+        self.next_seq = None      # sample the next update() must start at
+        self.dtype = dtype
+        self.spec = []
+        prev = 1
+        for f in sorted(factors):
+            if f % prev:
+                raise ValueError(f"pyramid factor {f} is not a multiple of {prev}")
+            self.spec.append((f, f // prev, max(1, int(span_s * fs) // f)))
+            prev = f
+        self.levels = []
+        self.resets = 0
+
+    def _reset(self, seq):
+        self.levels = [_Level(f, ratio, self.n_channels, bins, self.dtype) for f, ratio, bins in self.spec]
+        self.origin = seq
+
+    def update(self, seq, x, timestamps):
+        """Feed contiguous samples (channels x n) starting at sample `seq`.
+
+        Bins are aligned on `origin`; when samples were skipped (a reader
+        overrun) the levels restart at `seq` instead of drifting.
+        """
+        if self.origin is None or seq != self.next_seq:
+            if self.origin is not None:
+                self.resets += 1
+                print(f"⚠️ History pyramid restarted at sample {seq} (expected {self.next_seq})")
+            self._reset(seq)
+        self.next_seq = seq + x.shape[1]
+        lo = hi = mean = x
+        t = np.asarray(timestamps, dtype=float)
+        for level in self.levels:
+            lo, hi, mean, t = level.reduce(lo, hi, mean, t)
+            if lo.shape[1] == 0:
+                break
+
+    def query(self, start, stop, width):
+        """Coarsest level with at least `width` bins in [start, stop).
+
+        Returns (factor, seq, stats, t0) with stats shaped (3, channels, bins)
+        and seq the first sample of the first bin, or None when no level
+        fills the width (the caller then serves raw samples).
+        """
+        if self.origin is None:
+            return None
+        for level in reversed(self.levels):
+            f = level.factor
+            b0 = max(0, (start - self.origin) // f)
+            b1 = -(-(stop - self.origin) // f)
+            if b1 - b0 < width:
+                continue
+            # Coarser levels reach further back, so this one covers the most
+            first, block = level.ring.read(b0, b1)
+            n = block.shape[1]
+            _, times = level.ring.read_times(first, first + n)
+            stats = block[:-1].reshape(3, self.n_channels, n)
+            return f, self.origin + first * f, stats, float(times[0]) if n else None
+        return None
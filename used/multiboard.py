@@ -0,0 +1,308 @@
+import threading
+import time
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+
+import settings
+from acquisition import Acquisition, Demand, RingBuffer, RingReader, open_board, close_board
+from annotations import AnnotationTrack
+from calibration import Calibration, MBS_BOARD_CONFIG
+
+# Several boards in one deployment.
+# Every board keeps its own Acquisition (own reader thread and ring). A
+# merge thread aligns them on the timestamps of the first live board (the
+# first board unless it is stale): each of its samples gets the
+# nearest-in-time sample of every other board, or NaN when none lies
+# within one sample period. The
+# merged ring holds the selected channels of all boards, namespaced as
+# "<board>/<label>", plus the master timestamp row, so consumers read it
+# with a RingReader exactly like a single board's ring.
+# A board that stops delivering for MERGE_STALE_S is not waited for: its
+# channels are NaN until it is back, and no board holds more than
+# MERGE_STALE_S of samples waiting for a slower one. BrainFlow timestamps
+# come from the host clock, so boards on one host are directly comparable.
+# Subscribers of the merged stream subscribe on every board, so all boards
+# park together and the merge thread sleeps while they are parked.
+
+# Channel label and board config per board type
+PROFILES = {
+    "mbs": ({
+        1: "ECG", 2: "PPG", 3: "PCG", 4: "EMG1", 5: "EMG2",
+        6: "MYOMETER", 7: "SPIRO", 8: "TEMPERATURE", 9: "NIBP", 10: "OXYGEN",
+        11: "EEG CH11", 12: "EEG CH12", 13: "EEG CH13", 14: "EEG CH14",
+        15: "EEG CH15", 16: "EEG CH16"
+    }, MBS_BOARD_CONFIG),
+    "eeg": ({ch: f"EEG_{ch}" for ch in range(1, 17)}, None),
+}
+
+
+def parse_boards(text):
+    """"name=port:profile,..." -> [(name, port, profile)]; port "synthetic" is BrainFlow's synthetic board."""
+    boards = []
+    for item in filter(None, (s.strip() for s in text.split(","))):
+        name, _, rest = item.partition("=")
+        port, _, profile = rest.partition(":")
+        boards.append((name, port, profile or "mbs"))
+    return boards
+
+
+class BoardNode:
+    """One board: BrainFlow session, acquisition thread and merge state."""
+
+    def __init__(self, name, port, profile="mbs"):
+        self.name = name
+        self.port = port
+        self.board_id = BoardIds.SYNTHETIC_BOARD.value if port == "synthetic" else BoardIds.CYTON_DAISY_BOARD.value
+        names, self.config = PROFILES[profile]
+        self.channels = BoardShim.get_eeg_channels(self.board_id)
+        self.period = 1.0 / BoardShim.get_sampling_rate(self.board_id)
+        base = [names.get(ch, f"CH{ch}") for ch in self.channels]
+        self.labels = [f"{name}/{label}" for label in base]
+        self.calibration = Calibration(base, self.channels, config=self.config)
+        self.board = None
+        self.acquisition = None
+        self.reader = None
+
+        # Samples read but not merged yet
+        self.pend = np.zeros((len(self.channels), 0))
+        self.pend_ts = np.zeros(0)
+        self.started = None
+        self.samples = 0
+        self.last_ts = None       # board timestamp of the newest sample read
+        self.filled = 0           # merged samples emitted as NaN for this board
+        self.offset_ms = None     # median |timestamp difference| of the last merge
+        self._rate = (None, 0)    # (monotonic time, samples) of the last health()
+
+    def _reopen(self):
+        params = BrainFlowInputParams()
+        if self.port != "synthetic":
+            params.serial_port = self.port
+        else:
+            params.other_info = self.name  # BrainFlow allows one session per identical params
+        return open_board(self.board_id, params, self.config)
+
+    def open(self):
+        self.board = self._reopen()
+        self.acquisition = Acquisition(self.board, self.board_id, reopen=self._reopen, idle=settings.ACQ_IDLE)
+        self.acquisition.start()
+        self.reader = self.acquisition.reader()
+        self.started = time.monotonic()
+
+    def close(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.board = self.acquisition.board  # replaced when the board was reopened
+        if self.board is not None:
+            close_board(self.board)
+            self.board = None
+
+    def pull(self):
+        seq, data = self.reader.read()
+        n = data.shape[1]
+        if n:
+            # float64 timestamps from the ring, not the float32 sample row
+            _, ts = self.acquisition.ring.read_times(seq, seq + n)
+            self.pend = np.concatenate((self.pend, data[self.channels]), axis=1)
+            self.pend_ts = np.concatenate((self.pend_ts, ts))
+            self.samples += n
+            self.last_ts = float(ts[-1])
+
+    def stale(self, now):
+        acq = self.acquisition
+        times = [self.started] if acq is None else [self.started, acq.stream_started, acq.last_data]
+        since = max((t for t in times if t is not None), default=None)
+        return since is None or now - since > settings.MERGE_STALE_S
+
+    def take(self, t):
+        """Channels x len(t) of the samples nearest to the master times `t`.
+
+        Samples more than one sample period away from their master time are NaN.
+        """
+        if not len(self.pend_ts):
+            self.filled += len(t)
+            return np.full((len(self.channels), len(t)), np.nan)
+        idx = np.clip(np.searchsorted(self.pend_ts, t), 1, max(1, len(self.pend_ts) - 1))
+        if len(self.pend_ts) == 1:
+            idx = np.zeros(len(t), dtype=int)
+        else:
+            earlier = np.abs(self.pend_ts[idx - 1] - t) <= np.abs(self.pend_ts[idx] - t)
+            idx = np.where(earlier, idx - 1, idx)
+        offset = np.abs(self.pend_ts[idx] - t)
+        self.offset_ms = float(np.median(offset)) * 1e3
+        block = self.pend[:, idx]
+        far = offset > self.period
+        if far.any():
+            block[:, far] = np.nan
+            self.filled += int(far.sum())
+        # Later master samples can still need the last matched sample
+        keep = int(idx[-1])
+        self.pend = self.pend[:, keep:]
+        self.pend_ts = self.pend_ts[keep:]
+        return block
+
+    def drop_before(self, t, side="left"):
+        keep = int(np.searchsorted(self.pend_ts, t, side=side))
+        self.pend = self.pend[:, keep:]
+        self.pend_ts = self.pend_ts[keep:]
+
+    def cap(self, span_s):
+        """Drop pending samples older than `span_s` before the newest one."""
+        if len(self.pend_ts):
+            self.drop_before(self.pend_ts[-1] - span_s)
+
+    def health(self, now):
+        acq = self.acquisition
+        prev_time, prev_samples = self._rate
+        rate = None
+        if prev_time is not None and now > prev_time:
+            rate = round((self.samples - prev_samples) / (now - prev_time), 1)
+        self._rate = (now, self.samples)
+        return {
+            "connected": not self.stale(now),
+            "parked": acq.parked if acq else False,
+            "samples": self.samples,
+            "rate_hz": rate,
+            "lag_ms": None if self.last_ts is None else round((time.time() - self.last_ts) * 1e3, 1),
+            "offset_ms": None if self.offset_ms is None else round(self.offset_ms, 2),
+            "filled": self.filled,
+            "errors": acq.errors if acq else 0,
+            "overruns": self.reader.overruns if self.reader else 0,
+        }
+
+
+class MultiAcquisition:
+    """Boards merged into one time-aligned ring; drop-in for Acquisition readers."""
+
+    def __init__(self, nodes, capacity_s=None, poll_s=None):
+        capacity_s = settings.ACQ_RING_S if capacity_s is None else capacity_s
+        self.nodes = list(nodes)
+        self.poll_s = settings.ACQ_POLL_S if poll_s is None else poll_s
+        self.fs = BoardShim.get_sampling_rate(self.nodes[0].board_id)
+        self.labels = [label for node in self.nodes for label in node.labels]
+        self.calibration = Calibration.concat([node.calibration for node in self.nodes], self.labels)
+        self.channels = list(range(len(self.labels)))
+        self.timestamp_row = len(self.labels)
+        self.ring = RingBuffer(len(self.labels) + 1, int(capacity_s * self.fs), self.timestamp_row)
+        self.annotations = AnnotationTrack()
+        self.demand = Demand()
+        self.last_t = -np.inf     # timestamp of the last merged sample
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for node in self.nodes:
+            node.open()
+            # Board events (restarts, errors) go on the merged track
+            node.acquisition.annotations.add_listener(
+                lambda event, name=node.name: self.annotate(
+                    board=name, **{k: v for k, v in event.items() if k not in ("seq", "t")}))
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="merge", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self.demand.wake()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        for node in self.nodes:
+            node.close()
+
+    def reader(self, backlog=0):
+        return RingReader(self.ring, backlog)
+
+    def subscribe(self):
+        self.demand.add()
+        for node in self.nodes:
+            node.acquisition.subscribe()
+
+    def unsubscribe(self):
+        self.demand.remove()
+        for node in self.nodes:
+            node.acquisition.unsubscribe()
+
+    def annotate(self, kind, text=None, seq=None, **data):
+        seq = self.ring.seq if seq is None else seq
+        t = self.ring.timestamp(seq - 1) if seq == self.ring.seq else self.ring.timestamp(seq)
+        return self.annotations.add(kind, seq, time.time() if t is None else t, text, **data)
+
+    def gaps(self, seq, n):
+        return self.annotations.range(seq, seq + n, kind="gap")
+
+    def health(self):
+        now = time.monotonic()
+        return {node.name: node.health(now) for node in self.nodes}
+
+    def merge(self):
+        """Merge everything that can be aligned now; returns the number of samples written."""
+        now = time.monotonic()
+        for node in self.nodes:
+            node.pull()
+        live = [node for node in self.nodes if not node.stale(now)]
+        if not live:
+            for node in self.nodes:
+                node.cap(settings.MERGE_STALE_S)
+            return 0
+        # The first live board sets the time grid; a stale first board is NaN-filled
+        master = live[0]
+        master.drop_before(self.last_t, side="right")  # after a switch, keep time increasing
+        t = master.pend_ts
+        limit = len(t)
+        for node in live[1:]:
+            # Wait until the board has delivered up to the master time
+            last = node.pend_ts[-1] if len(node.pend_ts) else -np.inf
+            limit = min(limit, int(np.searchsorted(t, last, side="right")))
+        if len(t):
+            # ...but never longer than MERGE_STALE_S: late samples then read NaN
+            limit = max(limit, int(np.searchsorted(t, t[-1] - settings.MERGE_STALE_S, side="right")))
+        if limit:
+            self._emit(master, live, t[:limit])
+        for node in self.nodes:
+            if node is not master:
+                node.cap(settings.MERGE_STALE_S)
+        return limit
+
+    def _emit(self, master, live, emit):
+        limit = len(emit)
+        blocks = []
+        for node in self.nodes:
+            if node is master:
+                blocks.append(master.pend[:, :limit])
+            elif node in live:
+                blocks.append(node.take(emit))
+            else:
+                node.filled += limit
+                node.drop_before(emit[-1])
+                blocks.append(np.full((len(node.channels), limit), np.nan))
+        blocks.append(emit[None, :])
+        master.pend = master.pend[:, limit:]
+        master.pend_ts = master.pend_ts[limit:]
+        self.last_t = float(emit[-1])
+        self.ring.write(np.vstack(blocks))
+
+    def _run(self):
+        deadline = time.monotonic()
+        while self._running.is_set():
+            if settings.ACQ_IDLE and self.demand.idle():
+                # The boards park on the same grace: merge what they sent, then sleep
+                self.merge()
+                self.demand.wait()
+                deadline = time.monotonic()
+                continue
+            self.merge()
+            deadline += self.poll_s
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+
+def open_boards(text=None):
+    """MultiAcquisition for settings.BOARDS (not started)."""
+    specs = parse_boards(settings.BOARDS if text is None else text)
+    if not specs:
+        raise ValueError("no boards configured (BIOPULSE_BOARDS)")
+    return MultiAcquisition([BoardNode(*spec) for spec in specs])
@@ -1,3 +1,4 @@
+import startup  # first import: starts the startup clock
 import asyncio
 import websockets
 import json
@@ -5,13 +6,24 @@ import time
 import signal
 import sys
 import numpy as np
-from scipy.signal import iirnotch, filtfilt, butter, find_peaks, hilbert
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, BrainFlowError
+from payload import build_signals, dumps
+from acquisition import Acquisition, board_opener
+from stream_dsp import make_normalizer, resolve_mains
+from graph import vitals_graph
+from scheduler import SendScheduler
+import runtime
+from beats import StreamingPanTompkins, HrvTracker
+from quality import make_quality, ppg_sqi
+from calibration import Calibration, MBS_BOARD_CONFIG
+import settings
 
 # --- Setup ---
 board = None
 board_initialized = False
+acquisition = None
 is_running = True
+mains_hz = 60.0  # replaced by the detected/configured value at startup
 board_id = BoardIds.CYTON_DAISY_BOARD.value
 
 params = BrainFlowInputParams()
@@ -25,6 +37,9 @@ channel_names = {
     11: "EEG CH11", 12: "EEG CH12", 13: "EEG CH13", 14: "EEG CH14",
     15: "EEG CH15", 16: "EEG CH16"
 }
+calibration = Calibration(
+    [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels], eeg_channels, config=MBS_BOARD_CONFIG
+)
 
 # --- Signal Handling ---
 def signal_handler(sig, frame):
@@ -34,6 +49,9 @@ def signal_handler(sig, frame):
 
 def cleanup():
     global board, board_initialized
+    if acquisition is not None:
+        acquisition.stop()
+        board = acquisition.board  # replaced when the board was reopened
     if board and board_initialized:
         try:
             board.stop_stream()
@@ -49,136 +67,220 @@ def cleanup():
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
-# --- Filter Utils ---
-def safe_filter(data, b, a):
-    padlen = 3 * max(len(a), len(b))
-    if len(data) <= padlen:
-        return None
-    return filtfilt(b, a, data)
-
-def notch_filter(data, freq, fs, quality=30):
-    nyq = 0.5 * fs
-    b, a = iirnotch(freq / nyq, quality)
-    return safe_filter(data, b, a)
+# --- HR Estimators ---
+# ECG HR comes from the streaming Pan-Tompkins detector fed by graph_task();
+# PPG and PCG HR are nodes of the shared processing graph (graph.py)
+ecg_detector = None
+hrv_values = {}  # {"60s": {...}, "300s": {...}}, refreshed every HRV_PUBLISH_S
 
-def bandpass_filter(sig, fs, low, high):
-    b, a = butter(2, [low / (fs / 2), high / (fs / 2)], btype='band')
-    return safe_filter(sig, b, a)
+# --- Signal Quality ---
+# Flags from the raw samples; channels flagged bad skip the notch, the HR
+# estimators and the beat detector until the signal is usable again
+quality = None
+sqi_values = {}  # {label: 0-1}, refreshed every SQI_PUBLISH_S
 
-def normalize(data):
-    if np.ptp(data) == 0:
-        return np.zeros_like(data)
-    return (data - np.min(data)) / (np.max(data) - np.min(data))
+def usable(ch):
+    return quality is None or not quality.bad[eeg_channels.index(ch)]
 
-# --- HR Estimators ---
-def pan_tompkins_hr(ecg, fs):
-    try:
-        b, a = butter(1, [5 / (0.5 * fs), 15 / (0.5 * fs)], btype='band')
-        x = safe_filter(ecg, b, a)
-        if x is None:
-            return '--'
-        x = np.convolve(x, np.array([1, 2, 0, -2, -1]) / 8, mode='same')
-        x = x ** 2
-        x = np.convolve(x, np.ones(int(0.15 * fs)) / int(0.15 * fs), mode='same')
-        peaks, _ = find_peaks(x, distance=int(0.2 * fs), height=np.mean(x))
-        return int(60.0 / np.mean(np.diff(peaks) / fs)) if len(peaks) > 1 else '--'
-    except:
-        return '--'
-
-def estimate_hr_from_ppg(ppg, fs):
+async def quality_task():
     try:
-        f = bandpass_filter(ppg, fs, 0.5, 5)
-        if f is None:
-            return '--'
-        norm_f = (f - np.mean(f)) / np.std(f)
-        peaks, _ = find_peaks(norm_f, distance=int(0.5 * fs), prominence=0.8)
-        return int(60.0 / np.mean(np.diff(peaks) / fs)) if len(peaks) > 1 else '--'
-    except:
-        return '--'
-
-def estimate_hr_from_pcg(pcg, fs):
-    try:
-        f = bandpass_filter(pcg, fs, 20, 45)
-        if f is None:
-            return '--'
-        env = np.abs(hilbert(f))
-        norm_env = (env - np.mean(env)) / np.std(env)
-        peaks, _ = find_peaks(norm_env, distance=int(0.6 * fs), prominence=1.0)
-        return int(60.0 / np.mean(np.diff(peaks) / fs)) if len(peaks) > 1 else '--'
-    except:
-        return '--'
-
-# --- WebSocket Handler ---
+        reader = acquisition.reader()
+        while is_running:
+            if not await reader.wait_async(timeout=1.0):
+                continue
+            _, raw_data = reader.read()
+            quality.update(raw_data[eeg_channels])
+    except Exception as e:
+        print("🚨 Quality monitor error:", e)
+
+# --- WebSocket Handlers ---
+# Clients only receive: graph_task() filters every block once and
+# broadcasts the same serialized frame to all of them
+eeg_clients = set()
+
 async def eeg_handler(websocket, path):
     print("🔌 Client connected")
+    eeg_clients.add(websocket)
+    acquisition.subscribe()
+    try:
+        await websocket.wait_closed()
+    finally:
+        acquisition.unsubscribe()
+        eeg_clients.discard(websocket)
+        print("❌ Client disconnected")
+
+# --- ECG Beat Event Stream ---
+beat_clients = set()
+
+async def beat_handler(websocket, path):
+    print("🔌 Beat client connected")
+    beat_clients.add(websocket)
+    acquisition.subscribe()
+    try:
+        await websocket.wait_closed()
+    finally:
+        acquisition.unsubscribe()
+        beat_clients.discard(websocket)
+        print("❌ Beat client disconnected")
+
+def new_hrv_trackers():
+    return {f"{w:g}s": HrvTracker(w) for w in settings.HRV_WINDOWS_S}
+
+hrv_trackers = {}
+
+def detect_beats(seq, raw_ecg, bp_ecg, fs):
+    """Feed the beat detector one block: raw ECG row plus the graph's band/ECG."""
+    global ecg_detector, hrv_trackers
+    n_new = len(raw_ecg)
+    if any(e["kind"] in ("idle", "gap") for e in acquisition.annotations.range(seq, seq + n_new)):
+        # Parked or reconnected: the samples are not contiguous in time,
+        # so no RR interval may span the break
+        ecg_detector = None
+        hrv_trackers = new_hrv_trackers()
+    if not usable(1) or bp_ecg.shape[-1] != n_new:
+        # Unusable ECG: drop the detector, it relearns on good signal
+        ecg_detector = None
+        return
+    if ecg_detector is None:
+        ecg_detector = StreamingPanTompkins(fs)
+    _, timestamps = acquisition.ring.read_times(seq, seq + n_new)
+    for event in ecg_detector.update(raw_ecg, timestamps, bp=bp_ecg[0]):
+        # Detector index -> ring sample, counted back from the block end
+        event["seq"] = seq + n_new - (ecg_detector.n - event["seq"])
+        acquisition.annotate("beat", seq=event["seq"], hr=event["hr"])
+        for tracker in hrv_trackers.values():
+            tracker.add(event["t"], event["rr"])
+        if beat_clients:
+            websockets.broadcast(beat_clients, dumps(event))
+
+def publish_sqi(labels, window, full):
+    """SQI frame: line-noise index from the quality monitor, ECG from the beat
+    detector, PPG from the graph's display window (no extra copy)."""
+    overrides = {"ECG": ecg_detector.quality() if ecg_detector else None}
+    if "PPG" in labels and full:
+        i = labels.index("PPG")
+        # Calibrated output is in physical polarity already; raw PPG is inverted
+        sign = 1.0 if settings.CALIBRATE else np.sign(calibration.gain[i])
+        overrides["PPG"] = ppg_sqi(window[i], sign)
+    return quality.sqi_frame(labels, overrides)
+
+async def graph_task():
+    global hrv_values, hrv_trackers, sqi_values
     try:
         fs = BoardShim.get_sampling_rate(board_id)
         interval = 1.0 / fs
-        send_interval = 1.0 / 125
+        reader = acquisition.reader()
+        scheduler = SendScheduler(fs, name="norm+filter send")
+        labels = [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels]
+        # raw -> notch -> window -> display, and notch -> band -> HR / beats
+        # (graph.py); notch-skipped channels pass through with their filter
+        # state kept, quality-gated vitals skip their band stages
+        graph = vitals_graph(labels, fs, mains_hz, hr=("PPG", "PCG", "ECG"),
+                             active=lambda: None if quality is None else ~quality.bad,
+                             usable=lambda label: usable(eeg_channels[labels.index(label)]),
+                             dtype=settings.SAMPLE_DTYPE)
+        # Scale only moves with the new samples; old extremes fade out smoothly
+        normalizer = make_normalizer(len(eeg_channels), fs)
+        graph.stream("scale", normalizer.update, "notch")
+        graph.derive("display", lambda window, _: normalizer.apply(window), "window", "scale")
+        hrv_trackers = new_hrv_trackers()
+        hrv_published = sqi_published = 0.0
+        window_len = graph.stage("window").buf.shape[1]
 
         while is_running:
-            raw_data = board.get_current_board_data(250)
-            if raw_data.shape[1] < 10:
-                await asyncio.sleep(0.05)
+            await scheduler.tick()
+            batch = scheduler.take(reader)
+            if batch is None:
+                continue
+            new_seq, new_data = batch
+            n_new = new_data.shape[1]
+            if n_new == 0:
                 continue
 
             timestamp_now = time.time()
-            sensor_data = {}
-
-            for ch in eeg_channels:
-                label = channel_names.get(ch, f"CH{ch}")
-                samples = raw_data[ch]
-                filtered = notch_filter(samples, 60.0, fs)
-                if filtered is None or len(filtered) < 10:
-                    continue
-                normed = normalize(filtered)
-                sensor_data[label] = [
-                    {"x": timestamp_now - (len(normed) - i - 1) * interval, "y": float(round(normed[i], 6))}
-                    for i in range(len(normed))
-                ]
-
-            if not sensor_data:
+            calibrated, _ = calibration.transport(new_data[eeg_channels])
+            graph.push(raw=calibrated)
+            detect_beats(new_seq, new_data[eeg_channels[0]], graph.get("band/ECG"), fs)
+            if timestamp_now - hrv_published >= settings.HRV_PUBLISH_S:
+                hrv_values = {name: t.metrics(timestamp_now) for name, t in hrv_trackers.items()}
+                hrv_published = timestamp_now
+            if quality is not None and timestamp_now - sqi_published >= settings.SQI_PUBLISH_S:
+                window = graph.get("window")
+                sqi_values = publish_sqi(labels, window, window.shape[1] == window_len)
+                sqi_published = timestamp_now
+            if not eeg_clients:
                 continue
 
+            seq = reader.seq - graph.get("window").shape[1]
+            sensor_data = build_signals(
+                np.round(graph.get("display"), 6), labels, timestamp_now, interval, seq,
+                legacy_key="x", gaps=acquisition.gaps(new_seq, n_new)
+            )
             hr_values = {
-                "ECG": pan_tompkins_hr(raw_data[1], fs),
-                "PPG": estimate_hr_from_ppg(raw_data[2], fs),
-                "PCG": estimate_hr_from_pcg(raw_data[3], fs)
+                "ECG": ecg_detector.heart_rate() if ecg_detector else '--',
+                "PPG": graph.get("hr/PPG") if usable(2) else '--',
+                "PCG": graph.get("hr/PCG") if usable(3) else '--'
             }
-
             payload = {
                 "signals": sensor_data,
                 "heartrate": hr_values,
+                "quality": quality.frame(labels) if quality is not None else {},
+                "sqi": sqi_values,
+                "hrv": hrv_values,
                 "timestamp": timestamp_now
             }
 
-            await websocket.send(json.dumps(payload))
-            await asyncio.sleep(send_interval)
-    except websockets.ConnectionClosed:
-        print("❌ Client disconnected")
+            websockets.broadcast(eeg_clients, dumps(payload))
+            scheduler.sent(n_new)
+            startup.first_frame()
+            scheduler.maybe_report()
     except Exception as e:
-        print("🚨 Handler error:", e)
+        print("🚨 Processing graph error:", e)
 
 # --- Main Entry ---
 async def main():
-    global board, board_initialized
+    global board, board_initialized, acquisition, mains_hz, quality
+    startup.mark("imports")
+    # SciPy loads while the board is being set up
+    startup.preload()
     board = BoardShim(board_id, params)
     try:
         print("🔄 Preparing BrainFlow session...")
         board.prepare_session()
-        board.config_board(
-            'x1060100Xx2010000Xx3010000Xx4060000Xx5060000Xx6010000Xx7010000Xx8010000X'
-            'xQ010000XxW010000XxE010000XxR010000XxT010000XxY010000XxU010000XxI010000X'
-        )
+        board.config_board(MBS_BOARD_CONFIG)
         time.sleep(0.5)
+        startup.mark("session")
         board.start_stream()
         board_initialized = True
+        acquisition = Acquisition(board, board_id, reopen=board_opener(board_id, params.serial_port, MBS_BOARD_CONFIG),
+                                  idle=settings.ACQ_IDLE)
+        acquisition.subscribe()  # until the mains frequency is known
+        acquisition.start()
         print("✅ Streaming started")
+        startup.mark("stream")
+
+        # Mains frequency is detected once from the first seconds of data
+        fs = BoardShim.get_sampling_rate(board_id)
+        if settings.MAINS_HZ == "auto":
+            await asyncio.sleep(2.0)
+        _, first_block = acquisition.ring.latest(2 * fs)
+        acquisition.unsubscribe()
+        mains_hz = resolve_mains(calibration.apply(first_block[eeg_channels]), fs)
+        print(f"⚡ Mains filter at {mains_hz:g} Hz")
+        quality = make_quality(calibration, fs, mains_hz)
+        startup.mark("mains detection")
 
         ip = '0.0.0.0'
         port = 5555
-        async with websockets.serve(eeg_handler, ip, port):
-            print(f"🌐 WebSocket Server running at ws://{ip}:{port}")
+        beat_port = port + settings.BEATS_PORT_OFFSET
+        async with websockets.serve(eeg_handler, ip, port, **runtime.ws_options()), \
+                websockets.serve(beat_handler, ip, beat_port, **runtime.ws_options()):
+            print(f"🌐 WebSocket Server running at ws://{ip}:{port} ({runtime.loop_name()})")
+            print(f"🌐 Beat event stream at ws://{ip}:{beat_port}")
+            startup.mark("listening")
+            startup.report()
+            quality_worker = asyncio.create_task(quality_task())
+            graph_worker = asyncio.create_task(graph_task())
             await asyncio.Future()
     except Exception as e:
         print("🚨 Error:", e)
@@ -186,4 +288,4 @@ async def main():
         cleanup()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    runtime.run(main)
@@ -0,0 +1,207 @@
+import json
+import struct
+import time
+import numpy as np
+
+import settings
+from stream_dsp import Decimator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- Serializer ---
+_ORJSON_OPTS = orjson.OPT_SERIALIZE_NUMPY if orjson is not None else 0
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Serialize a payload to a JSON text frame (NumPy arrays allowed)."""
+    if orjson is not None and settings.USE_ORJSON:
+        return orjson.dumps(obj, option=_ORJSON_OPTS).decode()
+    return json.dumps(obj, default=_json_default, separators=(",", ":"))
+
+
+def serializer_name():
+    return "orjson" if orjson is not None and settings.USE_ORJSON else "json"
+
+
+# --- Frame builders ---
+def channel_frame(samples, t0, dt, seq, unit=None, gaps=None):
+    # orjson needs a contiguous array; row slices of board data are already
+    frame = {"t0": t0, "dt": dt, "seq": int(seq), "y": np.ascontiguousarray(samples)}
+    if unit:
+        frame["unit"] = unit
+    if gaps:
+        frame["gaps"] = gaps
+    return frame
+
+
+def legacy_points(samples, t_last, dt, key="__timestamp__"):
+    n = len(samples)
+    return [
+        {"y": val, key: t_last - (n - i - 1) * dt}
+        for i, val in enumerate(samples.tolist())
+    ]
+
+
+def build_signals(rows, labels, t_last, dt, seq, schema=None, legacy_dt=None, legacy_key="__timestamp__",
+                  units=None, gaps=None):
+    """Build the per-channel signal dict for one frame.
+
+    rows     -- 2-D array, one row per channel (already typed/rounded)
+    labels   -- channel labels, same order as rows
+    t_last   -- wall-clock time of the last sample in the frame
+    dt       -- sample period of the rows
+    seq      -- sample index of the first sample in the frame
+    units    -- optional unit per channel (columnar schema only)
+    gaps     -- "gap" annotation events starting in this frame (columnar only):
+                the samples from event["seq"] on follow a board reconnect
+
+    Slow channels can be thinned further by RateTiers (own dt/seq per tier)
+    and ChangeOnly (frames with "n" and "i": only the changed samples).
+    """
+    schema = schema or settings.PAYLOAD_SCHEMA
+    if schema == "legacy":
+        step = dt if legacy_dt is None else legacy_dt
+        return {
+            label: legacy_points(row, t_last, step, legacy_key)
+            for label, row in zip(labels, rows)
+        }
+    t0 = t_last - (rows.shape[1] - 1) * dt
+    units = units or [None] * len(labels)
+    return {
+        label: channel_frame(row, t0, dt, seq, unit, gaps)
+        for label, row, unit in zip(labels, rows, units)
+    }
+
+
+class RateTiers:
+    """Per-channel output rates for build_signals().
+
+    Channels with a rate in `rates` (label -> Hz, default
+    settings.CHANNEL_RATES) below the board rate are low-pass decimated by
+    round(fs / rate); channels sharing a factor form one tier. A tier's
+    frames have dt = factor / fs and seq = board seq // factor, and a frame
+    only carries a tier's channels when it has a new output sample for them.
+    """
+
+    def __init__(self, labels, fs, rates=None):
+        rates = settings.CHANNEL_RATES if rates is None else rates
+        self.labels = list(labels)
+        self.fs = fs
+        groups = {}
+        for i, label in enumerate(self.labels):
+            factor = max(1, int(round(fs / rates[label]))) if rates.get(label) else 1
+            groups.setdefault(factor, []).append(i)
+        self.full = groups.pop(1, [])
+        self.tiers = [(factor, idx, Decimator(len(idx), fs, factor)) for factor, idx in sorted(groups.items())]
+
+    def build(self, rows, t_last, seq, units=None, gaps=None):
+        """build_signals() for a frame of board-rate rows (one per label)."""
+        dt = 1.0 / self.fs
+        units = units or [None] * len(self.labels)
+        if not self.tiers:
+            return build_signals(rows, self.labels, t_last, dt, seq, units=units, gaps=gaps)
+        signals = build_signals(rows[self.full], [self.labels[i] for i in self.full], t_last, dt, seq,
+                                units=[units[i] for i in self.full], gaps=gaps)
+        last = seq + rows.shape[1] - 1
+        for factor, idx, decimator in self.tiers:
+            start, y = decimator.process(rows[idx], seq)
+            if y.shape[1] == 0:
+                continue
+            if np.issubdtype(rows.dtype, np.integer):
+                y = np.rint(y)
+            elif units[idx[0]] is not None:
+                y = np.round(y, settings.CALIBRATED_DECIMALS)
+            t_tier = t_last - (last - (start + (y.shape[1] - 1) * factor)) * dt
+            # Gap events point at the first tier sample on or after the gap
+            tier_gaps = [dict(g, seq=-(-g["seq"] // factor)) for g in gaps] if gaps else None
+            signals.update(build_signals(y.astype(rows.dtype), [self.labels[i] for i in idx], t_tier,
+                                         factor * dt, start // factor, units=[units[i] for i in idx],
+                                         gaps=tier_gaps))
+        return signals
+
+
+class ChangeOnly:
+    """Deadband (change-only) encoding of columnar channel frames, per connection.
+
+    A channel in `tolerances` (label -> tolerance in the sent units, default
+    settings.CHANNEL_DEADBAND) keeps only the samples that differ from the
+    last value sent by more than the tolerance. Its frame gets "n" (samples
+    covered) and "i" (offset of each kept sample in "y"); the client holds
+    each value until the next one. Every `keyframe_s` the newest sample is
+    sent with "key": true so late joiners resynchronize. A frame with
+    nothing to send for the channel is left out.
+    """
+
+    def __init__(self, tolerances=None, keyframe_s=None):
+        self.tolerances = settings.CHANNEL_DEADBAND if tolerances is None else tolerances
+        self.keyframe_s = settings.DEADBAND_KEYFRAME_S if keyframe_s is None else keyframe_s
+        self.last = {}      # label -> last value sent
+        self.key_at = {}    # label -> time of the last keyframe
+
+    def _encode(self, label, frame, now):
+        y = np.asarray(frame["y"])
+        tol = self.tolerances[label]
+        last = self.last.get(label)
+        offsets = []
+        # Few samples per frame on the slow channels this is meant for
+        for i, v in enumerate(y.tolist()):
+            if last is None or abs(v - last) > tol:
+                offsets.append(i)
+                last = v
+        key = now - self.key_at.get(label, -np.inf) >= self.keyframe_s
+        if key:
+            self.key_at[label] = now
+            if not offsets or offsets[-1] != len(y) - 1:
+                offsets.append(len(y) - 1)
+                last = y[-1].item()
+        self.last[label] = last
+        if not offsets and not frame.get("gaps"):
+            return None
+        encoded = dict(frame, n=len(y), i=offsets, y=y[offsets])
+        if key:
+            encoded["key"] = True
+        return encoded
+
+    def apply(self, signals, now=None):
+        """Encode the deadband channels of a build_signals() dict in place (columnar only)."""
+        if not self.tolerances or settings.PAYLOAD_SCHEMA == "legacy":
+            return signals
+        now = time.monotonic() if now is None else now
+        for label in self.tolerances:
+            frame = signals.get(label)
+            if frame is None or not len(frame["y"]):
+                continue
+            encoded = self._encode(label, frame, now)
+            if encoded is None:
+                del signals[label]
+            else:
+                signals[label] = encoded
+        return signals
+
+
+def binary_header(header, dtype, shape):
+    """uint32 LE length + JSON header, space-padded to an 8-byte boundary.
+
+    The header gets "dtype" (NumPy str, e.g. "<f4") and "shape" of the array
+    that follows, so it can be viewed in place (e.g. a JS Float32Array).
+    """
+    head = dumps(dict(header, dtype=np.dtype(dtype).str, shape=list(shape))).encode()
+    head += b" " * (-(4 + len(head)) % 8)
+    return struct.pack("<I", len(head)) + head
+
+
+def binary_frame(header, array):
+    """Binary frame: binary_header() followed by the raw C-order array bytes."""
+    array = np.ascontiguousarray(array)
+    return binary_header(header, array.dtype, array.shape) + array.tobytes()
@@ -0,0 +1,151 @@
+import numpy as np
+
+import settings
+
+# Per-channel signal quality flags from raw board samples (microvolts,
+# before calibration). New samples go into a short circular window; every
+# `hop` samples all channels are checked in one vectorized pass:
+#   railed      a sample at the ADS1299 full-scale limit (clipped input)
+#   flat        peak-to-peak below a few ADC counts (shorted or dead input)
+#   line_noise  mains and harmonics carry most of the window's variance
+#   lead_off    DC offset near full scale: with an open input the bias
+#               drive pulls the channel towards a rail. The Cyton stream has
+#               no lead-off status bits, so this is inferred from the data.
+# The window is kept at float64: flat detection works at the count level
+# on top of offsets of up to a volt.
+#
+# The same pass grades every channel with a 0-1 quality index (`sqi`): the
+# share of variance that is not mains. It needs the raw (un-notched) samples,
+# so it reads this window, which the flags keep anyway. Flagged channels get
+# 0. The ECG index comes from the beat detector (template correlation) and
+# the PPG index (ppg_sqi) from the display window the processing graph holds.
+
+FLAGS = ("railed", "flat", "line_noise", "lead_off")
+
+
+class QualityMonitor:
+    def __init__(self, n_channels, fs, full_scale_uv, lsb_uv, mains=None, window=None, hop=None, gate=None):
+        self.fs = fs
+        self.n = int(settings.QUALITY_WINDOW_S * fs) if window is None else int(window)
+        self.hop = max(1, int(settings.QUALITY_HOP_S * fs) if hop is None else int(hop))
+        gate = settings.QUALITY_GATE if gate is None else gate
+        self.gate = np.array([f in gate for f in FLAGS])
+
+        self.rail = settings.QUALITY_RAIL_FRACTION * np.asarray(full_scale_uv, dtype=float)
+        self.leadoff = settings.QUALITY_LEADOFF_FRACTION * np.asarray(full_scale_uv, dtype=float)
+        self.flat = settings.QUALITY_FLAT_COUNTS * np.asarray(lsb_uv, dtype=float)
+
+        self.buf = np.zeros((n_channels, self.n))
+        self.pos = 0
+        self.filled = 0
+        self.since_hop = 0
+
+        self.flags = np.zeros((len(FLAGS), n_channels), dtype=bool)
+        self.bad = np.zeros(n_channels, dtype=bool)
+        self.sqi = np.zeros(n_channels)
+        self.set_mains(mains)
+
+    def set_mains(self, mains):
+        """DFT rows at the mains fundamental and harmonics below Nyquist.
+
+        With a whole-second window these are exact bins, so their power does
+        not depend on where the circular window starts.
+        """
+        self.basis = None
+        if mains:
+            freqs = np.arange(mains, self.fs / 2, mains)
+            self.basis = np.exp(-2j * np.pi * np.outer(np.arange(self.n), freqs) / self.fs)
+
+    def _write(self, x):
+        n = x.shape[1]
+        if n >= self.n:
+            self.buf[:] = x[:, -self.n:]
+            self.pos = 0
+        else:
+            end = self.pos + n
+            if end <= self.n:
+                self.buf[:, self.pos:end] = x
+            else:
+                first = self.n - self.pos
+                self.buf[:, self.pos:] = x[:, :first]
+                self.buf[:, :n - first] = x[:, first:]
+            self.pos = end % self.n
+        self.filled = min(self.n, self.filled + n)
+
+    def _evaluate(self):
+        x = self.buf
+        mean = x.mean(axis=1)
+        railed, flat, line_noise, lead_off = self.flags
+        np.greater_equal(np.abs(x).max(axis=1), self.rail, out=railed)
+        np.less(np.ptp(x, axis=1), self.flat, out=flat)
+        np.greater(np.abs(mean), self.leadoff, out=lead_off)
+        xc = x - mean[:, None]
+        var = np.einsum("ij,ij->i", xc, xc) / self.n
+        safe_var = np.where(var > 0, var, 1.0)
+        sqi = np.ones_like(var)
+        if self.basis is not None:
+            spec = xc @ self.basis
+            # A sinusoid of amplitude A has |X| = A n / 2 and variance A^2 / 2
+            mains_var = 2.0 * (spec.real ** 2 + spec.imag ** 2).sum(axis=1) / self.n ** 2
+            np.greater(mains_var, settings.QUALITY_LINE_RATIO * var, out=line_noise)
+            line_noise &= var > 0
+            sqi = np.clip(1.0 - mains_var / safe_var, 0.0, 1.0)
+        self.bad = self.flags[self.gate].any(axis=0)
+        sqi[self.bad | (var == 0)] = 0.0
+        self.sqi = sqi
+
+    def update(self, x):
+        """Feed raw samples (channels x n). Returns True when the flags were re-evaluated."""
+        x = np.atleast_2d(x)
+        evaluated = False
+        while x.shape[1]:
+            take = min(self.hop - self.since_hop, x.shape[1])
+            self._write(x[:, :take])
+            x = x[:, take:]
+            self.since_hop += take
+            if self.since_hop == self.hop:
+                self.since_hop = 0
+                if self.filled == self.n:
+                    self._evaluate()
+                    evaluated = True
+        return evaluated
+
+    def good(self, i):
+        return not self.bad[i]
+
+    def frame(self, labels):
+        """{label: [flags]} for the stream; an empty list means usable."""
+        return {
+            label: [name for name, flagged in zip(FLAGS, self.flags[:, i]) if flagged]
+            for i, label in enumerate(labels)
+        }
+
+    def sqi_frame(self, labels, overrides=None):
+        """{label: 0-1 index}; `overrides` replaces entries (e.g. the ECG detector's)."""
+        values = {label: round(float(v), 3) for label, v in zip(labels, self.sqi)}
+        for label, value in (overrides or {}).items():
+            if label in values and value is not None and values[label] > 0:
+                values[label] = round(value, 3)
+        return values
+
+
+def ppg_sqi(x, sign=1.0):
+    """0-1 PPG index of a window in physical polarity (sign flips a raw one).
+
+    Geometric mean of the perfusion (AC/DC) and the skewness of the pulse
+    wave, scaled by SQI_PPG_PERFUSION and SQI_PPG_SKEW.
+    """
+    x = np.asarray(x, dtype=float)
+    mean = x.mean()
+    xc = x - mean
+    var = np.dot(xc, xc) / len(x)
+    if not var > 0:
+        return 0.0
+    perfusion = np.ptp(x) / max(abs(mean), 1e-9)
+    skew = sign * (xc ** 3).mean() / var ** 1.5
+    return float(np.sqrt(np.clip(perfusion / settings.SQI_PPG_PERFUSION, 0.0, 1.0)
+                         * np.clip(skew / settings.SQI_PPG_SKEW, 0.0, 1.0)))
+
+
+def make_quality(calibration, fs, mains=None):
+    return QualityMonitor(len(calibration.labels), fs, calibration.full_scale_uv, calibration.lsb_uv, mains)
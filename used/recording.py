@@ -0,0 +1,274 @@
+import json
+import os
+import time
+
+import numpy as np
+
+import settings
+from annotations import AnnotationFile, load_index, read_events
+from calibration import Calibration
+
+# Session recording in memory-mappable chunk files.
+# A session is a directory:
+#     session.json   labels, channels, fs, dtype, board config, start/end
+#     index.jsonl    one line per closed chunk: chunk, seq, n, t0, t1
+#     00000.dat      samples, sample-major (n x channels) in the session dtype:
+#                    raw ADC counts (settings.RAW_DTYPE) unless a float dtype
+#                    is asked for, which stores microvolts
+#     00000.ts       float64 board timestamp of every sample
+#     annotations.*  event track aligned to the samples (see annotations.py)
+# Chunks hold RECORD_CHUNK_S seconds, so appends are plain writes and a
+# time-range read maps only the chunks it overlaps.
+
+
+class SessionWriter:
+    def __init__(self, root, labels, channels, fs, config=None, name=None, chunk_s=None, dtype=None):
+        chunk_s = settings.RECORD_CHUNK_S if chunk_s is None else chunk_s
+        self.dtype = np.dtype(settings.RAW_DTYPE if dtype is None else dtype)
+        self.counts = np.issubdtype(self.dtype, np.integer)
+        self.name, self.path = self._create(root, name or time.strftime("MBS_%Y%m%d_%H%M%S"))
+
+        self.meta = {
+            "name": self.name,
+            "labels": list(labels),
+            "channels": [int(ch) for ch in channels],
+            "fs": fs,
+            "dtype": self.dtype.str,
+            "counts": self.counts,
+            "config": config,
+            "start": time.time(),
+            "end": None,
+            "n_samples": 0,
+        }
+        self._write_meta()
+        self.chunk_samples = max(1, int(chunk_s * fs))
+        self.n_chunks = 0
+        self.chunk = None   # (index, seq, n, t0, t1, dat file, ts file)
+        self.annotations = AnnotationFile(self.path)
+
+    @staticmethod
+    def _create(root, base):
+        # Two sessions started within the same second get _1, _2, ...
+        os.makedirs(root, exist_ok=True)
+        for k in range(1000):
+            name = base if k == 0 else f"{base}_{k}"
+            path = os.path.join(root, name)
+            try:
+                os.makedirs(path, exist_ok=False)
+                return name, path
+            except FileExistsError:
+                continue
+        raise FileExistsError(os.path.join(root, base))
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, "session.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    def _open_chunk(self, seq):
+        k = self.n_chunks
+        self.n_chunks += 1
+        dat = open(os.path.join(self.path, f"{k:05d}.dat"), "wb")
+        ts = open(os.path.join(self.path, f"{k:05d}.ts"), "wb")
+        self.chunk = [k, seq, 0, None, None, dat, ts]
+
+    def _close_chunk(self):
+        k, seq, n, t0, t1, dat, ts = self.chunk
+        dat.close()
+        ts.close()
+        with open(os.path.join(self.path, "index.jsonl"), "a") as f:
+            f.write(json.dumps({"chunk": k, "seq": seq, "n": n, "t0": t0, "t1": t1}) + "\n")
+        self.chunk = None
+
+    def write(self, seq, block, timestamps):
+        """Append samples (channels x n) starting at sample `seq`.
+
+        Integer sessions take raw ADC counts (Calibration.to_counts).
+        """
+        block = np.asarray(block)
+        timestamps = np.asarray(timestamps, dtype=float)
+        pos = 0
+        while pos < block.shape[1]:
+            if self.chunk is None:
+                self._open_chunk(seq + pos)
+            c = self.chunk
+            take = min(self.chunk_samples - c[2], block.shape[1] - pos)
+            c[5].write(np.ascontiguousarray(block[:, pos:pos + take].T, dtype=self.dtype).tobytes())
+            c[6].write(timestamps[pos:pos + take].tobytes())
+            if c[3] is None:
+                c[3] = float(timestamps[pos])
+            c[4] = float(timestamps[pos + take - 1])
+            c[2] += take
+            pos += take
+            self.meta["n_samples"] += take
+            if c[2] == self.chunk_samples:
+                self._close_chunk()
+        if self.chunk is not None:
+            # Readers of a live session see everything written so far
+            self.chunk[5].flush()
+            self.chunk[6].flush()
+
+    def annotate(self, event):
+        """Store an annotation event; safe to call from any thread."""
+        self.annotations.write(event)
+
+    def close(self):
+        if self.chunk is not None:
+            self._close_chunk()
+        self.annotations.close()
+        self.meta["end"] = time.time()
+        self._write_meta()
+
+
+class SessionReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "session.json")) as f:
+            self.meta = json.load(f)
+        self.labels = self.meta["labels"]
+        self.fs = self.meta["fs"]
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.counts = self.meta.get("counts", False)
+        self.n_channels = len(self.labels)
+        self.chunks = self._load_index()
+
+    def _load_index(self):
+        chunks = []
+        index = os.path.join(self.path, "index.jsonl")
+        if os.path.exists(index):
+            with open(index) as f:
+                chunks = [json.loads(line) for line in f if line.strip()]
+        # A live session also has one open chunk that is not indexed yet
+        k = len(chunks)
+        ts_file = os.path.join(self.path, f"{k:05d}.ts")
+        if os.path.exists(ts_file):
+            n_ts = os.path.getsize(ts_file) // 8
+            n_dat = os.path.getsize(os.path.join(self.path, f"{k:05d}.dat")) // (self.n_channels * self.dtype.itemsize)
+            n = min(n_ts, n_dat)
+            if n:
+                ts = np.memmap(ts_file, dtype=np.float64, mode="r", shape=(n,))
+                seq = chunks[-1]["seq"] + chunks[-1]["n"] if chunks else 0
+                chunks.append({"chunk": k, "seq": seq, "n": n, "t0": float(ts[0]), "t1": float(ts[-1])})
+        return chunks
+
+    @property
+    def n_samples(self):
+        return sum(c["n"] for c in self.chunks)
+
+    @property
+    def t0(self):
+        return self.chunks[0]["t0"] if self.chunks else None
+
+    @property
+    def duration(self):
+        return self.chunks[-1]["t1"] - self.chunks[0]["t0"] if self.chunks else 0.0
+
+    def summary(self):
+        return {
+            "name": self.meta["name"],
+            "start": self.t0,
+            "duration_s": round(self.duration, 3),
+            "fs": self.fs,
+            "n_samples": self.n_samples,
+            "labels": self.labels,
+            "live": self.meta["end"] is None,
+        }
+
+    def _map(self, chunk):
+        k, n = chunk["chunk"], chunk["n"]
+        dat = np.memmap(os.path.join(self.path, f"{k:05d}.dat"), dtype=self.dtype, mode="r",
+                        shape=(n, self.n_channels))
+        ts = np.memmap(os.path.join(self.path, f"{k:05d}.ts"), dtype=np.float64, mode="r", shape=(n,))
+        return dat, ts
+
+    def channel_index(self, names=None):
+        if not names:
+            return list(range(self.n_channels))
+        return [self.labels.index(name) for name in names]
+
+    def count(self, t_start, t_end):
+        """Number of samples with t_start <= t < t_end."""
+        return sum(len(ts) for _, ts in self._ranges(t_start, t_end))
+
+    def _ranges(self, t_start, t_end):
+        for chunk in self.chunks:
+            if chunk["t1"] < t_start or chunk["t0"] >= t_end:
+                continue
+            dat, ts = self._map(chunk)
+            i0 = int(np.searchsorted(ts, t_start, side="left"))
+            i1 = int(np.searchsorted(ts, t_end, side="left"))
+            if i1 > i0:
+                yield dat[i0:i1], ts[i0:i1]
+
+    def read(self, t_start, t_end, channels=None):
+        """Yield (samples (n x selected channels), timestamps) chunk by chunk.
+
+        t_start/t_end are absolute board times; only the overlapping part of
+        each chunk is copied out of the memory map.
+        """
+        idx = self.channel_index(channels)
+        for dat, ts in self._ranges(t_start, t_end):
+            yield dat[:, idx], np.array(ts)
+
+    def annotations(self, t_start=None, t_end=None, kind=None):
+        """Annotation events with t_start <= t < t_end (absolute board times)."""
+        index = load_index(self.path)
+        i = 0 if t_start is None else int(np.searchsorted(index["t"], t_start, side="left"))
+        j = len(index) if t_end is None else int(np.searchsorted(index["t"], t_end, side="left"))
+        return read_events(self.path, index, i, j, kind)
+
+    def calibration(self, channels=None):
+        idx = self.channel_index(channels)
+        return Calibration([self.labels[i] for i in idx], [self.meta["channels"][i] for i in idx],
+                           config=self.meta["config"])
+
+    def calibrated(self, t_start, t_end, channels=None):
+        """Like read(), but blocks are channels x n in physical units."""
+        calibration = self.calibration(channels)
+        for block, ts in self.read(t_start, t_end, channels):
+            yield calibration.apply(block.T, counts=self.counts), ts
+
+
+def decimate(blocks, factor):
+    """min/max/mean over bins of `factor` samples of a (channels x n, ts) stream.
+
+    Returns (lo, hi, mean, t0), each stat shaped channels x bins; the last
+    bin may be partial. Only one block plus the output is held in memory.
+    """
+    out = ([], [], [])
+    tail = None
+    t0 = None
+    for x, ts in blocks:
+        if t0 is None and len(ts):
+            t0 = float(ts[0])
+        if tail is not None:
+            x = np.concatenate((tail, x), axis=1)
+        k = x.shape[1] // factor
+        if k:
+            bins = x[:, :k * factor].reshape(x.shape[0], k, factor)
+            out[0].append(bins.min(axis=2))
+            out[1].append(bins.max(axis=2))
+            out[2].append(bins.mean(axis=2))
+        tail = x[:, k * factor:]
+    if tail is not None and tail.shape[1]:
+        out[0].append(tail.min(axis=1, keepdims=True))
+        out[1].append(tail.max(axis=1, keepdims=True))
+        out[2].append(tail.mean(axis=1, keepdims=True))
+    if not out[0]:
+        return None, None, None, None
+    return (*(np.concatenate(o, axis=1) for o in out), t0)
+
+
+def list_sessions(root=None):
+    root = settings.RECORD_DIR if root is None else root
+    if not os.path.isdir(root):
+        return []
+    names = sorted(d for d in os.listdir(root) if os.path.exists(os.path.join(root, d, "session.json")))
+    return [SessionReader(os.path.join(root, name)) for name in names]
+
+
+def open_session(name, root=None):
+    root = settings.RECORD_DIR if root is None else root
+    path = os.path.join(root, os.path.basename(name))
+    if not os.path.exists(os.path.join(path, "session.json")):
+        raise FileNotFoundError(name)
+    return SessionReader(path)
@@ -0,0 +1,33 @@
+import asyncio
+
+import settings
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Event loop and WebSocket transport options shared by the servers.
+
+
+def loop_name():
+    return "uvloop" if uvloop is not None and settings.USE_UVLOOP else "asyncio"
+
+
+def run(main):
+    """Run the main() coroutine function, on uvloop when enabled."""
+    if loop_name() == "uvloop":
+        if hasattr(uvloop, "run"):
+            return uvloop.run(main())
+        uvloop.install()
+    return asyncio.run(main())
+
+
+def ws_options():
+    """Keyword arguments for websockets.serve from settings."""
+    compression = settings.WS_COMPRESSION
+    return {
+        "write_limit": settings.WS_WRITE_LIMIT,
+        "max_queue": settings.WS_MAX_QUEUE,
+        "compression": None if compression in ("", "off", "none") else compression,
+    }
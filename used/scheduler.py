@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+import settings
+
+# Deadline-based pacing for the WebSocket send loops.
+# Ticks are scheduled on an absolute monotonic clock (deadline += period),
+# so DSP time inside the loop does not stretch the frame period. The period
+# is the latency budget expressed in samples; at each tick the loop sends
+# whatever new samples are available, or waits for the next tick if there
+# are too few and the oldest one is still within the budget.
+
+
+class SendScheduler:
+    def __init__(self, fs, latency_budget=None, name="send"):
+        budget = settings.SEND_LATENCY_S if latency_budget is None else latency_budget
+        self.fs = fs
+        self.name = name
+        self.budget = budget
+        self.frame_samples = max(1, int(round(budget * fs)))
+        self.period = self.frame_samples / fs
+        self.deadline = None
+
+        self.lateness = deque(maxlen=2000)   # wake-up delay past the deadline (s)
+        self.batches = deque(maxlen=2000)    # samples per sent frame
+        self.frames = 0
+        self.deferred = 0
+        self.skipped_ticks = 0
+        self.reported = time.monotonic()
+
+    async def tick(self):
+        """Sleep until the next deadline on the absolute clock."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.deadline is None:
+            self.deadline = now
+        delay = self.deadline - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        woke = loop.time()
+        self.lateness.append(max(woke - self.deadline, 0.0))
+        self.deadline += self.period
+        # Fell behind by more than a period: skip the missed ticks, no burst
+        if woke - self.deadline > self.period:
+            missed = int((woke - self.deadline) // self.period)
+            self.deadline += missed * self.period
+            self.skipped_ticks += missed
+
+    def ready(self, pending, oldest_ts=None):
+        """Send now? Enough samples for a frame, or the oldest is due."""
+        if pending >= self.frame_samples:
+            return True
+        if pending > 0 and oldest_ts is not None and time.time() - oldest_ts >= self.budget:
+            return True
+        self.deferred += 1
+        return False
+
+    def take(self, reader):
+        """(seq, block) from a RingReader when a frame is due, else None."""
+        pending = reader.pending()
+        if not self.ready(pending, reader.oldest_timestamp() if pending else None):
+            return None
+        return reader.read()
+
+    def sent(self, n_samples):
+        self.frames += 1
+        self.batches.append(n_samples)
+
+    def stats(self):
+        late = np.array(self.lateness) * 1e3 if self.lateness else np.zeros(1)
+        return {
+            "frames": self.frames,
+            "deferred_ticks": self.deferred,
+            "skipped_ticks": self.skipped_ticks,
+            "period_ms": round(self.period * 1e3, 2),
+            "batch_mean": round(float(np.mean(self.batches)), 2) if self.batches else 0.0,
+            "jitter_p50_ms": round(float(np.percentile(late, 50)), 3),
+            "jitter_p99_ms": round(float(np.percentile(late, 99)), 3),
+            "jitter_max_ms": round(float(late.max()), 3),
+        }
+
+    def maybe_report(self):
+        if settings.SCHED_REPORT_S <= 0:
+            return
+        now = time.monotonic()
+        if now - self.reported >= settings.SCHED_REPORT_S:
+            self.reported = now
+            print(f"⏱️ {self.name}:", self.stats())
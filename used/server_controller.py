@@ -1,12 +1,20 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import subprocess
 import signal
 import os
 import sys
 import time
+import threading
+
+import numpy as np
+
+import settings
+import recording
+import edf
+from payload import binary_header, dumps
 
 app = FastAPI(
     title="Server Manager API",
@@ -27,6 +35,52 @@ app.add_middleware(
 process = None
 current_script = None
 
+# === Warm interpreter pool ===
+# Interpreters that already imported NumPy/SciPy/BrainFlow (warm_start.py)
+# and wait for a script name on stdin; /run hands the script to one of them.
+WARM_START = os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_start.py")
+WARM_REFILL_DELAY_S = 5.0  # let the new server start before importing another interpreter
+warm_pool = []
+warm_lock = threading.Lock()  # the refill timer and request threads share the pool
+
+def spawn_process(args, **kwargs):
+    return subprocess.Popen(
+        args,
+        preexec_fn=os.setsid if os.name != 'nt' else None,
+        creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0,
+        **kwargs
+    )
+
+def fill_warm_pool():
+    with warm_lock:
+        warm_pool[:] = [p for p in warm_pool if p.poll() is None]
+        while len(warm_pool) < settings.WARM_POOL_SIZE:
+            warm_pool.append(spawn_process([sys.executable, WARM_START], stdin=subprocess.PIPE, text=True))
+
+def take_warm(script):
+    while True:
+        with warm_lock:
+            if not warm_pool:
+                return None
+            proc = warm_pool.pop(0)
+        if proc.poll() is not None:
+            continue
+        try:
+            proc.stdin.write(script + "\n")
+            proc.stdin.close()
+            return proc
+        except OSError:
+            continue
+
+def close_warm_pool():
+    with warm_lock:
+        for proc in warm_pool:
+            if proc.poll() is None:
+                proc.stdin.close()  # empty line: the interpreter exits
+        warm_pool.clear()
+
+fill_warm_pool()
+
 # === Request schema ===
 class ServerRequest(BaseModel):
     script_name: str  # e.g., "server_mbs.py"
@@ -43,12 +97,13 @@ def run_server(req: ServerRequest):
         script = req.script_name
         args = [sys.executable, script]
 
-        process = subprocess.Popen(
-            args,
-            preexec_fn=os.setsid if os.name != 'nt' else None,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
-        )
+        process = take_warm(script)
+        warm = process is not None
+        if not warm:
+            process = spawn_process(args)
         current_script = script
+        if settings.WARM_POOL_SIZE > 0:
+            threading.Timer(WARM_REFILL_DELAY_S, fill_warm_pool).start()
 
         return JSONResponse(
             status_code=200,
@@ -56,6 +111,7 @@ def run_server(req: ServerRequest):
                 "status": "running",
                 "script": script,
                 "pid": process.pid,
+                "warm": warm,
                 "message": f"{script} is now running (PID: {process.pid})"
             }
         )
@@ -134,10 +190,100 @@ def get_status():
         "message": "No server is currently running."
     }
 
+# === Recorded sessions ===
+@app.get("/sessions")
+def get_sessions():
+    return {"sessions": [session.summary() for session in recording.list_sessions()]}
+
+@app.get("/sessions/{name}/data")
+def get_session_data(name: str, channels: str = None, start: float = 0.0, end: float = None,
+                     format: str = "json", width: int = 2000):
+    """Time range of a session; start/end are seconds from the session start.
+
+    format=binary streams every sample (binary_header + float samples,
+    sample-major) chunk by chunk; format=json returns min/max/mean bins,
+    about `width` per channel.
+    """
+    try:
+        session = recording.open_session(name)
+        names = channels.split(",") if channels else None
+        labels = [session.labels[i] for i in session.channel_index(names)]
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"No session {name}"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    if session.t0 is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"{name} has no data"})
+
+    t_start = session.t0 + start
+    t_end = session.t0 + end if end is not None else float("inf")
+    n = session.count(t_start, t_end)
+    units = session.calibration(names).units
+    header = {"type": "session", "name": name, "t0": t_start, "dt": 1.0 / session.fs,
+              "labels": labels, "units": units}
+
+    if format == "binary":
+        def stream():
+            yield binary_header(header, settings.SAMPLE_DTYPE, (n, len(labels)))
+            for block, _ in session.calibrated(t_start, t_end, names):
+                yield np.ascontiguousarray(block.T).tobytes()
+        return StreamingResponse(stream(), media_type="application/octet-stream")
+
+    factor = max(1, -(-n // max(1, width)))
+    lo, hi, mean, t0 = recording.decimate(session.calibrated(t_start, t_end, names), factor)
+    body = dict(header, t0=t0, dt=factor / session.fs, factor=factor, n=0 if lo is None else lo.shape[1])
+    if lo is not None:
+        body.update(
+            min={label: lo[i] for i, label in enumerate(labels)},
+            max={label: hi[i] for i, label in enumerate(labels)},
+            mean={label: mean[i] for i, label in enumerate(labels)},
+        )
+    return Response(content=dumps(body), media_type="application/json")
+
+@app.get("/sessions/{name}/annotations")
+def get_session_annotations(name: str, start: float = None, end: float = None, kind: str = None):
+    """Annotation events of a session; start/end are seconds from the session start."""
+    try:
+        session = recording.open_session(name)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"No session {name}"})
+    t0 = session.t0
+    if t0 is None:
+        return {"name": name, "t0": None, "annotations": []}
+    t_start = t0 + start if start is not None else None
+    t_end = t0 + end if end is not None else None
+    return Response(content=dumps({"name": name, "t0": t0, "annotations": session.annotations(t_start, t_end, kind)}),
+                    media_type="application/json")
+
+@app.get("/sessions/{name}/export")
+def export_session(name: str, format: str = "edf", channels: str = None, start: float = 0.0, end: float = None):
+    """Session (or a time range of it) as an EDF+ or BDF+ file download."""
+    if format not in edf.FORMATS:
+        return JSONResponse(status_code=400, content={"status": "error", "message": f"Unknown format {format}"})
+    try:
+        session = recording.open_session(name)
+        names = channels.split(",") if channels else None
+        session.channel_index(names)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"No session {name}"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    if session.t0 is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"{name} has no data"})
+
+    t_start = session.t0 + start
+    t_end = session.t0 + end if end is not None else None
+    return StreamingResponse(
+        edf.iter_export(session, format, t_start, t_end, names),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{session.meta["name"]}.{format}"'},
+    )
+
 # === Graceful shutdown on Ctrl+C ===
 def handle_sigint(signal_received, frame):
     print("🛑 SIGINT received. Stopping subprocess...")
     response = stop_server()
+    close_warm_pool()
     print("Shutdown result:", response)
     sys.exit(0)
 
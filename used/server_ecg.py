@@ -1,3 +1,4 @@
+import startup  # first import: starts the startup clock
 import asyncio
 import websockets
 import json
@@ -5,10 +6,17 @@ import time
 import signal
 import sys
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, BrainFlowError
+from payload import build_signals, dumps
+from acquisition import Acquisition, board_opener
+from calibration import Calibration
+from scheduler import SendScheduler
+import runtime
+import settings
 
 # Global board instance
 board = None
 board_initialized = False
+acquisition = None
 
 # Signal handler for graceful shutdown
 def signal_handler(sig, frame):
@@ -18,6 +26,9 @@ def signal_handler(sig, frame):
 
 def cleanup():
     global board, board_initialized
+    if acquisition is not None:
+        acquisition.stop()
+        board = acquisition.board  # replaced when the board was reopened
     if board and board_initialized:
         try:
             board.stop_stream()
@@ -36,32 +47,42 @@ signal.signal(signal.SIGINT, signal_handler)
 
 async def eeg_handler(websocket, path):
     print("🔌 Client connected")
+    acquisition.subscribe()
     try:
         sampling_rate = board.get_sampling_rate(board_id)  # usually 250 Hz for Cyton+Daisy
         interval = 1.0 / 125  # Output interval for 125 Hz
+        labels = [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels]
+        reader = acquisition.reader()
+        scheduler = SendScheduler(sampling_rate, name="ecg send")
 
         while True:
-            raw_data = board.get_current_board_data(50)  # ~0.2s of data
-            sensor_data = {}
-            timestamp_now = time.time()
+            await scheduler.tick()
+            batch = scheduler.take(reader)
+            if batch is None:
+                continue
+            seq, raw_data = batch
+
+            # Downsample 250 → 125 Hz on even absolute sample indices
+            first = (-seq) % 2
+            samples = raw_data[:, first::2]
+            if samples.shape[1] == 0:
+                continue
 
-            for ch in eeg_channels:
-                label = channel_names.get(ch, f"CH{ch}")
-                samples = raw_data[ch][::2]  # Downsample 250 → 125 Hz
-                sensor_data[label] = [
-                    {
-                        "y": float(val),
-                        "__timestamp__": timestamp_now - (len(samples) - i - 1) * interval
-                    }
-                    for i, val in enumerate(samples)
-                ]
+            timestamp_now = time.time()
+            rows, units = calibration.transport(samples[eeg_channels])
+            sensor_data = build_signals(rows, labels, timestamp_now, interval, (seq + first) // 2, units=units,
+                                        gaps=acquisition.gaps(seq, raw_data.shape[1]))
 
-            await websocket.send(json.dumps(sensor_data))
-            await asyncio.sleep(0.008)  # ~125 Hz update rate
+            await websocket.send(dumps(sensor_data))
+            scheduler.sent(samples.shape[1])
+            startup.first_frame()
+            scheduler.maybe_report()
     except websockets.ConnectionClosed:
         print("❌ Client disconnected")
     except Exception as e:
         print("🚨 Handler error:", e)
+    finally:
+        acquisition.unsubscribe()
 
 # Config and EEG channels
 params = BrainFlowInputParams()
@@ -72,21 +93,30 @@ channel_names = {
     1: "LEAD_I", 2: "LEAD_II", 3: "LEAD_III", 4: "AVR", 5: "AVL", 6: "AVF",
     7: "V1", 8: "V2", 9: "V3", 10: "V4", 11: "V5", 12: "V6"
 }
+calibration = Calibration([channel_names.get(ch, f"CH{ch}") for ch in eeg_channels], eeg_channels)
 
 async def main():
-    global board, board_initialized
+    global board, board_initialized, acquisition
+    startup.mark("imports")
     board = BoardShim(board_id, params)
     try:
         print("🔄 Preparing BrainFlow session...")
         board.prepare_session()
+        startup.mark("session")
         board.start_stream()
         board_initialized = True
+        acquisition = Acquisition(board, board_id, reopen=board_opener(board_id, params.serial_port),
+                                  idle=settings.ACQ_IDLE)
+        acquisition.start()
         print("✅ Streaming started")
+        startup.mark("stream")
 
         ip = '10.42.0.1'  # Adjust to your local IP or '0.0.0.0' for all interfaces
         port = 8888
-        async with websockets.serve(eeg_handler, ip, port):
-            print(f"🌐 WebSocket Server running at ws://{ip}:{port}")
+        async with websockets.serve(eeg_handler, ip, port, **runtime.ws_options()):
+            print(f"🌐 WebSocket Server running at ws://{ip}:{port} ({runtime.loop_name()})")
+            startup.mark("listening")
+            startup.report()
             await asyncio.Future()  # run forever
     except BrainFlowError as e:
         print("🚨 BrainFlow setup failed:", e)
@@ -96,4 +126,4 @@ async def main():
         cleanup()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    runtime.run(main)
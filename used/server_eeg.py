@@ -1,3 +1,4 @@
+import startup  # first import: starts the startup clock
 import asyncio
 import websockets
 import json
@@ -5,10 +6,18 @@ import time
 import signal
 import sys
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, BrainFlowError
+from payload import build_signals, dumps
+from acquisition import Acquisition, board_opener
+from spectral import make_bandpower
+from calibration import Calibration
+from scheduler import SendScheduler
+import runtime
+import settings
 
 # Global board instance
 board = None
 board_initialized = False
+acquisition = None
 
 # Signal handler
 def signal_handler(sig, frame):
@@ -18,6 +27,9 @@ def signal_handler(sig, frame):
 
 def cleanup():
     global board, board_initialized
+    if acquisition is not None:
+        acquisition.stop()
+        board = acquisition.board  # replaced when the board was reopened
     if board and board_initialized:
         try:
             board.stop_stream()
@@ -45,54 +57,111 @@ channel_names = {
 # WebSocket handler
 async def eeg_handler(websocket, path):
     print("🔌 Client connected")
+    acquisition.subscribe()
     try:
         target_rate = 125  # Hz
         interval = 1.0 / target_rate  # 0.008 sec
+        sampling_rate = board.get_sampling_rate(board_id)
+        sample_interval = 1.0 / sampling_rate
+        labels = [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels]
+        reader = acquisition.reader()
+        scheduler = SendScheduler(sampling_rate, name="eeg send")
 
         while True:
-            raw_data = board.get_current_board_data(50)
-            sensor_data = {}
+            await scheduler.tick()
+            batch = scheduler.take(reader)
+            if batch is None:
+                continue
+            seq, raw_data = batch
+            n_new = raw_data.shape[1]
+
             timestamp_now = time.time()
+            rows, units = calibration.transport(raw_data[eeg_channels])
+            sensor_data = build_signals(
+                rows, labels, timestamp_now, sample_interval, seq,
+                legacy_dt=interval, units=units, gaps=acquisition.gaps(seq, n_new)
+            )
 
-            for ch in eeg_channels:
-                label = channel_names.get(ch, f"CH{ch}")
-                samples = raw_data[ch]
-                sensor_data[label] = [
-                    {
-                        "y": float(val),
-                        "__timestamp__": timestamp_now - (len(samples) - i - 1) * interval
-                    }
-                    for i, val in enumerate(samples)
-                ]
-
-            await websocket.send(json.dumps(sensor_data))
-            await asyncio.sleep(interval)
+            await websocket.send(dumps(sensor_data))
+            scheduler.sent(n_new)
+            startup.first_frame()
+            scheduler.maybe_report()
     except websockets.ConnectionClosed:
         print("❌ Client disconnected")
     except Exception as e:
         print("🚨 Handler error:", e)
+    finally:
+        acquisition.unsubscribe()
+
+# Band power stream (all EEG channels)
+band_clients = set()
+
+async def bandpower_handler(websocket, path):
+    print("🔌 Band power client connected")
+    band_clients.add(websocket)
+    acquisition.subscribe()
+    try:
+        await websocket.wait_closed()
+    finally:
+        acquisition.unsubscribe()
+        band_clients.discard(websocket)
+        print("❌ Band power client disconnected")
+
+async def bandpower_task():
+    try:
+        fs = board.get_sampling_rate(board_id)
+        labels = [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels]
+        stream = make_bandpower(len(eeg_channels), fs)
+        reader = acquisition.reader()
+
+        while True:
+            if not await reader.wait_async(timeout=1.0):
+                continue
+            seq, raw_data = reader.read()
+            n_new = raw_data.shape[1]
+            if n_new and stream.update(raw_data[eeg_channels]) and band_clients:
+                websockets.broadcast(band_clients, dumps(stream.frame(labels, time.time(), seq + n_new)))
+    except Exception as e:
+        print("🚨 Band power error:", e)
 
 # Setup
 params = BrainFlowInputParams()
 params.serial_port = '/dev/ttyUSB0'
 board_id = BoardIds.CYTON_DAISY_BOARD.value
 eeg_channels = BoardShim.get_eeg_channels(board_id)
+calibration = Calibration([channel_names.get(ch, f"CH{ch}") for ch in eeg_channels], eeg_channels)
 
 async def main():
-    global board, board_initialized
+    global board, board_initialized, acquisition
+    startup.mark("imports")
     board = BoardShim(board_id, params)
     try:
         print("🔄 Preparing BrainFlow session...")
         board.prepare_session()
+        startup.mark("session")
         board.start_stream()
         board_initialized = True
+        acquisition = Acquisition(board, board_id, reopen=board_opener(board_id, params.serial_port),
+                                  idle=settings.ACQ_IDLE)
+        acquisition.start()
         print("✅ EEG streaming started")
+        startup.mark("stream")
 
         ip = '10.42.0.1'
         port = 7777
-        async with websockets.serve(eeg_handler, ip, port):
-            print(f"🌐 WebSocket Server running at ws://{ip}:{port}")
-            await asyncio.Future()  # keep running
+        band_port = port + settings.BANDPOWER_PORT_OFFSET
+        async with websockets.serve(eeg_handler, ip, port, **runtime.ws_options()), \
+                websockets.serve(bandpower_handler, ip, band_port, **runtime.ws_options()):
+            print(f"🌐 WebSocket Server running at ws://{ip}:{port} ({runtime.loop_name()})")
+            print(f"🌐 Band power stream at ws://{ip}:{band_port}")
+            startup.mark("listening")
+            startup.report()
+            band_task = asyncio.create_task(bandpower_task())
+            try:
+                await asyncio.Future()  # keep running
+            finally:
+                band_task.cancel()
+                await asyncio.gather(band_task, return_exceptions=True)
     except BrainFlowError as e:
         print("🚨 BrainFlow error:", e)
     except Exception as e:
@@ -101,4 +170,4 @@ async def main():
         cleanup()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    runtime.run(main)
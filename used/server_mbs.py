@@ -1,13 +1,29 @@
+import startup  # first import: starts the startup clock
 import asyncio
 import websockets
 import json
 import time
+import os
 import signal
 import sys
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, BrainFlowError
+from payload import RateTiers, ChangeOnly, dumps, binary_frame
+from acquisition import Acquisition, board_opener
+from history import MinMaxPyramid, STATS
+from recording import SessionWriter
+import edf
+from spectral import make_bandpower
+from calibration import Calibration, MBS_BOARD_CONFIG
+from scheduler import SendScheduler
+import runtime
+import settings
 
 board = None
 board_initialized = False
+acquisition = None
+pyramid = None
 is_running = True  # Flag to control graceful shutdown
 
 def signal_handler(sig, frame):
@@ -18,6 +34,9 @@ def signal_handler(sig, frame):
 
 def cleanup():
     global board, board_initialized
+    if acquisition is not None:
+        acquisition.stop()
+        board = acquisition.board  # replaced when the board was reopened
     if board and board_initialized:
         try:
             board.stop_stream()
@@ -33,44 +52,275 @@ def cleanup():
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
+# --- Reconnect catch-up ---
+def history_request(path, fs):
+    """(first sample, pixel width) from the connect URL, or (None, None).
+
+    ?since=S or ?last=N (seconds) selects the range; &width=W asks for a
+    min/max/mean view of about W bins instead of every sample.
+    """
+    query = parse_qs(urlsplit(path or "").query)
+
+    def number(key):
+        # Malformed or non-finite values are ignored, not fatal to the connection
+        try:
+            value = float(query[key][0])
+        except (KeyError, ValueError):
+            return None
+        return value if np.isfinite(value) else None
+
+    ring = acquisition.ring
+    width = number("width")
+    # At most one bin per sample the ring can hold
+    width = None if width is None or width < 1 else int(min(width, ring.capacity))
+    since, last = number("since"), number("last")
+    if since is not None:
+        return int(min(max(since, 0), ring.seq)), width
+    if last is not None:
+        # Raw samples come from the ring; binned views (width) from the pyramid's longer span
+        span = settings.PYRAMID_SPAN_S if width else ring.capacity / fs
+        return max(0, ring.seq - int(min(max(last, 0.0), span) * fs)), width
+    return None, width
+
+def history_frame(start, stop, width, labels, interval):
+    # Runs in a worker thread: copy, calibration and packing of up to
+    # HISTORY_S of data stay off the event loop
+    view = pyramid.query(start, stop, width) if width else None
+    if view is not None:
+        factor, first, stats, t0 = view
+        header = {
+            "type": "history",
+            "seq": first,
+            "n": stats.shape[2],
+            "factor": factor,
+            "stats": list(STATS),
+            "t0": t0,
+            "dt": interval * factor,
+            "labels": labels,
+            "units": calibration.units if settings.CALIBRATE else None,
+        }
+        return binary_frame(header, stats)
+
+    start, block = acquisition.ring.read(start, stop)
+    n = block.shape[1]
+    _, times = acquisition.ring.read_times(start, start + n)
+    rows, units = calibration.transport(block[eeg_channels])
+    header = {
+        "type": "history",
+        "seq": start,
+        "n": n,
+        "t0": float(times[0]) if n else None,
+        "dt": interval,
+        "labels": labels,
+        "units": units,
+    }
+    if units is None:
+        # Raw ADC counts, as recorded sessions store them
+        rows = calibration.to_counts(rows)
+        header["lsb_uv"] = calibration.lsb_uv.tolist()
+    return binary_frame(header, rows)
+
 async def eeg_handler(websocket, path):
     print("🔌 Client connected")
+    acquisition.subscribe()
     try:
         sampling_rate = board.get_sampling_rate(board_id)
         interval = 1.0 / sampling_rate
-        send_interval = 1.0 / 125  # 125Hz
+        labels = [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels]
+        reader = acquisition.reader()
+        scheduler = SendScheduler(sampling_rate, name="mbs send")
+        # Slow channels (settings.CHANNEL_RATES) go out low-pass decimated and
+        # deadband encoded; legacy clients get every label in every frame
+        legacy = settings.PAYLOAD_SCHEMA == "legacy"
+        tiers = RateTiers(labels, sampling_rate, {} if legacy else None)
+        # Tolerances are physical units: only with calibrated output
+        change_only = ChangeOnly(None if settings.CALIBRATE and not legacy else {})
+
+        start, width = history_request(path, sampling_rate)
+        if start is not None:
+            # History ends where the live reader starts: no gap, no overlap
+            frame = await asyncio.get_running_loop().run_in_executor(
+                None, history_frame, start, reader.seq, width, labels, interval)
+            await websocket.send(frame)
+            print(f"📦 Sent {len(frame) / 1e3:.0f} kB of history")
 
         while is_running:
-            raw_data = board.get_board_data(3)
-            if raw_data.shape[1] == 0:
-                await asyncio.sleep(0.5)
+            await scheduler.tick()
+            batch = scheduler.take(reader)
+            if batch is None:
                 continue
+            seq, raw_data = batch
+            n_new = raw_data.shape[1]
 
-            sensor_data = {}
             timestamp_now = time.time()
-            for ch in eeg_channels:
-                label = channel_names.get(ch, f"CH{ch}")
-                samples = raw_data[ch]
-                sensor_data[label] = [
-                    {
-                        "y": int(samples[i]),
-                        "__timestamp__": timestamp_now - (len(samples) - i - 1) * interval
-                    }
-                    for i in range(len(samples))
-                ]
-
-            await websocket.send(json.dumps(sensor_data))
-            await asyncio.sleep(send_interval)
+            rows, units = calibration.transport(raw_data[eeg_channels])
+            if units is None:
+                rows = calibration.to_counts(rows)
+            sensor_data = change_only.apply(tiers.build(rows, timestamp_now, seq, units=units,
+                                                        gaps=acquisition.gaps(seq, n_new)))
+
+            await websocket.send(dumps(sensor_data))
+            scheduler.sent(n_new)
+            startup.first_frame()
+            scheduler.maybe_report()
 
     except websockets.ConnectionClosed:
         print("❌ Client disconnected")
     except Exception as e:
         print("🚨 Handler error:", e)
+    finally:
+        acquisition.unsubscribe()
+
+# --- History pyramid ---
+async def pyramid_task():
+    # History is a live consumer: without a subscription the board parks
+    # ACQ_IDLE_GRACE_S after the last client and catch-up would have a hole
+    acquisition.subscribe()
+    try:
+        reader = acquisition.reader(backlog=acquisition.ring.capacity)
+        while is_running:
+            if not await reader.wait_async(timeout=1.0):
+                continue
+            seq, raw_data = reader.read()
+            n_new = raw_data.shape[1]
+            if n_new == 0:
+                continue
+            rows, _ = calibration.transport(raw_data[eeg_channels])
+            _, timestamps = acquisition.ring.read_times(seq, seq + n_new)
+            pyramid.update(seq, rows, timestamps)
+    except Exception as e:
+        print("🚨 History pyramid error:", e)
+    finally:
+        acquisition.unsubscribe()
+
+# --- Session recording ---
+async def recorder_task():
+    labels = [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels]
+    loop = asyncio.get_running_loop()
+    writer = edf_file = edf_writer = None
+
+    def write_block(seq, block, timestamps, gaps, first_seq):
+        # Runs in the executor: file writes and flushes stay off the event loop
+        writer.write(seq, calibration.to_counts(block), timestamps)
+        if edf_writer is not None:
+            # EDF time runs on samples, so a reconnect gap is only visible as an annotation
+            for gap in gaps:
+                edf_writer.annotate((gap["seq"] - first_seq) / acquisition.fs, "gap", gap.get("duration"))
+            edf_writer.write(calibration.apply(block))
+
+    acquisition.subscribe()  # keeps the board streaming without clients
+    try:
+        writer = SessionWriter(settings.RECORD_DIR, labels, eeg_channels, acquisition.fs, config=MBS_BOARD_CONFIG)
+        print(f"💾 Recording to {writer.path}")
+        acquisition.annotations.add_listener(writer.annotate)
+        if settings.RECORD_EDF:
+            # Live EDF+/BDF+ copy; the record count is patched in on close
+            edf_file = open(os.path.join(writer.path, f"{writer.name}.{settings.RECORD_EDF}"), "wb")
+            edf_writer = edf.for_calibration(edf_file, calibration, acquisition.fs, fmt=settings.RECORD_EDF)
+        reader = acquisition.reader()
+        first_seq = reader.seq
+        while is_running:
+            if not await reader.wait_async(timeout=1.0):
+                continue
+            seq, raw_data = reader.read()
+            n_new = raw_data.shape[1]
+            if n_new == 0:
+                continue
+            _, timestamps = acquisition.ring.read_times(seq, seq + n_new)
+            gaps = acquisition.gaps(seq, n_new) if edf_writer is not None else ()
+            await loop.run_in_executor(None, write_block, seq, raw_data[eeg_channels], timestamps, gaps, first_seq)
+    except Exception as e:
+        print("🚨 Recorder error:", e)
+    finally:
+        acquisition.unsubscribe()
+        if writer is not None:
+            acquisition.annotations.remove_listener(writer.annotate)
+            writer.close()
+        if edf_writer is not None:
+            edf_writer.close()
+        if edf_file is not None:
+            edf_file.close()
+
+# --- Annotation track ---
+annotation_clients = set()
+# Kinds a client may add; gaps, restarts and beats come from the server only
+CLIENT_ANNOTATION_KINDS = {"marker"}
+
+def broadcast_annotation(event):
+    if annotation_clients:
+        websockets.broadcast(annotation_clients, dumps({"type": "annotations", "events": [event]}))
+
+async def annotation_handler(websocket, path):
+    print("🔌 Annotation client connected")
+    try:
+        # ?since=<seq> / ?last=<seconds> first sends the events already held
+        start, _ = history_request(path, acquisition.fs)
+        events = acquisition.annotations.range(start) if start is not None else None
+        annotation_clients.add(websocket)
+        if events is not None:
+            await websocket.send(dumps({"type": "annotations", "events": events}))
+        # Clients add markers: {"kind": "marker", "text": "...", "seq": optional}
+        async for message in websocket:
+            try:
+                msg = json.loads(message)
+                kind = msg.get("kind", "marker")
+                if kind not in CLIENT_ANNOTATION_KINDS:
+                    raise ValueError(f"kind {kind!r} is not allowed")
+                text = msg.get("text")
+                if text is not None and not isinstance(text, str):
+                    raise TypeError("text must be a string")
+                seq = msg.get("seq")
+                if seq is not None:
+                    # Only samples still held in the ring (or the next one)
+                    if isinstance(seq, bool) or not isinstance(seq, int):
+                        raise TypeError("seq must be an integer")
+                    if not acquisition.ring.oldest() <= seq <= acquisition.ring.seq:
+                        raise ValueError(f"seq {seq} is outside the ring")
+                acquisition.annotate(kind, text, seq)
+            except (ValueError, TypeError, AttributeError) as e:
+                print("⚠️ Bad annotation:", e)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        annotation_clients.discard(websocket)
+        print("❌ Annotation client disconnected")
+
+# --- EEG band power stream ---
+band_clients = set()
+
+async def bandpower_handler(websocket, path):
+    print("🔌 Band power client connected")
+    band_clients.add(websocket)
+    acquisition.subscribe()
+    try:
+        await websocket.wait_closed()
+    finally:
+        acquisition.unsubscribe()
+        band_clients.discard(websocket)
+        print("❌ Band power client disconnected")
+
+async def bandpower_task():
+    try:
+        fs = board.get_sampling_rate(board_id)
+        labels = [channel_names.get(ch, f"CH{ch}") for ch in bandpower_channels]
+        stream = make_bandpower(len(bandpower_channels), fs)
+        reader = acquisition.reader()
+
+        while is_running:
+            if not await reader.wait_async(timeout=1.0):
+                continue
+            seq, raw_data = reader.read()
+            n_new = raw_data.shape[1]
+            if n_new and stream.update(raw_data[bandpower_channels]) and band_clients:
+                websockets.broadcast(band_clients, dumps(stream.frame(labels, time.time(), seq + n_new)))
+    except Exception as e:
+        print("🚨 Band power error:", e)
 
 params = BrainFlowInputParams()
 params.serial_port = '/dev/ttyUSB0'
 board_id = BoardIds.CYTON_DAISY_BOARD.value
 eeg_channels = BoardShim.get_eeg_channels(board_id)
+bandpower_channels = [ch for ch in eeg_channels if ch >= 11]  # EEG CH11-16
 
 channel_names = {
     1: "ECG", 2: "PPG", 3: "PCG", 4: "EMG1", 5: "EMG2",
@@ -78,32 +328,58 @@ channel_names = {
     11: "EEG CH11", 12: "EEG CH12", 13: "EEG CH13", 14: "EEG CH14",
     15: "EEG CH15", 16: "EEG CH16"
 }
+calibration = Calibration(
+    [channel_names.get(ch, f"CH{ch}") for ch in eeg_channels], eeg_channels, config=MBS_BOARD_CONFIG
+)
 
 async def main():
-    global board, board_initialized
+    global board, board_initialized, acquisition, pyramid
+    startup.mark("imports")
     board = BoardShim(board_id, params)
 
     try:
         print("🔄 Preparing BrainFlow session...")
         board.prepare_session()
 
-        gain_config = (
-            'x1060100Xx2010000Xx3010000Xx4060000Xx5060000Xx6010000Xx7010000Xx8010000X'
-            'xQ010000XxW010000XxE010000XxR010000XxT010000XxY010000XxU010000XxI010000X'
-        )
-        board.config_board(gain_config)
+        board.config_board(MBS_BOARD_CONFIG)
         time.sleep(0.5)
+        startup.mark("session")
 
         board.start_stream()
         board_initialized = True
+        # The acquisition ring doubles as the reconnect history
+        acquisition = Acquisition(board, board_id, capacity_s=max(settings.ACQ_RING_S, settings.HISTORY_S),
+                                  reopen=board_opener(board_id, params.serial_port, MBS_BOARD_CONFIG),
+                                  idle=settings.ACQ_IDLE)
+        acquisition.start()
+        pyramid = MinMaxPyramid(len(eeg_channels), acquisition.fs)
         print("✅ Streaming started")
+        startup.mark("stream")
 
         ip = '10.42.0.1'
         port = 5555
-        async with websockets.serve(eeg_handler, ip, port):
-            print(f"🌐 WebSocket Server running at ws://{ip}:{port}")
+        band_port = port + settings.BANDPOWER_PORT_OFFSET
+        annotation_port = port + settings.ANNOTATION_PORT_OFFSET
+        # Events are added on any thread; they are sent from the loop
+        loop = asyncio.get_running_loop()
+        acquisition.annotations.add_listener(lambda event: loop.call_soon_threadsafe(broadcast_annotation, event))
+        async with websockets.serve(eeg_handler, ip, port, **runtime.ws_options()), \
+                websockets.serve(bandpower_handler, ip, band_port, **runtime.ws_options()), \
+                websockets.serve(annotation_handler, ip, annotation_port, **runtime.ws_options()):
+            print(f"🌐 WebSocket Server running at ws://{ip}:{port} ({runtime.loop_name()})")
+            print(f"🌐 Band power stream at ws://{ip}:{band_port}")
+            print(f"🌐 Annotation track at ws://{ip}:{annotation_port}")
+            startup.mark("listening")
+            startup.report()
+            band_task = asyncio.create_task(bandpower_task())
+            history_task = asyncio.create_task(pyramid_task())
+            record_task = asyncio.create_task(recorder_task()) if settings.RECORD else None
             while is_running:
                 await asyncio.sleep(0.1)
+            band_task.cancel()
+            history_task.cancel()
+            if record_task:
+                await record_task  # exits on is_running, closes the session
 
     except BrainFlowError as e:
         print("🚨 BrainFlow error:", e)
@@ -113,4 +389,4 @@ async def main():
         cleanup()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    runtime.run(main)
@@ -0,0 +1,106 @@
+import startup  # first import: starts the startup clock
+import asyncio
+import websockets
+import time
+import signal
+from payload import build_signals, dumps
+from multiboard import open_boards
+from scheduler import SendScheduler
+import runtime
+
+# Every board in settings.BOARDS, merged into one time-aligned stream with
+# namespaced labels ("boardA/ECG", "boardB/EEG_3") and per-board health.
+
+acquisition = None
+is_running = True
+board_health = {}  # {board: {...}}, refreshed every second
+
+def signal_handler(sig, frame):
+    global is_running
+    print("\n🛑 Signal received, cleaning up...")
+    is_running = False
+
+def cleanup():
+    if acquisition is not None:
+        acquisition.stop()
+    print("✅ Cleaned up")
+
+signal.signal(signal.SIGTERM, signal_handler)
+signal.signal(signal.SIGINT, signal_handler)
+
+async def eeg_handler(websocket, path):
+    print("🔌 Client connected")
+    acquisition.subscribe()
+    try:
+        interval = 1.0 / acquisition.fs
+        calibration = acquisition.calibration
+        reader = acquisition.reader()
+        scheduler = SendScheduler(acquisition.fs, name="multi send")
+
+        while is_running:
+            await scheduler.tick()
+            batch = scheduler.take(reader)
+            if batch is None:
+                continue
+            seq, raw_data = batch
+            n_new = raw_data.shape[1]
+
+            timestamp_now = time.time()
+            rows, units = calibration.transport(raw_data[acquisition.channels])
+            payload = {
+                "signals": build_signals(rows, acquisition.labels, timestamp_now, interval, seq, units=units,
+                                         gaps=acquisition.gaps(seq, n_new)),
+                "boards": board_health,
+                "timestamp": timestamp_now,
+            }
+
+            await websocket.send(dumps(payload))
+            scheduler.sent(n_new)
+            startup.first_frame()
+            scheduler.maybe_report()
+    except websockets.ConnectionClosed:
+        print("❌ Client disconnected")
+    except Exception as e:
+        print("🚨 Handler error:", e)
+    finally:
+        acquisition.unsubscribe()
+
+async def health_task():
+    global board_health
+    was_connected = {}
+    while is_running:
+        board_health = acquisition.health()
+        for name, health in board_health.items():
+            if was_connected.get(name, True) != health["connected"]:
+                print(f"{'✅' if health['connected'] else '⚠️'} {name} {'back' if health['connected'] else 'silent'}")
+            was_connected[name] = health["connected"]
+        await asyncio.sleep(1.0)
+
+async def main():
+    global acquisition
+    startup.mark("imports")
+    try:
+        acquisition = open_boards()
+        names = ", ".join(node.name for node in acquisition.nodes)
+        print(f"🔄 Preparing BrainFlow sessions ({names})...")
+        acquisition.start()
+        print(f"✅ Streaming {len(acquisition.labels)} channels from {len(acquisition.nodes)} boards")
+        startup.mark("stream")
+
+        ip = '0.0.0.0'
+        port = 5555
+        async with websockets.serve(eeg_handler, ip, port, **runtime.ws_options()):
+            print(f"🌐 WebSocket Server running at ws://{ip}:{port} ({runtime.loop_name()})")
+            startup.mark("listening")
+            startup.report()
+            health = asyncio.create_task(health_task())
+            while is_running:
+                await asyncio.sleep(0.1)
+            health.cancel()
+    except Exception as e:
+        print("🚨 Error:", e)
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    runtime.run(main)
@@ -0,0 +1,204 @@
+import os
+
+# Runtime options shared by the servers and the GUI.
+# Every option can be overridden from the environment, so the controller
+# (or a shell) can switch behaviour without editing the scripts.
+
+
+def env_str(name, default):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+# --- Payload ---
+# "columnar": {label: {"t0", "dt", "seq", "y": [...]}}
+# "legacy":   {label: [{"y": ..., "__timestamp__": ...}, ...]}
+PAYLOAD_SCHEMA = env_str("BIOPULSE_PAYLOAD", "columnar")
+# Use orjson when it is installed (set to 0 to force the stdlib json module)
+USE_ORJSON = env_bool("BIOPULSE_ORJSON", True)
+# Output rate per channel label ("label=Hz,..."); server_mbs low-pass
+# decimates these channels and sends each rate as its own tier (frames with
+# their own dt and seq). Unlisted channels go at the board rate. The
+# anti-alias cutoff is DECIMATE_CUTOFF of the output Nyquist frequency.
+# MYOMETER at 5 Hz (2 Hz passband) keeps the slow channels' bytes >95% below
+# full rate; at 10 Hz the frame headers keep it just below 95%.
+CHANNEL_RATES = {
+    label: float(hz) for label, _, hz in (
+        item.partition("=") for item in env_str(
+            "BIOPULSE_CHANNEL_RATES", "TEMPERATURE=1,NIBP=1,OXYGEN=1,MYOMETER=5").split(",") if item)
+}
+DECIMATE_CUTOFF = env_float("BIOPULSE_DECIMATE_CUTOFF", 0.8)
+# Change-only channels ("label=tolerance,...", physical units): server_mbs
+# sends a sample only when it moves more than the tolerance from the last
+# value sent, plus a keyframe every DEADBAND_KEYFRAME_S. Off by default: no
+# MBS channel has a real calibration fit yet, so values are microvolts and
+# sensor noise alone exceeds any tolerance meant for degC or %SpO2. Set a
+# tolerance only for a fitted channel, sized from recorded data.
+CHANNEL_DEADBAND = {
+    label: float(tol) for label, _, tol in (
+        item.partition("=") for item in env_str(
+            "BIOPULSE_CHANNEL_DEADBAND", "").split(",") if item)
+}
+DEADBAND_KEYFRAME_S = env_float("BIOPULSE_DEADBAND_KEYFRAME", 5.0)
+
+# --- Display normalization ---
+# Sliding window (seconds) for the min/max scale, and how fast the scale
+# shrinks back after an extreme leaves the window (time constant, seconds).
+# NORM_MODE is "window" (sliding min/max) or "decay" (peak-hold envelope).
+NORM_WINDOW_S = env_float("BIOPULSE_NORM_WINDOW", 4.0)
+NORM_RELEASE_S = env_float("BIOPULSE_NORM_RELEASE", 1.0)
+NORM_MODE = env_str("BIOPULSE_NORM_MODE", "window")
+
+# --- EEG band power stream ---
+# Welch window and hop (seconds), number of averaged segments, and the
+# number of bins of the optional decimated spectrum (0 = bands only).
+# The stream is served on the raw stream port + BANDPOWER_PORT_OFFSET.
+BANDPOWER_WINDOW_S = env_float("BIOPULSE_BANDPOWER_WINDOW", 2.0)
+BANDPOWER_HOP_S = env_float("BIOPULSE_BANDPOWER_HOP", 0.5)
+BANDPOWER_SEGMENTS = env_int("BIOPULSE_BANDPOWER_SEGMENTS", 4)
+BANDPOWER_SPECTRUM_BINS = env_int("BIOPULSE_BANDPOWER_SPECTRUM_BINS", 0)
+BANDPOWER_PORT_OFFSET = env_int("BIOPULSE_BANDPOWER_PORT_OFFSET", 1)
+
+# --- ECG beat event stream ---
+# Served on the raw stream port + BEATS_PORT_OFFSET; the detector is fed
+# as soon as the acquisition thread delivers new samples.
+BEATS_PORT_OFFSET = env_int("BIOPULSE_BEATS_PORT_OFFSET", 2)
+
+# --- Signal quality ---
+# Per-channel flags from the raw samples over a sliding window, re-evaluated
+# every QUALITY_HOP_S (quality.py). QUALITY_GATE lists the flags that make
+# the expensive stages (notch, HR estimators, beat detector) skip a channel.
+QUALITY_WINDOW_S = env_float("BIOPULSE_QUALITY_WINDOW", 1.0)
+QUALITY_HOP_S = env_float("BIOPULSE_QUALITY_HOP", 0.25)
+QUALITY_RAIL_FRACTION = env_float("BIOPULSE_QUALITY_RAIL", 0.99)
+QUALITY_FLAT_COUNTS = env_float("BIOPULSE_QUALITY_FLAT", 2.0)
+QUALITY_LINE_RATIO = env_float("BIOPULSE_QUALITY_LINE", 0.5)
+QUALITY_LEADOFF_FRACTION = env_float("BIOPULSE_QUALITY_LEADOFF", 0.9)
+QUALITY_GATE = [f for f in env_str("BIOPULSE_QUALITY_GATE", "railed,flat,lead_off").split(",") if f]
+# Graded 0-1 quality index per channel, published every SQI_PUBLISH_S next
+# to the heart rate. PPG scores full marks from this perfusion (AC/DC) and
+# pulse skewness up.
+SQI_PUBLISH_S = env_float("BIOPULSE_SQI_PUBLISH", 1.0)
+SQI_PPG_PERFUSION = env_float("BIOPULSE_SQI_PPG_PERFUSION", 0.01)
+SQI_PPG_SKEW = env_float("BIOPULSE_SQI_PPG_SKEW", 0.5)
+
+# --- HRV ---
+# Rolling windows (seconds, comma separated) and publish period of the
+# HRV metrics sent next to the heart rate.
+HRV_WINDOWS_S = [float(w) for w in env_str("BIOPULSE_HRV_WINDOWS", "60,300").split(",")]
+HRV_PUBLISH_S = env_float("BIOPULSE_HRV_PUBLISH", 1.0)
+
+# --- Calibration ---
+# Convert samples to physical units (calibration.py) before sending;
+# calibrated values are rounded to CALIBRATED_DECIMALS. Off, server_mbs
+# sends raw ADC counts (RAW_DTYPE) like the recorded sessions hold:
+# microvolts = counts x the channel's LSB (lsb_uv in the history header).
+CALIBRATE = env_bool("BIOPULSE_CALIBRATE", True)
+CALIBRATED_DECIMALS = env_int("BIOPULSE_CALIBRATED_DECIMALS", 3)
+
+# --- Mains rejection ---
+# "auto" detects 50/60 Hz once at startup; MAINS_HARMONICS is the number of
+# harmonics notched on top of the fundamental (below Nyquist).
+MAINS_HZ = env_str("BIOPULSE_MAINS", "auto")
+MAINS_HARMONICS = env_int("BIOPULSE_MAINS_HARMONICS", 2)
+MAINS_QUALITY = env_float("BIOPULSE_MAINS_Q", 30.0)
+
+# --- Send scheduling ---
+# Latency budget per frame (seconds); frames are paced on an absolute clock
+# at this period. Jitter statistics are printed every SCHED_REPORT_S (0 = off).
+SEND_LATENCY_S = env_float("BIOPULSE_SEND_LATENCY", 0.04)
+SCHED_REPORT_S = env_float("BIOPULSE_SCHED_REPORT", 30.0)
+
+# --- Acquisition ---
+# Board polling cadence of the acquisition thread (seconds) and the length
+# of the in-process ring buffer it fills (seconds of all board rows).
+ACQ_POLL_S = env_float("BIOPULSE_ACQ_POLL", 0.01)
+ACQ_RING_S = env_float("BIOPULSE_ACQ_RING", 10.0)
+# A board without new samples for ACQ_STALL_S is reopened (servers and GUI),
+# retrying after RECONNECT_MIN_S, doubling up to RECONNECT_MAX_S.
+ACQ_STALL_S = env_float("BIOPULSE_ACQ_STALL", 1.0)
+RECONNECT_MIN_S = env_float("BIOPULSE_RECONNECT_MIN", 0.5)
+RECONNECT_MAX_S = env_float("BIOPULSE_RECONNECT_MAX", 10.0)
+# Servers stop the board stream once nobody (stream clients, recorder) has
+# subscribed for ACQ_IDLE_GRACE_S and restart it for the next subscriber.
+ACQ_IDLE = env_bool("BIOPULSE_ACQ_IDLE", True)
+ACQ_IDLE_GRACE_S = env_float("BIOPULSE_ACQ_IDLE_GRACE", 5.0)
+
+# --- Multiple boards ---
+# server_multi drives every board in BOARDS ("name=port:profile,...",
+# profile "mbs" or "eeg", port "synthetic" for BrainFlow's synthetic board)
+# and merges them on the first live board's timestamps (multiboard.py). A board
+# silent for MERGE_STALE_S is not waited for; its channels read NaN.
+BOARDS = env_str("BIOPULSE_BOARDS", "boardA=/dev/ttyUSB0:mbs,boardB=/dev/ttyUSB1:eeg")
+MERGE_STALE_S = env_float("BIOPULSE_MERGE_STALE", 0.5)
+
+# --- Annotations ---
+# Events kept in memory per acquisition (markers, board restarts, ...);
+# server_mbs streams them on the raw stream port + ANNOTATION_PORT_OFFSET.
+ANNOTATION_CAPACITY = env_int("BIOPULSE_ANNOTATION_CAPACITY", 10000)
+ANNOTATION_PORT_OFFSET = env_int("BIOPULSE_ANNOTATION_PORT_OFFSET", 3)
+
+# --- Event loop / WebSocket transport ---
+# Run the servers on uvloop when it is installed (set to 0 for stock asyncio).
+USE_UVLOOP = env_bool("BIOPULSE_UVLOOP", True)
+# Passed to websockets.serve: write buffer high-water mark (bytes), incoming
+# message queue length, and per-message compression ("deflate" or "off").
+WS_WRITE_LIMIT = env_int("BIOPULSE_WS_WRITE_LIMIT", 32768)
+WS_MAX_QUEUE = env_int("BIOPULSE_WS_MAX_QUEUE", 16)
+WS_COMPRESSION = env_str("BIOPULSE_WS_COMPRESSION", "deflate")
+
+# --- Startup ---
+# Modules imported on a background thread while the board is being set up,
+# and the number of pre-imported interpreters the controller keeps ready
+# for /run (0 starts a fresh interpreter for every run).
+PRELOAD_MODULES = [m for m in env_str("BIOPULSE_PRELOAD", "scipy.signal").split(",") if m]
+WARM_POOL_SIZE = env_int("BIOPULSE_WARM_POOL", 0)
+
+# --- Sample dtype ---
+# Floating dtype of every sample buffer and filter stage (ring buffer, DSP,
+# display), and the integer dtype of raw ADC counts, sent or stored.
+# float32 halves the memory traffic; timestamps always stay float64.
+SAMPLE_DTYPE = env_str("BIOPULSE_DTYPE", "float32")
+RAW_DTYPE = env_str("BIOPULSE_RAW_DTYPE", "int32")
+
+# --- History / reconnect catch-up ---
+# Seconds of all channels server_mbs keeps in memory. A client connecting
+# with ?since=<seq> or ?last=<seconds> first gets that span as one binary
+# frame, then the live stream continues from the next sample.
+HISTORY_S = env_float("BIOPULSE_HISTORY", 300.0)
+# Min/max/mean pyramid for zoomed-out history (?last=<s>&width=<px>):
+# samples per bin at each level, and the span every level covers (seconds).
+PYRAMID_FACTORS = [int(f) for f in env_str("BIOPULSE_PYRAMID", "8,64,512").split(",")]
+PYRAMID_SPAN_S = env_float("BIOPULSE_PYRAMID_SPAN", 1800.0)
+
+# --- Recording ---
+# server_mbs records every session to RECORD_DIR in chunk files of
+# RECORD_CHUNK_S seconds (see recording.py) when RECORD is on.
+RECORD = env_bool("BIOPULSE_RECORD", False)
+RECORD_DIR = env_str("BIOPULSE_RECORD_DIR", "./Sessions")
+RECORD_CHUNK_S = env_float("BIOPULSE_RECORD_CHUNK", 60.0)
+# Also write the recording live as an EDF+ ("edf", 16 bit) or BDF+ ("bdf",
+# 24 bit) file next to the chunks; "" for chunks only. Recorded sessions
+# can always be exported later (GET /sessions/<name>/export, edf.py).
+RECORD_EDF = env_str("BIOPULSE_RECORD_EDF", "")
+# Physical limit (+/- microvolts) of the biopotential channels (microvolts
+# at PGA gain 24) in 16-bit EDF files. The full ADS1299 input range would
+# cost 5.7 uV per digital step; +/-5 mV keeps 0.15 uV steps and covers
+# ECG/EMG/EEG. Other channels keep the full input range.
+EDF_UV_RANGE = env_float("BIOPULSE_EDF_UV_RANGE", 5000.0)
@@ -0,0 +1,145 @@
+import numpy as np
+
+import settings
+
+# Streaming Welch band power for EEG channels.
+# Samples go into a per-channel circular buffer; every `hop` samples one
+# Hann-windowed segment is transformed with rfft and added to a ring of
+# the last `segments` periodograms (Welch average).
+
+EEG_BANDS = {
+    "delta": (0.5, 4.0),
+    "theta": (4.0, 8.0),
+    "alpha": (8.0, 13.0),
+    "beta": (13.0, 30.0),
+    "gamma": (30.0, 45.0),
+}
+
+
+class BandPowerStream:
+    def __init__(self, n_channels, fs, window, hop, segments=4, bands=EEG_BANDS,
+                 spectrum_bins=0, spectrum_fmax=60.0, dtype=None):
+        self.fs = fs
+        self.dtype = np.dtype(settings.SAMPLE_DTYPE if dtype is None else dtype)
+        self.nperseg = int(window)
+        self.hop = max(1, int(hop))
+        self.bands = dict(bands)
+
+        self.buf = np.zeros((n_channels, self.nperseg), dtype=self.dtype)
+        self.pos = 0
+        self.filled = 0
+        self.since_hop = 0
+
+        # Cached periodic Hann window and one-sided PSD scaling
+        self.window = np.hanning(self.nperseg + 1)[:-1].astype(self.dtype)
+        self.scale = 1.0 / (fs * np.sum(self.window.astype(float) ** 2))
+        self.freqs = np.fft.rfftfreq(self.nperseg, 1.0 / fs)
+        self.df = self.freqs[1] - self.freqs[0]
+        self.band_slices = [
+            slice(int(np.searchsorted(self.freqs, lo)), int(np.searchsorted(self.freqs, hi)))
+            for lo, hi in self.bands.values()
+        ]
+
+        self.psd_ring = np.zeros((segments, n_channels, len(self.freqs)))
+        self.n_segments = 0
+        self.seg_slot = 0
+
+        # Decimated spectrum: group bins up to fmax into `spectrum_bins` groups
+        self.spectrum_edges = None
+        if spectrum_bins:
+            top = int(np.searchsorted(self.freqs, spectrum_fmax, side="right"))
+            edges = np.linspace(0, top, min(spectrum_bins, top) + 1).astype(int)
+            self.spectrum_edges = np.unique(edges)[:-1]
+            self.spectrum_top = top
+            self.spectrum_freqs = np.add.reduceat(self.freqs[:top], self.spectrum_edges) / np.diff(
+                np.append(self.spectrum_edges, top))
+
+    def _write(self, x):
+        n = x.shape[1]
+        if n >= self.nperseg:
+            self.buf[:] = x[:, -self.nperseg:]
+            self.pos = 0
+        else:
+            end = self.pos + n
+            if end <= self.nperseg:
+                self.buf[:, self.pos:end] = x
+            else:
+                first = self.nperseg - self.pos
+                self.buf[:, self.pos:] = x[:, :first]
+                self.buf[:, :n - first] = x[:, first:]
+            self.pos = end % self.nperseg
+        self.filled = min(self.nperseg, self.filled + n)
+
+    def _segment(self):
+        seg = np.concatenate((self.buf[:, self.pos:], self.buf[:, :self.pos]), axis=1)
+        seg -= seg.mean(axis=1, keepdims=True)
+        seg *= self.window
+        spec = np.fft.rfft(seg, axis=1)
+        psd = (spec.real ** 2 + spec.imag ** 2) * self.scale
+        # One-sided: double all but DC, and Nyquist when nperseg is even
+        psd[:, 1:psd.shape[1] - (self.nperseg % 2 == 0)] *= 2.0
+        self.psd_ring[self.seg_slot] = psd
+        self.seg_slot = (self.seg_slot + 1) % len(self.psd_ring)
+        self.n_segments = min(len(self.psd_ring), self.n_segments + 1)
+
+    def update(self, x):
+        """Feed new samples (channels x n). Returns True when a new estimate is ready."""
+        x = np.atleast_2d(x)
+        ready = False
+        # Split at hop boundaries so every segment ends on the right sample
+        while x.shape[1]:
+            take = min(self.hop - self.since_hop, x.shape[1])
+            self._write(x[:, :take])
+            x = x[:, take:]
+            self.since_hop += take
+            if self.since_hop == self.hop:
+                self.since_hop = 0
+                if self.filled == self.nperseg:
+                    self._segment()
+                    ready = True
+        return ready
+
+    def psd(self):
+        return self.psd_ring[:self.n_segments].mean(axis=0)
+
+    def band_powers(self, psd=None):
+        """Absolute band power per channel, shape (channels, bands)."""
+        psd = self.psd() if psd is None else psd
+        return np.stack([psd[:, s].sum(axis=1) * self.df for s in self.band_slices], axis=1)
+
+    def spectrum(self, psd=None):
+        """Decimated PSD per channel, or None when disabled."""
+        if self.spectrum_edges is None:
+            return None
+        psd = self.psd() if psd is None else psd
+        sums = np.add.reduceat(psd[:, :self.spectrum_top], self.spectrum_edges, axis=1)
+        return sums / np.diff(np.append(self.spectrum_edges, self.spectrum_top))
+
+    def frame(self, labels, t, seq):
+        """Low-rate payload for the band power stream."""
+        psd = self.psd()
+        powers = self.band_powers(psd)
+        frame = {
+            "type": "bandpower",
+            "t": t,
+            "seq": int(seq),
+            "bands": list(self.bands),
+            "power": {label: powers[i] for i, label in enumerate(labels)},
+        }
+        spectrum = self.spectrum(psd)
+        if spectrum is not None:
+            frame["spectrum"] = {
+                "f": self.spectrum_freqs,
+                "psd": {label: spectrum[i] for i, label in enumerate(labels)},
+            }
+        return frame
+
+
+def make_bandpower(n_channels, fs):
+    return BandPowerStream(
+        n_channels, fs,
+        window=int(settings.BANDPOWER_WINDOW_S * fs),
+        hop=int(settings.BANDPOWER_HOP_S * fs),
+        segments=settings.BANDPOWER_SEGMENTS,
+        spectrum_bins=settings.BANDPOWER_SPECTRUM_BINS,
+    )
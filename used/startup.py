@@ -0,0 +1,61 @@
+import importlib
+import threading
+import time
+
+import settings
+
+# Startup timing and import warm-up for the servers.
+# Import this module first: the clock starts here. Each server marks the end
+# of its startup phases and prints one report once it is listening; the
+# first frame sent to a client is reported separately.
+
+_t0 = time.perf_counter()
+_last = _t0
+_phases = []
+_first_frame = False
+
+
+def reset():
+    """Restart the clock (a pre-warmed interpreter that just got its script)."""
+    global _t0, _last, _first_frame
+    _t0 = _last = time.perf_counter()
+    _phases.clear()
+    _first_frame = False
+
+
+def mark(name):
+    """End of a startup phase; its duration is the time since the last mark."""
+    global _last
+    now = time.perf_counter()
+    _phases.append((name, now - _last))
+    _last = now
+
+
+def report():
+    phases = " | ".join(f"{name} {sec:.2f}s" for name, sec in _phases)
+    print(f"⏱️ startup: {phases} (total {_last - _t0:.2f}s)")
+
+
+def first_frame():
+    """Call after each send; prints the time to the first frame once."""
+    global _first_frame
+    if _first_frame:
+        return
+    _first_frame = True
+    print(f"⏱️ first frame {time.perf_counter() - _t0:.2f}s after start")
+
+
+def preload(modules=None):
+    """Import heavy modules on a background thread, e.g. during board setup."""
+    modules = settings.PRELOAD_MODULES if modules is None else modules
+
+    def run():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                print("⚠️ preload failed:", e)
+
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,262 @@
+from functools import lru_cache
+
+import numpy as np
+
+import settings
+
+# Streaming DSP stages shared by the servers and the GUI.
+# Each stage keeps its own state and is fed only the new samples of a
+# block (shape: channels x samples), so the per-frame cost is O(new samples).
+# SciPy is imported on first use: it dominates interpreter startup on the Pi.
+
+
+# --- Sliding-window normalization ---
+class StreamingNormalizer:
+    """Per-channel [0, 1] scaling from a sliding min/max with smooth release.
+
+    mode="window": min/max over the last `window` samples, tracked as a ring
+    of per-block extremes (the block-level form of a monotonic deque, so all
+    channels update in one vectorized step).
+    mode="decay":  peak-hold envelope that decays towards each new block.
+
+    A new extreme widens the scale immediately; when an old extreme leaves
+    the window the scale shrinks with time constant `release` (samples)
+    instead of jumping.
+    """
+
+    def __init__(self, n_channels, window, block=25, release=250, mode="window"):
+        self.mode = mode
+        self.block = max(1, int(block))
+        self.n_blocks = max(1, int(np.ceil(window / self.block)))
+        self.release = float(release)
+
+        self.block_min = np.full((n_channels, self.n_blocks), np.inf)
+        self.block_max = np.full((n_channels, self.n_blocks), -np.inf)
+        self.slot = 0
+        self.fill = 0
+
+        self.lo = None
+        self.hi = None
+
+    def _push(self, x):
+        # Split the new samples along the current partial block boundary
+        pos = 0
+        n = x.shape[1]
+        while pos < n:
+            take = min(self.block - self.fill, n - pos)
+            part = x[:, pos:pos + take]
+            if self.fill == 0:
+                self.block_min[:, self.slot] = part.min(axis=1)
+                self.block_max[:, self.slot] = part.max(axis=1)
+            else:
+                np.minimum(self.block_min[:, self.slot], part.min(axis=1), out=self.block_min[:, self.slot])
+                np.maximum(self.block_max[:, self.slot], part.max(axis=1), out=self.block_max[:, self.slot])
+            self.fill += take
+            pos += take
+            if self.fill == self.block:
+                self.fill = 0
+                self.slot = (self.slot + 1) % self.n_blocks
+                # Clear the slot that starts the next block (oldest block drops out)
+                self.block_min[:, self.slot] = np.inf
+                self.block_max[:, self.slot] = -np.inf
+
+    def update(self, x):
+        """Feed new samples (channels x n) and return the current lo/hi scale."""
+        x = np.atleast_2d(x)
+        n = x.shape[1]
+        if n == 0:
+            return self.lo, self.hi
+
+        if self.mode == "decay":
+            target_lo = x.min(axis=1)
+            target_hi = x.max(axis=1)
+        else:
+            self._push(x)
+            target_lo = self.block_min.min(axis=1)
+            target_hi = self.block_max.max(axis=1)
+
+        if self.lo is None:
+            self.lo = target_lo.astype(float)
+            self.hi = target_hi.astype(float)
+            return self.lo, self.hi
+
+        alpha = 1.0 - np.exp(-n / self.release) if self.release > 0 else 1.0
+        # Expand immediately, shrink smoothly
+        self.lo = np.where(target_lo < self.lo, target_lo, self.lo + (target_lo - self.lo) * alpha)
+        self.hi = np.where(target_hi > self.hi, target_hi, self.hi + (target_hi - self.hi) * alpha)
+        return self.lo, self.hi
+
+    def apply(self, x):
+        """Scale samples to [0, 1] with the current lo/hi (zeros when flat)."""
+        x = np.atleast_2d(x)
+        dtype = np.result_type(x.dtype, np.float32)
+        if self.lo is None:
+            return np.zeros_like(x, dtype=dtype)
+        span = (self.hi - self.lo).astype(dtype)[:, None]
+        out = np.subtract(x, self.lo.astype(dtype)[:, None], dtype=dtype)
+        np.divide(out, span, out=out, where=span > 0)
+        out[np.broadcast_to(span <= 0, out.shape)] = 0.0
+        return np.clip(out, 0.0, 1.0, out=out)
+
+
+def make_normalizer(n_channels, fs):
+    return StreamingNormalizer(
+        n_channels,
+        window=int(settings.NORM_WINDOW_S * fs),
+        block=max(1, int(fs // 10)),
+        release=settings.NORM_RELEASE_S * fs,
+        mode=settings.NORM_MODE,
+    )
+
+
+# --- Mains rejection ---
+def detect_mains(block, fs, candidates=(50.0, 60.0), default=60.0, min_ratio=3.0):
+    """Pick the mains frequency from a few seconds of data (channels x samples).
+
+    Compares the power at each candidate and its harmonics (summed over
+    channels) against the median spectral background; returns `default`
+    when no candidate stands out.
+    """
+    x = np.atleast_2d(np.asarray(block, dtype=float))
+    if x.shape[1] < fs:
+        return default
+    x = x - x.mean(axis=1, keepdims=True)
+    spec = np.abs(np.fft.rfft(x * np.hanning(x.shape[1]), axis=1)) ** 2
+    power = spec.sum(axis=0)
+    freqs = np.fft.rfftfreq(x.shape[1], 1.0 / fs)
+    background = np.median(power[freqs > 1.0]) or 1e-12
+
+    scores = {}
+    for f in candidates:
+        harmonics = np.arange(f, fs / 2, f)
+        near = np.zeros_like(freqs, dtype=bool)
+        for h in harmonics:
+            near |= np.abs(freqs - h) <= 0.5
+        scores[f] = power[near].max() / background if near.any() else 0.0
+    best = max(scores, key=scores.get)
+    return best if scores[best] >= min_ratio else default
+
+
+@lru_cache(maxsize=8)
+def mains_sos(fs, mains, harmonics, quality):
+    """One SOS cascade notching the fundamental and the first N harmonics."""
+    from scipy.signal import iirnotch, tf2sos
+
+    sections = []
+    for k in range(1, harmonics + 2):
+        f = k * mains
+        if f >= fs / 2:
+            break
+        b, a = iirnotch(f, quality, fs=fs)
+        sections.append(tf2sos(b, a))
+    return np.vstack(sections)
+
+
+class MainsNotch:
+    """Streaming comb notch: one sosfilt pass per block over all channels."""
+
+    def __init__(self, n_channels, fs, mains, harmonics=2, quality=30.0, dtype=None):
+        self.mains = mains
+        self.dtype = np.dtype(settings.SAMPLE_DTYPE if dtype is None else dtype)
+        # sosfilt runs in the common dtype of sos and x; keep both in self.dtype
+        self.sos = mains_sos(fs, float(mains), int(harmonics), float(quality)).astype(self.dtype)
+        self.n_channels = n_channels
+        self.zi = None
+
+    def process(self, x, active=None):
+        """Filter a block; channels where `active` is False pass through unfiltered."""
+        from scipy.signal import sosfilt, sosfilt_zi
+
+        x = np.atleast_2d(np.asarray(x, dtype=self.dtype))
+        if x.shape[1] == 0:
+            return x
+        if self.zi is None:
+            # Start from steady state at the first sample to avoid a step transient
+            base = sosfilt_zi(self.sos)
+            self.zi = (base[:, None, :] * x[:, 0][None, :, None]).astype(self.dtype)
+        if active is None or active.all():
+            y, self.zi = sosfilt(self.sos, x, axis=1, zi=self.zi)
+            return y
+        # Skipped channels keep their state and resume from it
+        y = x.copy()
+        if active.any():
+            y[active], self.zi[:, active] = sosfilt(self.sos, x[active], axis=1, zi=self.zi[:, active])
+        return y
+
+
+def make_mains_notch(n_channels, fs, mains):
+    return MainsNotch(n_channels, fs, mains, settings.MAINS_HARMONICS, settings.MAINS_QUALITY)
+
+
+def resolve_mains(block, fs):
+    """Mains frequency from settings, or detected from `block` when set to auto."""
+    if settings.MAINS_HZ != "auto":
+        return float(settings.MAINS_HZ)
+    return detect_mains(block, fs)
+
+
+# --- Band-pass ---
+@lru_cache(maxsize=16)
+def bandpass_sos(fs, low, high, order):
+    from scipy.signal import butter
+
+    return butter(order, [low, high], btype="band", fs=fs, output="sos")
+
+
+class Bandpass:
+    """Streaming Butterworth band-pass; filter state is carried across blocks."""
+
+    def __init__(self, n_channels, fs, low, high, order=2):
+        self.sos = bandpass_sos(float(fs), float(low), float(high), int(order))
+        self.n_channels = n_channels
+        self.zi = None
+
+    def process(self, x):
+        from scipy.signal import sosfilt, sosfilt_zi
+
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        if x.shape[1] == 0:
+            return x
+        if self.zi is None:
+            self.zi = sosfilt_zi(self.sos)[:, None, :] * x[:, 0][None, :, None]
+        y, self.zi = sosfilt(self.sos, x, axis=1, zi=self.zi)
+        return y
+
+
+# --- Rate reduction ---
+@lru_cache(maxsize=8)
+def lowpass_sos(fs, cutoff, order):
+    from scipy.signal import butter
+
+    return butter(order, cutoff, fs=fs, output="sos")
+
+
+class Decimator:
+    """Streaming anti-alias low-pass and decimation by an integer factor.
+
+    Output samples are the filtered board samples whose absolute index is a
+    multiple of `factor`, so the output grid does not depend on how the
+    input is split into blocks.
+    """
+
+    def __init__(self, n_channels, fs, factor, order=4, cutoff=None):
+        cutoff = settings.DECIMATE_CUTOFF if cutoff is None else cutoff
+        self.factor = int(factor)
+        # Kept at float64: with the cutoff at ~0.1% of fs float32 sections are unstable
+        self.sos = lowpass_sos(fs, cutoff * fs / (2 * self.factor), int(order))
+        self.n_channels = n_channels
+        self.zi = None
+
+    def process(self, x, seq):
+        """(absolute index of the first output sample, output block) for input starting at sample `seq`."""
+        from scipy.signal import sosfilt, sosfilt_zi
+
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        first = (-seq) % self.factor
+        if x.shape[1] == 0:
+            return seq + first, x
+        if self.zi is None:
+            # Steady state at the first sample, as in MainsNotch
+            self.zi = sosfilt_zi(self.sos)[:, None, :] * x[:, 0][None, :, None]
+        y, self.zi = sosfilt(self.sos, x, axis=1, zi=self.zi)
+        return seq + first, y[:, first::self.factor]
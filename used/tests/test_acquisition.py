@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+import pytest
+from brainflow.board_shim import BoardIds, BoardShim
+
+import settings
+from acquisition import Acquisition, RingBuffer, RingReader
+
+BOARD_ID = BoardIds.SYNTHETIC_BOARD.value
+ROWS = BoardShim.get_num_rows(BOARD_ID)
+TS_ROW = BoardShim.get_timestamp_channel(BOARD_ID)
+
+
+class FakeBoard:
+    """get_board_data() returns 5 samples per call while `live`, else nothing."""
+
+    def __init__(self, live=True):
+        self.live = live
+        self.released = False
+
+    def get_board_data(self):
+        if not self.live:
+            return np.zeros((ROWS, 0))
+        data = np.zeros((ROWS, 5))
+        data[TS_ROW] = time.time() + np.arange(5) / 250
+        return data
+
+    def start_stream(self):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def release_session(self):
+        self.released = True
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def fast_reconnect(monkeypatch):
+    monkeypatch.setattr(settings, "ACQ_STALL_S", 0.2)
+    monkeypatch.setattr(settings, "RECONNECT_MIN_S", 0.05)
+    monkeypatch.setattr(settings, "RECONNECT_MAX_S", 0.2)
+
+
+def test_ring_reader_counts_overruns():
+    ring = RingBuffer(2, 10, None)
+    reader = RingReader(ring)
+    ring.write(np.ones((2, 25)))
+    seq, block = reader.read()
+    assert (seq, block.shape[1]) == (15, 10)
+    assert reader.overruns == 1
+
+
+def test_stalled_board_is_reopened_and_gap_annotated(fast_reconnect):
+    first = FakeBoard()
+    opened = []
+
+    def reopen():
+        # Two silent sessions before one that delivers
+        board = FakeBoard(live=len(opened) >= 2)
+        opened.append(board)
+        return board
+
+    acq = Acquisition(first, BOARD_ID, poll_s=0.01, reopen=reopen)
+    acq.start()
+    try:
+        assert wait_for(lambda: acq.ring.seq > 20)
+        first.live = False
+        assert wait_for(lambda: acq.reconnects == 1)
+        kinds = [e["kind"] for e in acq.annotations.range(0)]
+        assert kinds == ["board_lost", "gap"]
+        gap = acq.gaps(0, acq.ring.seq)[0]
+        assert gap["attempts"] == 3 and gap["duration"] > 0
+        # Every dropped session was released, the live one is in use
+        assert first.released and all(b.released for b in opened[:2])
+        assert acq.board is opened[2] and acq.connected
+    finally:
+        acq.stop()
+
+
+def test_reconnect_request_is_ignored_while_lost(fast_reconnect):
+    opened = []
+
+    def reopen():
+        board = FakeBoard(live=False)
+        opened.append(board)
+        return board
+
+    acq = Acquisition(FakeBoard(live=False), BOARD_ID, poll_s=0.01, reopen=reopen)
+    acq.start()
+    try:
+        assert wait_for(lambda: not acq.connected)
+        acq.reconnect()
+        assert not acq._force_reconnect
+    finally:
+        acq.stop()
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from beats import HrvTracker, StreamingPanTompkins
+
+FS = 250
+
+
+def synthetic_ecg(beat_times, duration, fs=FS, noise_uv=5.0, seed=0):
+    """Narrow QRS-like pulses (1 mV) at `beat_times` on white noise."""
+    t = np.arange(int(duration * fs)) / fs
+    x = np.zeros_like(t)
+    x[(np.asarray(beat_times) * fs).astype(int)] = 1000.0
+    x = np.convolve(x, np.hanning(9), mode="same")
+    return t, x + np.random.default_rng(seed).normal(0.0, noise_uv, len(t))
+
+
+def run(detector, t, x, block=25):
+    events = []
+    for k in range(0, len(t), block):
+        events += detector.update(x[k:k + block], t[k:k + block])
+    return events
+
+
+def test_detects_every_beat_at_75_bpm():
+    beats = np.arange(0.5, 30.0, 0.8)
+    t, x = synthetic_ecg(beats, 30.0)
+    events = run(StreamingPanTompkins(FS), t, x)
+    found = np.array([e["t"] for e in events])
+    # Everything after the 2 s learning phase, within one QRS width
+    expected = beats[beats > 2.5]
+    assert len(found) >= len(expected)
+    assert np.all(np.min(np.abs(found[:, None] - expected[None, :]), axis=0) < 0.04)
+
+
+def test_heart_rate_independent_of_block_size():
+    t, x = synthetic_ecg(np.arange(0.5, 20.0, 0.8), 20.0)
+    rates = set()
+    for block in (1, 7, 25, 250):
+        detector = StreamingPanTompkins(FS)
+        run(detector, t, x, block)
+        rates.add(detector.heart_rate())
+    assert rates == {75}
+
+
+def test_search_back_recovers_a_weak_beat():
+    beats = np.arange(0.5, 20.0, 0.8)
+    t, x = synthetic_ecg(beats, 20.0)
+    weak = beats[15]
+    i = int(weak * FS)
+    x[i - 10:i + 10] *= 0.4      # under threshold 1, above half of it
+    events = run(StreamingPanTompkins(FS), t, x)
+    found = np.array([e["t"] for e in events])
+    assert np.min(np.abs(found - weak)) < 0.04
+
+
+def test_long_intervals_are_not_rr():
+    # A 4 s pause (no beats) must not give a 15 bpm interval
+    beats = np.concatenate((np.arange(0.5, 10.0, 0.8), np.arange(14.1, 24.0, 0.8)))
+    t, x = synthetic_ecg(beats, 24.0)
+    detector = StreamingPanTompkins(FS)
+    events = run(detector, t, x)
+    rrs = [e["rr"] for e in events if e["rr"] is not None]
+    assert max(rrs) <= detector.max_rr
+    assert detector.heart_rate() == 75
+
+
+def test_quality_decays_without_beats():
+    t, x = synthetic_ecg(np.arange(0.5, 15.0, 0.8), 15.0)
+    detector = StreamingPanTompkins(FS)
+    run(detector, t, x)
+    assert detector.quality() > 0.9
+    quiet = np.zeros(4 * FS)
+    run(detector, t[-1] + np.arange(1, len(quiet) + 1) / FS, quiet)
+    assert detector.quality() == 0.0
+
+
+def reference_hrv(rr_ms):
+    d = np.diff(rr_ms)
+    return np.std(rr_ms, ddof=1), np.sqrt(np.mean(d ** 2)), 100.0 * np.mean(np.abs(d) > 50.0)
+
+
+def test_hrv_matches_batch_formulas():
+    rng = np.random.default_rng(1)
+    rr = 0.8 + rng.normal(0.0, 0.05, 200)
+    t = np.cumsum(rr)
+    tracker = HrvTracker(window_s=60.0)
+    for ti, r in zip(t, rr):
+        tracker.add(ti, r)
+    m = tracker.metrics(t[-1])
+    window = rr[t >= t[-1] - 60.0] * 1000.0
+    sdnn, rmssd, pnn50 = reference_hrv(window)
+    assert m["n"] == len(window)
+    assert m["sdnn"] == pytest.approx(sdnn, abs=0.01)
+    assert m["rmssd"] == pytest.approx(rmssd, abs=0.01)
+    assert m["pnn50"] == pytest.approx(pnn50, abs=0.01)
+
+
+def test_hrv_expires_old_beats():
+    tracker = HrvTracker(window_s=10.0)
+    for k in range(40):
+        tracker.add(k * 0.8, 0.8)
+    tracker.add(40 * 0.8, 1.2)
+    assert tracker.metrics(32.0)["n"] == 13
+    m = tracker.metrics(32.0 + 9.5)
+    assert m["n"] == 1 and m["sdnn"] is None
+
+
+def test_hrv_differences_skip_rejected_intervals():
+    tracker = HrvTracker(window_s=60.0)
+    for k, rr in enumerate([0.8, 0.9, None, 0.7, 0.8, 3.0, 0.6]):
+        tracker.add(k, rr)
+    # Accepted pairs: 0.8->0.9 and 0.7->0.8; 0.9->0.7 and 0.8->0.6 span a rejection
+    m = tracker.metrics()
+    assert m["n"] == 5
+    assert m["rmssd"] == pytest.approx(100.0)
+    assert m["pnn50"] == pytest.approx(100.0)
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+import settings
+from multiboard import BoardNode, MultiAcquisition
+
+FS = 250
+BLOCK = 25
+
+
+class Feed:
+    """Drives BoardNode.pull/stale with synthetic blocks instead of a board."""
+
+    def __init__(self, node, value, offset=0.0):
+        self.node = node
+        self.value = value
+        self.offset = offset     # timestamp offset against the host clock (s)
+        self.step = 1            # host samples per board sample
+        self.next = 0            # host sample index of the next block
+        self.alive = True
+        node.pull = self.pull
+        node.stale = lambda now: not self.alive
+
+    def pull(self):
+        if not self.alive:
+            return
+        # One block of host time per pull, whatever the board's rate
+        n = BLOCK // self.step
+        ts = (self.next + self.step * np.arange(n)) / FS + self.offset
+        self.next += self.step * n
+        node = self.node
+        node.pend = np.concatenate((node.pend, np.full((len(node.channels), n), self.value)), axis=1)
+        node.pend_ts = np.concatenate((node.pend_ts, ts))
+
+
+@pytest.fixture
+def boards():
+    a, b = BoardNode("A", "synthetic"), BoardNode("B", "synthetic")
+    merged = MultiAcquisition([a, b])
+    return merged, Feed(a, 1.0), Feed(b, 2.0, offset=0.001)
+
+
+def merged_rows(merged, n):
+    _, block = merged.ring.latest(n)
+    a = block[0]
+    b = block[len(merged.nodes[0].channels)]
+    return a, b, block[merged.timestamp_row]
+
+
+def run(merged, steps):
+    for _ in range(steps):
+        merged.merge()
+
+
+def test_live_boards_are_aligned(boards):
+    merged, fa, fb = boards
+    run(merged, 20)
+    assert merged.ring.seq >= 19 * BLOCK
+    a, b, t = merged_rows(merged, merged.ring.seq)
+    assert np.all(a == 1.0) and np.all(b == 2.0)
+    assert np.all(np.diff(t) > 0)
+    assert merged.nodes[1].offset_ms == pytest.approx(1.0, abs=0.01)
+
+
+def test_stale_first_board_does_not_stop_the_merge(boards):
+    merged, fa, fb = boards
+    run(merged, 10)
+    before = merged.ring.seq
+    fa.alive = False
+    run(merged, 10)
+    assert merged.ring.seq - before >= 9 * BLOCK
+    a, b, _ = merged_rows(merged, 5 * BLOCK)
+    assert np.all(np.isnan(a)) and np.all(b == 2.0)
+    # Back on the host clock: the first board drives again, time keeps increasing
+    fa.alive, fa.next = True, fb.next
+    run(merged, 10)
+    a, b, _ = merged_rows(merged, 5 * BLOCK)
+    assert np.all(a == 1.0) and np.all(b == 2.0)
+    _, times = merged.ring.read_times(0, merged.ring.seq)
+    assert np.all(np.diff(times) > 0)
+
+
+def test_matches_further_than_one_sample_are_nan(boards):
+    merged, fa, fb = boards
+    fb.step = 5                        # board B at a fifth of the rate
+    run(merged, 80)
+    _, b, _ = merged_rows(merged, 8 * BLOCK)
+    # B sits 0.25 period after every fifth master sample: only that sample
+    # and the next are within one period, the other three are NaN
+    assert np.isnan(b).sum() == pytest.approx(len(b) * 3 / 5, abs=2)
+    assert np.all(b[~np.isnan(b)] == 2.0)
+    assert merged.nodes[1].filled > 0
+
+
+def test_pending_samples_stay_bounded(boards):
+    merged, fa, fb = boards
+    fb.offset = 5.0                     # board B 5 s ahead of A
+    run(merged, 100)
+    cap = int(settings.MERGE_STALE_S * FS) + 1
+    assert len(merged.nodes[1].pend_ts) <= cap + BLOCK
+    assert len(merged.nodes[0].pend_ts) <= cap + BLOCK
+    # A still drives; B's samples are never within a sample period
+    _, b, _ = merged_rows(merged, 10 * BLOCK)
+    assert np.all(np.isnan(b))
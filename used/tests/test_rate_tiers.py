@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from payload import ChangeOnly, RateTiers
+from stream_dsp import Decimator
+
+FS = 250
+
+
+def blocks(x, sizes, start=0):
+    pos = 0
+    for size in sizes:
+        yield start + pos, x[:, pos:pos + size]
+        pos += size
+
+
+def decimate_in_blocks(x, factor, sizes, start=0):
+    decimator = Decimator(x.shape[0], FS, factor)
+    firsts, outs = [], []
+    for seq, block in blocks(x, sizes, start):
+        first, y = decimator.process(block, seq)
+        if y.shape[1]:
+            firsts.append(first)
+            outs.append(y)
+    return firsts, np.concatenate(outs, axis=1)
+
+
+def test_decimator_grid_does_not_depend_on_block_split():
+    x = np.random.default_rng(0).normal(size=(2, 2000))
+    ref_first, ref = decimate_in_blocks(x, 25, [2000], start=7)
+    for sizes in ([1] * 2000, [13] * 153 + [11], [250] * 8, [24, 26] * 40):
+        firsts, y = decimate_in_blocks(x, 25, sizes, start=7)
+        np.testing.assert_allclose(y, ref, rtol=1e-10, atol=1e-12)
+        # Output samples sit on absolute indices that are multiples of the factor
+        assert all(f % 25 == 0 for f in firsts)
+        assert firsts[0] == ref_first[0] == 25
+
+
+def test_decimator_starts_in_steady_state_and_removes_hum():
+    t = np.arange(10 * FS) / FS
+    x = np.vstack((36.6 + 0.5 * np.sin(2 * np.pi * 50.0 * t),))
+    _, y = decimate_in_blocks(x, 250, [25] * 100)
+    np.testing.assert_allclose(y[0], 36.6, atol=5e-3)
+
+
+def test_rate_tiers_seq_and_dt():
+    labels = ["ECG", "TEMPERATURE", "MYOMETER"]
+    tiers = RateTiers(labels, FS, {"TEMPERATURE": 1, "MYOMETER": 5})
+    x = np.random.default_rng(1).normal(size=(3, 3 * FS)).astype(np.float32)
+    frames = []
+    for seq, block in blocks(x, [10] * 75, start=1000):
+        t_last = (seq + block.shape[1] - 1) / FS
+        frames.append(tiers.build(block, t_last, seq))
+    assert all("ECG" in f for f in frames)
+    ecg = np.concatenate([f["ECG"]["y"] for f in frames])
+    np.testing.assert_array_equal(ecg, x[0])
+
+    temp = [f["TEMPERATURE"] for f in frames if "TEMPERATURE" in f]
+    myo = [f["MYOMETER"] for f in frames if "MYOMETER" in f]
+    assert [t["seq"] for t in temp] == [4, 5, 6]           # board samples 1000, 1250, 1500
+    assert [m["seq"] for m in myo] == list(range(20, 35))  # every 50 board samples
+    for frame, factor in ((temp[0], 250), (myo[0], 50)):
+        assert frame["dt"] == pytest.approx(factor / FS)
+        # t0 is the board time of the tier sample
+        assert frame["t0"] == pytest.approx(frame["seq"] * factor / FS)
+
+
+def test_change_only_keeps_changes_and_keyframes():
+    change = ChangeOnly({"T": 0.5}, keyframe_s=5.0)
+    frame = {"T": {"t0": 0.0, "dt": 1.0, "seq": 0, "y": np.array([1.0, 1.2, 1.9, 1.8])}}
+    out = change.apply(frame, now=0.0)["T"]
+    assert out["i"] == [0, 2, 3] and out["key"]
+    out = change.apply({"T": dict(frame["T"], y=np.array([1.9, 2.0]))}, now=1.0)
+    assert "T" not in out
+    out = change.apply({"T": dict(frame["T"], y=np.array([2.0]))}, now=6.0)["T"]
+    assert out["i"] == [0] and out["key"]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from calibration import MBS_BOARD_CONFIG, Calibration
+from recording import SessionReader, SessionWriter, decimate
+
+FS = 250
+LABELS = ["ECG", "PPG"]
+CHANNELS = [1, 2]
+
+
+@pytest.fixture
+def session(tmp_path):
+    """12 s at 250 Hz in 5 s chunks (two closed, one open), t0 = 1000 s."""
+    calibration = Calibration(LABELS, CHANNELS, config=MBS_BOARD_CONFIG)
+    writer = SessionWriter(str(tmp_path), LABELS, CHANNELS, FS, config=MBS_BOARD_CONFIG, name="s", chunk_s=5)
+    n = 12 * FS
+    uv = np.vstack((np.arange(n) * calibration.lsb_uv[0], -np.arange(n) * calibration.lsb_uv[1]))
+    ts = 1000.0 + np.arange(n) / FS
+    for k in range(0, n, 37):   # block size unrelated to the chunk size
+        writer.write(k, calibration.to_counts(uv[:, k:k + 37]), ts[k:k + 37])
+    return writer, uv, ts
+
+
+def test_chunk_index_and_live_chunk(session):
+    writer, _, ts = session
+    reader = SessionReader(writer.path)
+    assert [(c["seq"], c["n"]) for c in reader.chunks] == [(0, 1250), (1250, 1250), (2500, 500)]
+    assert reader.t0 == ts[0]
+    assert reader.n_samples == len(ts)
+    assert reader.summary()["live"]
+
+
+def test_range_query_spans_chunks(session):
+    writer, uv, ts = session
+    writer.close()
+    reader = SessionReader(writer.path)
+    assert not reader.summary()["live"]
+    t_start, t_end = 1004.0, 1011.0
+    blocks = list(reader.calibrated(t_start, t_end))
+    assert len(blocks) == 3
+    data = np.concatenate([b for b, _ in blocks], axis=1)
+    times = np.concatenate([t for _, t in blocks])
+    mask = (ts >= t_start) & (ts < t_end)
+    assert reader.count(t_start, t_end) == mask.sum()
+    np.testing.assert_array_equal(times, ts[mask])
+    # int32 counts back to physical units (PPG is inverted)
+    expected = Calibration(LABELS, CHANNELS, config=MBS_BOARD_CONFIG).apply(uv[:, mask], dtype=float)
+    np.testing.assert_allclose(data, expected, atol=1e-3)
+
+
+def test_channel_selection_and_empty_range(session):
+    writer, uv, ts = session
+    reader = SessionReader(writer.path)
+    (block, _), = reader.read(1000.0, 1001.0, channels=["PPG"])
+    assert block.shape == (FS, 1)
+    assert reader.count(2000.0, 2001.0) == 0
+    assert list(reader.read(2000.0, 2001.0)) == []
+
+
+def test_decimate_over_chunks(session):
+    writer, uv, ts = session
+    reader = SessionReader(writer.path)
+    lo, hi, mean, t0 = decimate(reader.calibrated(1000.0, 1012.0), 100)
+    assert t0 == 1000.0
+    assert lo.shape == (2, 30)
+    np.testing.assert_allclose(lo[0], uv[0, ::100], atol=1e-3)
+    np.testing.assert_allclose(hi[0], uv[0, 99::100], atol=1e-3)
+
+
+def test_same_second_sessions_get_unique_names(tmp_path):
+    first = SessionWriter(str(tmp_path), LABELS, CHANNELS, FS, name="MBS_x")
+    second = SessionWriter(str(tmp_path), LABELS, CHANNELS, FS, name="MBS_x")
+    assert (first.name, second.name) == ("MBS_x", "MBS_x_1")
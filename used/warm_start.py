@@ -0,0 +1,39 @@
+import startup  # clock is restarted when the script arrives
+import importlib
+import os
+import runpy
+import sys
+
+import settings
+
+# Pre-imported interpreter for the controller's warm pool.
+# Imports the heavy third-party and shared modules up front, then blocks
+# until server_controller.py writes a script path on stdin and runs that
+# script as __main__ in this process, skipping the import phase.
+
+WARM_MODULES = [
+    "numpy", "websockets", "brainflow.board_shim", "orjson",
+    "payload", "acquisition", "calibration", "scheduler", "runtime",
+    "spectral", "stream_dsp", "beats",
+]
+
+
+def main():
+    for name in WARM_MODULES + settings.PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    line = sys.stdin.readline().strip()
+    if not line:
+        return  # pool closed by the controller
+    script = os.path.abspath(line)
+    sys.argv = [script]
+    sys.path.insert(0, os.path.dirname(script))
+    startup.reset()
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == '__main__':
+    main()